@@ -3,11 +3,18 @@ from fastapi import APIRouter, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
 from typing import Optional
 from urllib.parse import quote
+import html
 import os
 from datetime import datetime, timedelta
 
 from app.database import db_manager
 from app.services import analysis_service
+from app.background_jobs import background_job_manager, PRIORITY_LOW
+from app.file_analysis.yara_rules import yara_rule_manager
+from app.domain_matcher import trusted_domain_manager
+from app.tracing import trace_buffer
+from app.cache import disk_cache
+from app.config import tracing_config
 
 router = APIRouter(prefix="/admin/ui", tags=["Админ UI"])
 
@@ -64,6 +71,7 @@ def _layout(request: Request, title: str, body: str) -> str:
       <a href=\"{p('admin/ui/cache')}\">Кэш URL</a>
       <a href=\"{p('admin/ui/ip')}\">IP репутация</a>
       <a href=\"{p('admin/ui/logs')}\">Логи</a>
+      <a href=\"{p('admin/ui/traces')}\">Трассы</a>
       <a href=\"{p('admin/ui/danger')}\" style=\"color: #dc2626;\">⚠️ Опасная зона</a>
       <a href=\"{p('docs')}\" style=\"float:right\">Документация</a>
     </nav>
@@ -77,6 +85,10 @@ def _layout(request: Request, title: str, body: str) -> str:
 
 
 async def _refresh_cache_entries(target: str, limit: int):
+    """
+    Ставит перепроверку старейших записей в очередь фоновых задач с низким
+    приоритетом: массовое обновление не задерживает перепроверки пользователей.
+    """
     limit = max(1, min(limit, 50))
     targets = []
     target = target.lower()
@@ -89,38 +101,24 @@ async def _refresh_cache_entries(target: str, limit: int):
     if "all" in targets:
         targets = ["whitelist", "blacklist"]
 
-    summary = {"processed": 0, "whitelist": 0, "blacklist": 0, "errors": 0}
     entries = []
     for store in targets:
         entries.extend(db_manager.get_cached_entries(store, limit))
 
-    # Ограничиваем общее число обновлений
-    entries = entries[:limit]
-
-    for entry in entries:
-        url = entry.get("url")
-        payload = entry.get("payload") or {}
-        if not url:
-            url = payload.get("url")
-        if not url:
-            domain = entry.get("domain") or payload.get("domain")
-            if domain:
-                url = f"https://{domain}"
-        if not url:
-            summary["errors"] += 1
-            continue
-        try:
-            result = await analysis_service.analyze_url(url, use_external_apis=True)
-            summary["processed"] += 1
-            if result.get("safe") is True:
-                db_manager.save_whitelist_entry(url, result)
-                summary["whitelist"] += 1
-            elif result.get("safe") is False:
-                db_manager.save_blacklist_entry(url, result)
-                summary["blacklist"] += 1
-        except Exception as exc:
+    # Ограничиваем общее число обновлений; каждая запись - отдельная задача (дубликаты отсекает dedup_key)
+    summary = {"queued": 0, "errors": 0}
+    for entry in entries[:limit]:
+        store = "blacklist" if entry.get("url_hash") else "whitelist"
+        job_data = {
+            "store": store,
+            "cache_key": entry.get("url_hash") if store == "blacklist" else entry.get("domain"),
+            "url": entry.get("url"),
+            "domain": entry.get("domain"),
+        }
+        if background_job_manager.add_job("cache_revalidate", job_data, priority=PRIORITY_LOW):
+            summary["queued"] += 1
+        else:
             summary["errors"] += 1
-            logging.getLogger(__name__).warning(f"Cache refresh failed for {url}: {exc}")
 
     return summary
 
@@ -157,7 +155,7 @@ async def dashboard(request: Request):
         <label>Сколько записей пересканировать (старейшие)</label>
         <input type="number" name="limit" min="1" max="50" value="10" />
         <button type="submit">Обновить локальную базу</button>
-        <p class="muted" style="font-size:12px;">Обновление вручную: мы пересканируем N самых старых записей через VirusTotal и перезапишем их в базе.</p>
+        <p class="muted" style="font-size:12px;">Обновление вручную: N самых старых записей ставятся в фоновую очередь на пересканирование через VirusTotal и перезаписываются в базе.</p>
       </form>
     </div>
     <div class="row">
@@ -353,11 +351,46 @@ async def refresh_cache_action(
     summary = await _refresh_cache_entries(target, int(limit))
     prefix = request.scope.get("root_path", "")
     redirect = RedirectResponse(url=(prefix + ("/admin/ui" if not prefix.endswith('/') else "admin/ui")), status_code=303)
-    msg = quote(f"Обновлено: {summary['processed']}, white: {summary['whitelist']}, black: {summary['blacklist']}, ошибок: {summary['errors']}")
+    msg = quote(f"Поставлено в очередь на перепроверку: {summary['queued']}, ошибок: {summary['errors']}")
     redirect.set_cookie("flash", msg, max_age=10)
     return redirect
 
 
+@router.post("/yara/reload")
+async def reload_yara_rules_action(request: Request):
+    """Перезагрузка YARA-правил из каталога (новый набор подменяет текущий без остановки проверок)"""
+    if not yara_rule_manager.available:
+        msg = "yara-python не установлен"
+    else:
+        try:
+            changed = await yara_rule_manager.reload()
+            version = (yara_rule_manager.current.version if yara_rule_manager.current else None)
+            msg = f"YARA-правила {'обновлены' if changed else 'не изменились'}: версия {version}"
+        except Exception as e:
+            logging.getLogger(__name__).error(f"YARA reload error: {e}")
+            msg = f"Ошибка перезагрузки YARA: {str(e)}"
+    prefix = request.scope.get("root_path", "")
+    redirect = RedirectResponse(url=(prefix + ("/admin/ui" if not prefix.endswith('/') else "admin/ui")), status_code=303)
+    redirect.set_cookie("flash", quote(msg), max_age=10)
+    return redirect
+
+
+@router.post("/trusted-domains/reload")
+async def reload_trusted_domains_action(request: Request):
+    """Перечитывание списков доверенных доменов и Public Suffix List"""
+    try:
+        changed = await trusted_domain_manager.reload()
+        stats = trusted_domain_manager.get_stats()
+        msg = f"Доверенные домены {'обновлены' if changed else 'не изменились'}: {stats.get('domains', 0)} доменов"
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Trusted domains reload error: {e}")
+        msg = f"Ошибка перезагрузки доверенных доменов: {str(e)}"
+    prefix = request.scope.get("root_path", "")
+    redirect = RedirectResponse(url=(prefix + ("/admin/ui" if not prefix.endswith('/') else "admin/ui")), status_code=303)
+    redirect.set_cookie("flash", quote(msg), max_age=10)
+    return redirect
+
+
 @router.get("/threats", response_class=HTMLResponse)
 async def threats_page(request: Request):
     # Получаем все угрозы из реальных таблиц
@@ -536,6 +569,15 @@ async def search_urls_page(request: Request, q: str = ""):
         for m in results["malicious_urls"]
     ])
     
+    disk_breakdown = disk_cache.get_breakdown()
+    disk_rows = "".join([
+        f"<tr><td>{html.escape(d['namespace'] or '-')}</td>"
+        f"<td>{html.escape(d['source'] or '-')}</td>"
+        f"<td>{'-' if d['safe'] is None else ('safe' if d['safe'] else 'unsafe')}</td>"
+        f"<td>{d['entries']}</td></tr>"
+        for d in disk_breakdown
+    ])
+    
     blacklist_rows = "".join([
         f"<tr><td><a href=\"{b['url']}\" target=\"_blank\">{b['url'][:80]}{'...' if len(b['url']) > 80 else ''}</a></td>"
         f"<td>{b.get('domain', '-')}</td>"
@@ -723,6 +765,42 @@ async def logs_page(request: Request):
     return _layout(request, "Админ панель – логи", body)
 
 
+@router.get("/traces", response_class=HTMLResponse)
+async def traces_page(request: Request):
+    """Последние трассы этапов анализа URL (буфер текущего воркера)"""
+    traces = trace_buffer.recent(100)
+
+    def spans_cell(spans) -> str:
+        return "<br>".join(
+            f"<code>{html.escape(s['name'])}</code> +{s['start_ms']} мс, {s['duration_ms']} мс"
+            for s in sorted(spans, key=lambda s: s['start_ms'])
+        ) or '-'
+
+    tr = "".join([
+        f"<tr><td class=\"muted\">{datetime.fromtimestamp(t['started_at']).strftime('%Y-%m-%d %H:%M:%S')}</td>"
+        f"<td>{html.escape(t['label'])}</td><td>{t['total_ms']}</td><td>{spans_cell(t['spans'])}</td></tr>"
+        for t in traces
+    ])
+
+    body = f"""
+    <div class="card">
+      <h1>Трассы анализа URL</h1>
+      <p class="muted">Запросы с заголовком {html.escape(tracing_config.TRACE_HEADER)}: 1 или параметром ?{html.escape(tracing_config.TRACE_QUERY_PARAM)}=1,
+      а также выборка {tracing_config.TRACE_SAMPLE_RATE:.2%} остальных. Буфер хранится в памяти каждого воркера
+      (до {tracing_config.TRACE_BUFFER_SIZE} трасс).</p>
+    </div>
+    <div class="card">
+      <div style=\"max-height:700px;overflow:auto\">
+        <table>
+          <thead><tr><th>Время</th><th>Запрос</th><th>Всего, мс</th><th>Этапы</th></tr></thead>
+          <tbody>{tr or '<tr><td colspan=4 class="muted">Трасс пока нет</td></tr>'}</tbody>
+        </table>
+      </div>
+    </div>
+    """
+    return _layout(request, "Админ панель – трассы", body)
+
+
 @router.get("/cache", response_class=HTMLResponse)
 async def cache_page(request: Request):
     """Страница для просмотра всех URL из кэша (whitelist и blacklist)"""
@@ -782,6 +860,29 @@ async def cache_page(request: Request):
         </form>
       </div>
     </div>
+    <div class="card">
+      <h2>Диск-кэш сервиса (cache.db)</h2>
+      <p class="muted">Записи по пространству ключей, источнику вердикта и вердикту</p>
+      <div style=\"max-height:300px;overflow:auto\">
+        <table>
+          <thead><tr><th>Пространство</th><th>Источник</th><th>Вердикт</th><th>Записей</th></tr></thead>
+          <tbody>{disk_rows or '<tr><td colspan=4 class="muted">Диск-кэш пуст</td></tr>'}</tbody>
+        </table>
+      </div>
+      <form method="post" action="{request.scope.get('root_path','') + ('/admin/ui/cache/disk-purge' if not request.scope.get('root_path','').endswith('/') else 'admin/ui/cache/disk-purge')}" style="margin-top:12px; display:grid; gap:8px; max-width:500px;">
+        <label>Пространство ключей (url, hash, upload, verdict)</label>
+        <input name="namespace" placeholder="любое" />
+        <label>Источник вердикта (source)</label>
+        <input name="source" placeholder="любой" />
+        <label>Вердикт</label>
+        <select name="verdict">
+          <option value="">любой</option>
+          <option value="safe">safe</option>
+          <option value="unsafe">unsafe</option>
+        </select>
+        <button type="submit" style="background: #dc2626;">Удалить подходящие записи</button>
+      </form>
+    </div>
     <div class="card">
       <h2>Whitelist (безопасные домены)</h2>
       <div style=\"max-height:400px;overflow:auto\">
@@ -833,6 +934,32 @@ async def clear_cache_action(
     return redirect
 
 
+@router.post("/cache/disk-purge")
+async def disk_cache_purge_action(
+    request: Request,
+    namespace: str = Form(""),
+    source: str = Form(""),
+    verdict: str = Form(""),
+):
+    """Выборочная очистка диск-кэша по пространству ключей, источнику и вердикту"""
+    safe = {"safe": True, "unsafe": False}.get(verdict)
+    if not namespace.strip() and not source.strip() and safe is None:
+        msg = "Укажите хотя бы один фильтр"
+    else:
+        try:
+            count = disk_cache.delete_where(namespace.strip() or None, source.strip() or None, safe)
+            analysis_service.clear_cache()
+            msg = f"Удалено {count} записей из диск-кэша"
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Disk cache purge error: {e}")
+            msg = f"Ошибка очистки: {str(e)}"
+    
+    prefix = request.scope.get("root_path", "")
+    redirect = RedirectResponse(url=(prefix + ("/admin/ui/cache" if not prefix.endswith('/') else "admin/ui/cache")), status_code=303)
+    redirect.set_cookie("flash", quote(msg), max_age=10)
+    return redirect
+
+
 @router.get("/danger", response_class=HTMLResponse)
 async def danger_zone_page(request: Request):
     """Страница опасной зоны - полная очистка базы данных"""
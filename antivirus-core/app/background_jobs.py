@@ -1,71 +1,132 @@
 # app/background_jobs.py
 import asyncio
+import json
 import time
 from typing import Dict, Any, List, Optional
 from app.logger import logger
+from app.config import background_job_config
 from app.database import db_manager
+from app.pg_listener import pg_listener
 from app.external_apis.manager import external_api_manager
+from app.metrics import JOB_LAG_SECONDS, JOB_RESULTS, JOB_SECONDS
+
+# Приоритеты задач: выше - раньше. Проверки по запросу пользователя не ждут массовых обновлений
+PRIORITY_LOW = 0      # массовые операции (обновление кэша из админки)
+PRIORITY_NORMAL = 50
+PRIORITY_HIGH = 100   # перепроверки, инициированные пользователем
+
+
+class JobDeferred(Exception):
+    """Задачу сейчас выполнять нельзя (например, исчерпан бюджет квоты): перенос без траты попытки"""
+
+    def __init__(self, delay_seconds: int, reason: str = ""):
+        super().__init__(reason or f"deferred for {delay_seconds}s")
+        self.delay_seconds = delay_seconds
 
 class BackgroundJobManager:
-    """Менеджер фоновых задач для долгих проверок"""
+    """Менеджер фоновых задач для долгих проверок
+
+    Задачи забираются из background_jobs через FOR UPDATE SKIP LOCKED, поэтому
+    несколько воркеров не обрабатывают одну задачу дважды. О новых задачах
+    обработчики узнают по NOTIFY, редкий опрос остаётся страховкой.
+    Порядок выборки: priority DESC, run_after, created_at; задачи с run_after
+    в будущем (отложенные, периодические, повторы с backoff) ждут своего времени.
+    """
     
-    def __init__(self):
+    def __init__(self,
+                 concurrency: int = background_job_config.BACKGROUND_JOB_CONCURRENCY,
+                 poll_interval: int = background_job_config.BACKGROUND_JOB_POLL_INTERVAL):
         self.jobs: Dict[str, Dict[str, Any]] = {}
         self.running = False
-        self.task = None
+        self.concurrency = max(concurrency, 1)
+        self.poll_interval = poll_interval
+        self.channel = background_job_config.BACKGROUND_JOB_CHANNEL
+        self.max_retries = background_job_config.BACKGROUND_JOB_MAX_RETRIES
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
     
     async def start(self):
-        """Запуск фонового обработчика задач"""
+        """Запуск фоновых обработчиков задач"""
         if self.running:
             return
         
         self.running = True
-        self.task = asyncio.create_task(self._job_processor())
-        logger.info("Background job manager started")
+        self._wakeup = asyncio.Event()
+        try:
+            await pg_listener.subscribe(self.channel, self._on_notify)
+        except Exception as e:
+            logger.warning(f"Background jobs NOTIFY subscription failed, polling only: {e}")
+        self._tasks = [asyncio.create_task(self._job_consumer(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._watchdog()))
+        logger.info(f"Background job manager started ({self.concurrency} consumers)")
     
     async def stop(self):
-        """Остановка фонового обработчика задач"""
+        """Остановка фоновых обработчиков задач"""
         self.running = False
-        if self.task:
-            self.task.cancel()
-            try:
-                await self.task
-            except asyncio.CancelledError:
-                pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
         logger.info("Background job manager stopped")
     
-    async def _job_processor(self):
-        """Основной цикл обработки фоновых задач"""
+    def _on_notify(self, payload: str):
+        """Уведомление о новой задаче - будим обработчики"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _job_consumer(self, consumer_id: int):
+        """Цикл обработчика: забирает по одной задаче, при пустой очереди ждёт NOTIFY"""
         while self.running:
             try:
-                # Получаем задачи из БД
-                pending_jobs = self._get_pending_jobs()
-                
-                for job in pending_jobs:
-                    await self._process_job(job)
-                
-                # Ждем перед следующей итерацией
-                await asyncio.sleep(10)  # Проверяем каждые 10 секунд
-                
+                # Сбрасываем событие до запроса: NOTIFY, пришедший во время запроса, не потеряется
+                self._wakeup.clear()
+                jobs = await asyncio.to_thread(self._get_pending_jobs, 1)
+                if jobs:
+                    await self._process_job(jobs[0])
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Background job processor error: {e}")
+                logger.error(f"Background job consumer {consumer_id} error: {e}")
                 await asyncio.sleep(30)  # При ошибке ждем дольше
     
-    def _get_pending_jobs(self) -> List[Dict[str, Any]]:
-        """Получение ожидающих задач из БД"""
+    async def _watchdog(self):
+        """Возвращает в очередь задачи, зависшие после падения воркера"""
+        while self.running:
+            try:
+                requeued = await asyncio.to_thread(self._requeue_stale_jobs)
+                if requeued:
+                    logger.warning(f"Requeued {requeued} stale background jobs")
+                    self._wakeup.set()
+            except Exception as e:
+                logger.error(f"Background job watchdog error: {e}")
+            await asyncio.sleep(self.poll_interval)
+    
+    def _get_pending_jobs(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Атомарно забирает ожидающие задачи (переводит их в 'processing')"""
         try:
             with db_manager._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, job_type, job_data, created_at, retry_count
-                    FROM background_jobs 
-                    WHERE status = 'pending' AND retry_count < 3
-                    ORDER BY created_at ASC
-                    LIMIT 10
-                """)
+                cursor.execute(db_manager._adapt_query("""
+                    UPDATE background_jobs
+                    SET status = 'processing', updated_at = CURRENT_TIMESTAMP
+                    WHERE id IN (
+                        SELECT id FROM background_jobs
+                        WHERE status = 'pending' AND retry_count < ?
+                        AND run_after <= CURRENT_TIMESTAMP
+                        ORDER BY priority DESC, run_after ASC, created_at ASC
+                        LIMIT ?
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, job_type, job_data, created_at, retry_count, priority, repeat_interval,
+                        EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - run_after) AS lag_seconds
+                """), (self.max_retries, limit))
                 rows = [dict(row) for row in cursor.fetchall()]
                 # Пытаемся преобразовать job_data из JSON
-                import json
                 for r in rows:
                     try:
                         if isinstance(r.get('job_data'), str):
@@ -77,16 +138,58 @@ class BackgroundJobManager:
             logger.error(f"Get pending jobs error: {e}")
             return []
     
+    def get_queue_stats(self) -> Optional[Dict[str, Any]]:
+        """Число задач, чей срок запуска наступил, и возраст самой старой из них (сек)"""
+        try:
+            with db_manager._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(db_manager._adapt_query("""
+                    SELECT COUNT(*) AS due,
+                           COALESCE(EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(run_after)), 0) AS oldest_due_seconds
+                    FROM background_jobs
+                    WHERE status = 'pending' AND retry_count < ?
+                    AND run_after <= CURRENT_TIMESTAMP
+                """), (self.max_retries,))
+                row = cursor.fetchone()
+                return {"due": int(row["due"]), "oldest_due_seconds": float(row["oldest_due_seconds"])}
+        except Exception as e:
+            logger.error(f"Background queue stats error: {e}")
+            return None
+    
+    def _requeue_stale_jobs(self) -> int:
+        """
+        Возвращает в 'pending' задачи, которые слишком долго в 'processing';
+        исчерпавшие попытки помечаются 'failed' (иначе они навсегда остались бы в 'pending')
+        """
+        try:
+            with db_manager._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(db_manager._adapt_query("""
+                    UPDATE background_jobs
+                    SET retry_count = retry_count + 1,
+                        status = CASE WHEN retry_count + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                        error_message = CASE WHEN retry_count + 1 >= ? THEN 'Stale processing timeout'
+                                             ELSE error_message END,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE status = 'processing'
+                    AND updated_at < CURRENT_TIMESTAMP - (? * INTERVAL '1 second')
+                """), (self.max_retries, self.max_retries, background_job_config.BACKGROUND_JOB_STALE_TIMEOUT))
+                return cursor.rowcount or 0
+        except Exception as e:
+            logger.error(f"Requeue stale jobs error: {e}")
+            return 0
+    
     async def _process_job(self, job: Dict[str, Any]):
-        """Обработка отдельной задачи"""
+        """Обработка отдельной задачи (статус 'processing' уже выставлен при захвате)"""
         job_id = job['id']
         job_type = job['job_type']
         job_data = job['job_data']
+        # Задержка между плановым временем запуска и захватом задачи обработчиком
+        if job.get('lag_seconds') is not None:
+            JOB_LAG_SECONDS.labels(job_type=job_type).observe(max(float(job['lag_seconds']), 0.0))
+        started = time.perf_counter()
         
         try:
-            # Обновляем статус на "processing"
-            self._update_job_status(job_id, 'processing')
-            
             # Выполняем задачу в зависимости от типа
             if job_type == 'url_recheck':
                 await self._process_url_recheck(job_data)
@@ -94,18 +197,34 @@ class BackgroundJobManager:
                 await self._process_file_recheck(job_data)
             elif job_type == 'ip_recheck':
                 await self._process_ip_recheck(job_data)
+            elif job_type == 'threat_feed_ingest':
+                await self._process_threat_feed_ingest(job_data)
+            elif job_type == 'cache_revalidate':
+                await self._process_cache_revalidate(job_data)
             else:
                 logger.warning(f"Unknown job type: {job_type}")
-                self._update_job_status(job_id, 'failed', 'Unknown job type')
+                await asyncio.to_thread(self._update_job_status, job_id, 'failed', 'Unknown job type')
+                JOB_RESULTS.labels(job_type=job_type, status='unknown_type').inc()
                 return
             
-            # Отмечаем как выполненную
-            self._update_job_status(job_id, 'completed')
+            # Периодическая задача планируется заново, остальные отмечаются выполненными
+            if job.get('repeat_interval'):
+                await asyncio.to_thread(self._reschedule_job, job_id, job['repeat_interval'])
+            else:
+                await asyncio.to_thread(self._update_job_status, job_id, 'completed')
+            JOB_RESULTS.labels(job_type=job_type, status='completed').inc()
             
+        except JobDeferred as e:
+            logger.info(f"Job {job_id} deferred: {e}")
+            JOB_RESULTS.labels(job_type=job_type, status='deferred').inc()
+            await asyncio.to_thread(self._reschedule_job, job_id, e.delay_seconds, False)
         except Exception as e:
             logger.error(f"Job {job_id} processing error: {e}")
+            JOB_RESULTS.labels(job_type=job_type, status='error').inc()
             # Увеличиваем счетчик попыток
-            self._increment_retry_count(job_id)
+            await asyncio.to_thread(self._increment_retry_count, job_id, str(e))
+        finally:
+            JOB_SECONDS.labels(job_type=job_type).observe(time.perf_counter() - started)
     
     async def _process_url_recheck(self, job_data: Dict[str, Any]):
         """Повторная проверка URL через внешние API"""
@@ -153,6 +272,32 @@ class BackgroundJobManager:
             logger.error(f"File recheck error for {file_hash}: {e}")
             raise
     
+    async def _process_cache_revalidate(self, job_data: Dict[str, Any]):
+        """Перепроверка одной записи cached_whitelist/cached_blacklist (массовое обновление из админки)"""
+        from app.cache_revalidator import cache_revalidator
+        
+        # Тот же общий бюджет квоты, что и у плановой ревалидации
+        summary = await cache_revalidator.revalidate_entries([job_data])
+        if summary["deferred"]:
+            raise JobDeferred(cache_revalidator.interval, "provider quota budget exhausted")
+        if summary["errors"]:
+            raise RuntimeError(f"Cache revalidation failed for {job_data.get('cache_key')}")
+    
+    async def _process_threat_feed_ingest(self, job_data: Dict[str, Any]):
+        """Загрузка фида угроз из THREAT_FEEDS_DIR (периодическая задача - регулярное обновление фида)"""
+        from app.threat_feeds import threat_feed_loader
+        
+        path = threat_feed_loader.resolve(job_data.get('file', ''))
+        await asyncio.to_thread(
+            threat_feed_loader.ingest,
+            path,
+            job_data.get('kind', 'url'),
+            job_data.get('source', ''),
+            job_data.get('expire_missing', True),
+            job_data.get('threat_type'),
+            job_data.get('severity'),
+        )
+    
     async def _process_ip_recheck(self, job_data: Dict[str, Any]):
         """Повторная проверка IP через внешние API"""
         ip_address = job_data.get('ip_address')
@@ -175,40 +320,104 @@ class BackgroundJobManager:
         try:
             with db_manager._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
+                cursor.execute(db_manager._adapt_query("""
                     UPDATE background_jobs 
                     SET status = ?, error_message = ?, updated_at = CURRENT_TIMESTAMP
                     WHERE id = ?
-                """, (status, error_message, job_id))
-                conn.commit()
+                """), (status, error_message, job_id))
+                db_manager._commit_if_needed(conn)
         except Exception as e:
             logger.error(f"Update job status error: {e}")
     
-    def _increment_retry_count(self, job_id: int):
-        """Увеличение счетчика попыток"""
+    def _reschedule_job(self, job_id: int, repeat_interval: int, reset_retries: bool = True):
+        """
+        Возвращает задачу в очередь через repeat_interval секунд: периодическую
+        (счетчик попыток сбрасывается) или отложенную (JobDeferred, счетчик сохраняется)
+        """
         try:
             with db_manager._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
+                cursor.execute(db_manager._adapt_query("""
+                    UPDATE background_jobs
+                    SET status = 'pending', error_message = NULL,
+                        retry_count = CASE WHEN ? THEN 0 ELSE retry_count END,
+                        run_after = CURRENT_TIMESTAMP + (? * INTERVAL '1 second'),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """), (reset_retries, repeat_interval, job_id))
+                db_manager._commit_if_needed(conn)
+        except Exception as e:
+            logger.error(f"Reschedule job error: {e}")
+    
+    def _increment_retry_count(self, job_id: int, error_message: str = None):
+        """Увеличение счетчика попыток и повтор с экспоненциальной задержкой"""
+        try:
+            with db_manager._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(db_manager._adapt_query("""
                     UPDATE background_jobs 
-                    SET retry_count = retry_count + 1, status = 'pending'
+                    SET retry_count = retry_count + 1,
+                        status = CASE WHEN retry_count + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                        run_after = CURRENT_TIMESTAMP
+                            + (LEAST(? * POWER(2, retry_count), ?) * INTERVAL '1 second'),
+                        error_message = ?, updated_at = CURRENT_TIMESTAMP
                     WHERE id = ?
-                """, (job_id,))
-                conn.commit()
+                """), (
+                    self.max_retries,
+                    background_job_config.BACKGROUND_JOB_RETRY_BASE_DELAY,
+                    background_job_config.BACKGROUND_JOB_RETRY_MAX_DELAY,
+                    error_message,
+                    job_id,
+                ))
+                db_manager._commit_if_needed(conn)
         except Exception as e:
             logger.error(f"Increment retry count error: {e}")
     
-    def add_job(self, job_type: str, job_data: Dict[str, Any]) -> bool:
-        """Добавление новой фоновой задачи"""
+    @staticmethod
+    def _default_dedup_key(job_type: str, job_data: Dict[str, Any]) -> Optional[str]:
+        """Ключ дедупликации для перепроверок: одна активная задача на URL/хеш/IP"""
+        target_field = {
+            'url_recheck': 'url',
+            'file_recheck': 'file_hash',
+            'ip_recheck': 'ip_address',
+            'threat_feed_ingest': 'source',
+            'cache_revalidate': 'cache_key',
+        }.get(job_type)
+        target = job_data.get(target_field) if target_field else None
+        return f"{job_type}:{target}" if target else None
+    
+    def add_job(self, job_type: str, job_data: Dict[str, Any],
+                priority: int = PRIORITY_NORMAL,
+                delay_seconds: int = 0,
+                repeat_interval: Optional[int] = None,
+                dedup_key: Optional[str] = None) -> bool:
+        """
+        Добавление новой фоновой задачи (с уведомлением обработчиков через NOTIFY)
+
+        delay_seconds - отложенный запуск; repeat_interval - период повторения (сек);
+        dedup_key - если активная задача с таким ключом уже есть, новая не создаётся,
+        а существующей повышается приоритет и при необходимости сдвигается запуск.
+        """
+        if dedup_key is None:
+            dedup_key = self._default_dedup_key(job_type, job_data)
         try:
             with db_manager._get_connection() as conn:
                 cursor = conn.cursor()
-                import json
-                cursor.execute("""
-                    INSERT INTO background_jobs (job_type, job_data, status, created_at)
-                    VALUES (?, ?, 'pending', CURRENT_TIMESTAMP)
-                """, (job_type, json.dumps(job_data)))
-                conn.commit()
+                cursor.execute(db_manager._adapt_query("""
+                    INSERT INTO background_jobs
+                        (job_type, job_data, status, priority, run_after, repeat_interval, dedup_key, created_at)
+                    VALUES (?, ?, 'pending', ?, CURRENT_TIMESTAMP + (? * INTERVAL '1 second'), ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (dedup_key) WHERE status IN ('pending', 'processing')
+                    DO UPDATE SET
+                        priority = GREATEST(background_jobs.priority, EXCLUDED.priority),
+                        run_after = LEAST(background_jobs.run_after, EXCLUDED.run_after),
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING id
+                """), (job_type, json.dumps(job_data), priority, max(delay_seconds, 0), repeat_interval, dedup_key))
+                row = cursor.fetchone()
+                if delay_seconds <= 0:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, str(row["id"]) if row else ""))
+                db_manager._commit_if_needed(conn)
                 return True
         except Exception as e:
             logger.error(f"Add job error: {e}")
@@ -1,17 +1,32 @@
 # app/cache.py
 import sqlite3
-import json
+import threading
 import time
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from app.logger import logger
+from app.metrics import DISK_CACHE_RESULTS, DISK_CACHE_SECONDS, timed
+from app.serialization import dumps, loads
+from app.startup_profile import startup_profile
 
 class DiskCache:
     """Диск-кэш с TTL для переживания перезапусков"""
     
     def __init__(self, cache_db_path: str = "data/cache.db"):
         self.cache_db_path = cache_db_path
-        self._init_cache_db()
+        # Файл и таблица создаются при первом обращении, а не при импорте модуля
+        self._initialized = False
+        self._init_lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение с базой кэша; при первом вызове создает её"""
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    with startup_profile.measure("disk_cache.init", kind="lazy"):
+                        self._init_cache_db()
+                    self._initialized = True
+        return sqlite3.connect(self.cache_db_path)
     
     def _init_cache_db(self):
         """Инициализация базы данных кэша"""
@@ -25,18 +40,42 @@ class DiskCache:
                         key TEXT PRIMARY KEY,
                         value TEXT NOT NULL,
                         expires_at INTEGER NOT NULL,
-                        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+                        created_at INTEGER DEFAULT (strftime('%s', 'now')),
+                        namespace TEXT,
+                        source TEXT,
+                        safe INTEGER
                     )
                 """)
+                # Базы, созданные до появления индексируемых колонок: старые строки
+                # заполняет backfill_index_columns (фоном после старта)
+                columns = {row[1] for row in cursor.execute("PRAGMA table_info(cache)")}
+                for column, column_type in (("namespace", "TEXT"), ("source", "TEXT"), ("safe", "INTEGER")):
+                    if column not in columns:
+                        cursor.execute(f"ALTER TABLE cache ADD COLUMN {column} {column_type}")
                 cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires_at)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_source ON cache(source)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_namespace ON cache(namespace, source, safe)")
                 conn.commit()
         except Exception as e:
             logger.error(f"Cache DB initialization error: {e}")
     
+    @staticmethod
+    def _index_fields(key: str, value: Any) -> Tuple[str, Optional[str], Optional[int]]:
+        """Индексируемые поля записи: пространство ключа (до первого ':'), source и вердикт safe"""
+        namespace = key.split(":", 1)[0] if ":" in key else ""
+        if not isinstance(value, dict):
+            return namespace, None, None
+        source = value.get("source")
+        safe = value.get("safe")
+        return (namespace,
+                str(source) if source is not None else None,
+                int(bool(safe)) if safe is not None else None)
+    
+    @timed(DISK_CACHE_SECONDS, op="get")
     def get(self, key: str) -> Optional[Dict[str, Any]]:
         """Получение значения из кэша"""
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
@@ -46,68 +85,152 @@ class DiskCache:
                 
                 if result:
                     value_str, expires_at = result
-                    return json.loads(value_str)
+                    DISK_CACHE_RESULTS.labels(result="hit").inc()
+                    return loads(value_str)
                 else:
+                    DISK_CACHE_RESULTS.labels(result="miss").inc()
                     # Удаляем истекшие записи
                     cursor.execute("DELETE FROM cache WHERE expires_at <= ?", (int(time.time()),))
                     conn.commit()
                     return None
         except Exception as e:
             logger.error(f"Cache get error: {e}")
+            DISK_CACHE_RESULTS.labels(result="error").inc()
             return None
     
+    @timed(DISK_CACHE_SECONDS, op="set")
     def set(self, key: str, value: Dict[str, Any], ttl_seconds: int = 300):
         """Сохранение значения в кэш"""
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 expires_at = int(time.time()) + ttl_seconds
-                value_str = json.dumps(value)
+                value_str = dumps(value)
+                namespace, source, safe = self._index_fields(key, value)
                 
                 cursor.execute(
-                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
-                    (key, value_str, expires_at)
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at, namespace, source, safe) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, value_str, expires_at, namespace, source, safe)
                 )
                 conn.commit()
         except Exception as e:
             logger.error(f"Cache set error: {e}")
     
+    @timed(DISK_CACHE_SECONDS, op="update")
+    def update(self, key: str, updater: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+               ttl_seconds: int = 300) -> Optional[Dict[str, Any]]:
+        """
+        Атомарное чтение-изменение-запись одной записи: BEGIN IMMEDIATE держит
+        блокировку записи, поэтому обновления из других воркеров не теряются.
+        updater получает текущее значение (None, если записи нет) и возвращает
+        новое или None - тогда ничего не записывается. Возвращает итоговое значение.
+        """
+        try:
+            conn = self._connect()
+            conn.isolation_level = None
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(
+                    "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                    (key, int(time.time()))
+                )
+                row = cursor.fetchone()
+                current = loads(row[0]) if row else None
+                value = updater(current)
+                if value is not None:
+                    namespace, source, safe = self._index_fields(key, value)
+                    cursor.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, expires_at, namespace, source, safe) VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, dumps(value), int(time.time()) + ttl_seconds, namespace, source, safe)
+                    )
+                cursor.execute("COMMIT")
+                return value if value is not None else current
+            except Exception:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Cache update error: {e}")
+            return None
+    
+    @timed(DISK_CACHE_SECONDS, op="delete")
     def delete(self, key: str):
         """Удаление значения из кэша"""
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM cache WHERE key = ?", (key,))
                 conn.commit()
         except Exception as e:
             logger.error(f"Cache delete error: {e}")
     
-    def delete_by_source(self, source: str):
-        """Удаление всех записей с указанным source из кэша"""
+    def delete_where(self, namespace: Optional[str] = None, source: Optional[str] = None,
+                     safe: Optional[bool] = None) -> int:
+        """
+        Удаление записей по пространству ключей, source и/или вердикту одним DELETE по индексам.
+        Возвращает количество удаленных записей.
+        """
+        conditions, params = [], []
+        for column, value in (("namespace", namespace), ("source", source)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if safe is not None:
+            conditions.append("safe = ?")
+            params.append(int(bool(safe)))
+        if not conditions:
+            raise ValueError("At least one of namespace, source or safe is required")
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT key, value FROM cache")
-                rows = cursor.fetchall()
-                deleted_count = 0
-                for key, value_str in rows:
-                    try:
-                        value = json.loads(value_str)
-                        if value.get("source") == source:
-                            cursor.execute("DELETE FROM cache WHERE key = ?", (key,))
-                            deleted_count += 1
-                    except Exception:
-                        continue
+                cursor.execute(f"DELETE FROM cache WHERE {' AND '.join(conditions)}", params)
+                deleted_count = cursor.rowcount
                 conn.commit()
                 if deleted_count > 0:
-                    logger.info(f"Deleted {deleted_count} cache entries with source={source}")
+                    logger.info(f"Deleted {deleted_count} cache entries (namespace={namespace}, source={source}, safe={safe})")
+                return deleted_count
+        except Exception as e:
+            logger.error(f"Cache delete_where error: {e}")
+            return 0
+    
+    def delete_by_source(self, source: str) -> int:
+        """Удаление всех записей с указанным source из кэша"""
+        return self.delete_where(source=source)
+    
+    def backfill_index_columns(self, batch_size: int = 5000) -> int:
+        """
+        Заполняет namespace/source/safe у записей, сохраненных до появления этих колонок.
+        Идет пачками, чтобы не держать блокировку записи на всю таблицу.
+        """
+        updated = 0
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("""
+                        UPDATE cache SET
+                            namespace = CASE WHEN instr(key, ':') > 0 THEN substr(key, 1, instr(key, ':') - 1) ELSE '' END,
+                            source = CASE WHEN json_valid(value) THEN json_extract(value, '$.source') END,
+                            safe = CASE WHEN json_valid(value) THEN json_extract(value, '$.safe') END
+                        WHERE rowid IN (SELECT rowid FROM cache WHERE namespace IS NULL LIMIT ?)
+                    """, (batch_size,))
+                    conn.commit()
+                    if cursor.rowcount <= 0:
+                        break
+                    updated += cursor.rowcount
+            if updated:
+                logger.info(f"Backfilled index columns for {updated} cache entries")
         except Exception as e:
-            logger.error(f"Cache delete_by_source error: {e}")
+            logger.error(f"Cache backfill error: {e}")
+        return updated
     
     def clear_expired(self):
         """Очистка истекших записей"""
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM cache WHERE expires_at <= ?", (int(time.time()),))
                 conn.commit()
@@ -117,7 +240,7 @@ class DiskCache:
     def get_stats(self) -> Dict[str, Any]:
         """Получение статистики кэша"""
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT COUNT(*) FROM cache")
                 total_entries = cursor.fetchone()[0]
@@ -134,10 +257,29 @@ class DiskCache:
             logger.error(f"Cache stats error: {e}")
             return {"total_entries": 0, "active_entries": 0, "expired_entries": 0}
     
+    def get_breakdown(self) -> List[Dict[str, Any]]:
+        """Количество записей по пространству ключей, source и вердикту (по индексу, без чтения значений)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT namespace, source, safe, COUNT(*) FROM cache
+                    GROUP BY namespace, source, safe
+                    ORDER BY COUNT(*) DESC
+                """)
+                return [
+                    {"namespace": namespace, "source": source,
+                     "safe": None if safe is None else bool(safe), "entries": count}
+                    for namespace, source, safe, count in cursor.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Cache breakdown error: {e}")
+            return []
+    
     def clear_all(self) -> int:
         """Очищает весь кэш. Возвращает количество удаленных записей."""
         try:
-            with sqlite3.connect(self.cache_db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT COUNT(*) FROM cache")
                 count = cursor.fetchone()[0]
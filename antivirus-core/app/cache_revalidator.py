@@ -0,0 +1,233 @@
+# app/cache_revalidator.py
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from app.config import cache_revalidation_config, config
+from app.database import db_manager
+from app.external_apis.manager import external_api_manager
+from app.logger import logger
+from app.services import analysis_service
+
+# Ключ advisory-блокировки PostgreSQL: ревалидацию выполняет один воркер из всех процессов
+REVALIDATION_LOCK_ID = 7305110142
+# Только эти источники означают свежий вердикт внешних API; эвристика и trusted_domain
+# (например, при таймауте провайдеров) не должны переписывать прежний вердикт
+AUTHORITATIVE_SOURCES = ("external_apis", "combined")
+# Имя в provider_usage, под которым учитываются сами перепроверки (бюджет ревалидации)
+REVALIDATION_USAGE_KEY = "cache_revalidation"
+
+
+class CacheRevalidator:
+    """
+    Фоновая перепроверка популярных записей cached_whitelist/cached_blacklist.
+
+    Раз в CACHE_REVALIDATION_INTERVAL выбираются записи, проверенные дольше
+    CACHE_REVALIDATION_REFRESH_AFTER назад, в порядке популярности (hit_count с
+    учётом давности last_seen), и перепроверяются через внешние API с ограниченной
+    параллельностью. Расход квоты VirusTotal ограничен долей часового лимита.
+    Бюджет считается по provider_usage - поминутным счетчикам в PostgreSQL, куда
+    пишут все воркеры (и запросы пользователей, и перепроверки); без БД - по
+    счетчикам этого процесса. Перепроверки по задачам из админки проходят через
+    тот же бюджет.
+
+    Планировщик запускается в каждом воркере uvicorn, но циклы выполняет только
+    держатель advisory-блокировки (pg_try_advisory_lock на отдельном соединении),
+    поэтому бюджет квоты не умножается на число воркеров и записи не
+    перепроверяются дважды. При падении лидера блокировку забирает другой воркер.
+    """
+
+    def __init__(self,
+                 interval: int = cache_revalidation_config.CACHE_REVALIDATION_INTERVAL,
+                 refresh_after: int = cache_revalidation_config.CACHE_REVALIDATION_REFRESH_AFTER,
+                 batch_size: int = cache_revalidation_config.CACHE_REVALIDATION_BATCH,
+                 concurrency: int = cache_revalidation_config.CACHE_REVALIDATION_CONCURRENCY,
+                 quota_share: float = cache_revalidation_config.CACHE_REVALIDATION_QUOTA_SHARE):
+        self.interval = interval
+        self.refresh_after = refresh_after
+        self.batch_size = batch_size
+        self.concurrency = max(concurrency, 1)
+        self.hourly_budget = int(config.VIRUSTOTAL_HOURLY_LIMIT * quota_share)
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        # Время каждой перепроверки за последний час - учёт бюджета, если provider_usage недоступна
+        self._spent: Deque[float] = deque()
+        self.last_run: Optional[Dict[str, Any]] = None
+        # Соединение, удерживающее блокировку лидера
+        self._leader_conn = None
+
+    async def start(self):
+        if self.running or not cache_revalidation_config.CACHE_REVALIDATION_ENABLED:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._revalidation_loop())
+        logger.info(f"Cache revalidator started (budget {self.hourly_budget}/h, concurrency {self.concurrency})")
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await asyncio.to_thread(self._release_leadership)
+        logger.info("Cache revalidator stopped")
+
+    def _acquire_leadership(self) -> bool:
+        """Удерживает ли этот воркер блокировку лидера (при необходимости пытается ее взять)."""
+        if db_manager is None:
+            return False
+        if self._leader_conn is not None:
+            try:
+                with self._leader_conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                return True
+            except Exception as e:
+                # Соединение потеряно - блокировка освобождена сервером
+                logger.warning(f"Cache revalidator lost leader connection: {e}")
+                self._release_leadership()
+        try:
+            conn = db_manager._get_connection()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (REVALIDATION_LOCK_ID,))
+                acquired = cursor.fetchone()["acquired"]
+        except Exception as e:
+            logger.error(f"Cache revalidator leader lock error: {e}")
+            return False
+        if not acquired:
+            conn.close()
+            return False
+        self._leader_conn = conn
+        logger.info("Cache revalidator: this worker is the leader")
+        return True
+
+    def _release_leadership(self) -> None:
+        if self._leader_conn is None:
+            return
+        try:
+            # Закрытие сессии снимает advisory-блокировку
+            self._leader_conn.close()
+        except Exception:
+            pass
+        self._leader_conn = None
+
+    def remaining_budget(self) -> int:
+        """Сколько перепроверок ещё можно сделать в текущем часовом окне (по всем воркерам)."""
+        now = time.time()
+        while self._spent and now - self._spent[0] >= 3600:
+            self._spent.popleft()
+        usage = db_manager.get_provider_usage(3600) if db_manager is not None else None
+        if usage is not None:
+            spent = usage.get(REVALIDATION_USAGE_KEY, 0)
+            vt_used = usage.get(external_api_manager.virustotal.provider, 0)
+        else:
+            # Общие счетчики недоступны - видим только запросы этого процесса
+            spent = len(self._spent)
+            vt_used = len([t for t in external_api_manager.virustotal.request_times if now - t < 3600])
+        own_remaining = self.hourly_budget - spent
+        # Не забираем квоту, которую уже израсходовали пользовательские запросы
+        provider_remaining = config.VIRUSTOTAL_HOURLY_LIMIT - vt_used
+        return max(0, min(own_remaining, provider_remaining))
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Один цикл ревалидации с учётом бюджета квоты."""
+        if not any(external_api_manager.enabled_apis.values()):
+            return {"processed": 0, "skipped": "no_external_apis"}
+        if db_manager is not None:
+            await asyncio.to_thread(db_manager.purge_provider_usage)
+        budget = await asyncio.to_thread(self.remaining_budget)
+        if budget <= 0:
+            logger.info("Cache revalidation skipped: provider quota budget exhausted")
+            return {"processed": 0, "skipped": "quota_budget"}
+        entries = await asyncio.to_thread(
+            db_manager.get_revalidation_candidates, min(self.batch_size, budget), self.refresh_after
+        )
+        summary = await self.revalidate_entries(entries)
+        self.last_run = {"finished_at": time.time(), **summary}
+        if summary["processed"] or summary["errors"]:
+            logger.info(f"Cache revalidation cycle: {summary}")
+        return summary
+
+    async def revalidate_entries(self, entries: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Перепроверяет переданные записи кэша с ограниченной параллельностью.
+        Записи сверх оставшегося бюджета квоты не проверяются и считаются в deferred.
+        """
+        summary = {"processed": 0, "whitelist": 0, "blacklist": 0, "unchanged": 0, "errors": 0, "deferred": 0}
+        entries = list(entries)
+        budget = await asyncio.to_thread(self.remaining_budget)
+        if len(entries) > budget:
+            summary["deferred"] = len(entries) - budget
+            entries = entries[:budget]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _revalidate(entry: Dict[str, Any]):
+            url = self._entry_url(entry)
+            if not url:
+                summary["errors"] += 1
+                return
+            async with semaphore:
+                self._spent.append(time.time())
+                if db_manager is not None:
+                    await asyncio.to_thread(db_manager.record_provider_usage, REVALIDATION_USAGE_KEY)
+                try:
+                    verdict = await self._revalidate_url(url, entry)
+                    summary["processed"] += 1
+                    summary[verdict] += 1
+                except Exception as exc:
+                    summary["errors"] += 1
+                    logger.warning(f"Cache revalidation failed for {url}: {exc}")
+
+        await asyncio.gather(*(_revalidate(entry) for entry in entries))
+        return summary
+
+    # ---------------------- Внутренние методы ----------------------
+
+    @staticmethod
+    def _entry_url(entry: Dict[str, Any]) -> Optional[str]:
+        payload = entry.get("payload") or {}
+        url = entry.get("url") or payload.get("url")
+        if not url:
+            domain = entry.get("domain") or payload.get("domain")
+            if domain:
+                url = f"https://{domain}"
+        return url
+
+    async def _revalidate_url(self, url: str, entry: Dict[str, Any]) -> str:
+        store = entry.get("store") or ("blacklist" if entry.get("url_hash") else "whitelist")
+        result = await analysis_service.analyze_url(url, use_external_apis=True, ignore_database=True)
+        safe = result.get("safe")
+        if result.get("source") not in AUTHORITATIVE_SOURCES:
+            safe = None
+        if safe is True:
+            await asyncio.to_thread(db_manager.save_whitelist_entry, url, result)
+            if store == "blacklist":
+                await asyncio.to_thread(db_manager.remove_cached_blacklist_url, url)
+            return "whitelist"
+        if safe is False:
+            await asyncio.to_thread(db_manager.save_blacklist_entry, url, result)
+            if store == "whitelist":
+                await asyncio.to_thread(db_manager.remove_cached_whitelist_domain, url)
+            return "blacklist"
+        # Вердикт внешних API не получен - прежний оставляем, но не перепроверяем запись каждый цикл
+        cache_key = entry.get("cache_key") or entry.get("url_hash") or entry.get("domain")
+        if cache_key:
+            await asyncio.to_thread(db_manager.mark_cache_revalidated, store, cache_key)
+        return "unchanged"
+
+    async def _revalidation_loop(self):
+        while self.running:
+            await asyncio.sleep(self.interval)
+            try:
+                if not await asyncio.to_thread(self._acquire_leadership):
+                    continue
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Cache revalidation error: {e}")
+
+
+# Глобальный экземпляр планировщика ревалидации
+cache_revalidator = CacheRevalidator()
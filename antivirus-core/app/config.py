@@ -51,6 +51,8 @@ class SecurityConfig:
     MAX_URL_LENGTH = int(os.getenv("MAX_URL_LENGTH", "2048"))
     MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "100"))
     MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+    # Перепроверок URL по запросу пользователя в минуту (каждая тратит квоту внешних API)
+    URL_RECHECK_PER_MINUTE = int(os.getenv("URL_RECHECK_PER_MINUTE", "5"))
 
 class ServerConfig:
     """Конфигурация сервера и окружений"""
@@ -98,10 +100,10 @@ class ExternalAPIConfig:
     GOOGLE_SAFE_BROWSING_KEY = os.getenv("GOOGLE_SAFE_BROWSING_KEY", "your_google_key_here")
     ABUSEIPDB_API_KEY = os.getenv("ABUSEIPDB_API_KEY", "96707cab41d7ac50b7503d883ccc6fa002cba3245b086e9cf129eaa55b13c12dfe79bfe4ebb6846")
     
-    # URL эндпоинтов
-    VIRUSTOTAL_URL_API = "https://www.virustotal.com/api/v3"
-    GOOGLE_SAFE_BROWSING_API = "https://safebrowsing.googleapis.com/v4"
-    ABUSEIPDB_API = "https://api.abuseipdb.com/api/v2"
+    # URL эндпоинтов (переопределяются для нагрузочных тестов с benchmarks/fake_providers.py)
+    VIRUSTOTAL_URL_API = os.getenv("VIRUSTOTAL_URL_API", "https://www.virustotal.com/api/v3")
+    GOOGLE_SAFE_BROWSING_API = os.getenv("GOOGLE_SAFE_BROWSING_API", "https://safebrowsing.googleapis.com/v4")
+    ABUSEIPDB_API = os.getenv("ABUSEIPDB_API", "https://api.abuseipdb.com/api/v2")
     
     # Настройки таймаутов
     REQUEST_TIMEOUT = 30
@@ -113,11 +115,191 @@ class ExternalAPIConfig:
     # Google Safe Browsing: обычно 10000 запросов в сутки
     GOOGLE_DAILY_LIMIT = int(os.getenv("GOOGLE_DAILY_LIMIT", "10000"))
 
+class WebSocketConfig:
+    """Конфигурация WebSocket подключений"""
+    # Размер очереди исходящих сообщений на одного клиента
+    WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    # Таймаут отправки одного сообщения (сек) - медленный клиент отключается
+    WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+    # Таймаут heartbeat (сек) и период проверки устаревших соединений
+    WS_HEARTBEAT_TIMEOUT = int(os.getenv("WS_HEARTBEAT_TIMEOUT", "90"))
+    WS_SWEEP_INTERVAL = int(os.getenv("WS_SWEEP_INTERVAL", "5"))
+
+class EventBusConfig:
+    """Конфигурация межпроцессной шины событий (PostgreSQL LISTEN/NOTIFY)"""
+    EVENT_BUS_ENABLED = os.getenv("EVENT_BUS_ENABLED", "true").lower() == "true"
+    EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "avqon_events")
+    # Окно накопления событий перед отправкой пачкой (мс) и максимальный размер пачки
+    EVENT_BUS_FLUSH_INTERVAL_MS = int(os.getenv("EVENT_BUS_FLUSH_INTERVAL_MS", "50"))
+    EVENT_BUS_MAX_BATCH = int(os.getenv("EVENT_BUS_MAX_BATCH", "100"))
+
+class BackgroundJobConfig:
+    """Конфигурация очереди фоновых задач"""
+    # Количество параллельных обработчиков в одном процессе
+    BACKGROUND_JOB_CONCURRENCY = int(os.getenv("BACKGROUND_JOB_CONCURRENCY", "4"))
+    # Канал NOTIFY о новых задачах и резервный интервал опроса (сек), если уведомление потеряно
+    BACKGROUND_JOB_CHANNEL = os.getenv("BACKGROUND_JOB_CHANNEL", "background_jobs")
+    BACKGROUND_JOB_POLL_INTERVAL = int(os.getenv("BACKGROUND_JOB_POLL_INTERVAL", "30"))
+    BACKGROUND_JOB_MAX_RETRIES = int(os.getenv("BACKGROUND_JOB_MAX_RETRIES", "3"))
+    # Задачи, зависшие в 'processing' дольше этого времени (сек), возвращаются в очередь
+    BACKGROUND_JOB_STALE_TIMEOUT = int(os.getenv("BACKGROUND_JOB_STALE_TIMEOUT", "600"))
+    # Экспоненциальная задержка повтора: base * 2^retry_count, не больше max (сек)
+    BACKGROUND_JOB_RETRY_BASE_DELAY = int(os.getenv("BACKGROUND_JOB_RETRY_BASE_DELAY", "30"))
+    BACKGROUND_JOB_RETRY_MAX_DELAY = int(os.getenv("BACKGROUND_JOB_RETRY_MAX_DELAY", "3600"))
+
+class CacheRevalidationConfig:
+    """Конфигурация фоновой перепроверки локального кэша (whitelist/blacklist)"""
+    CACHE_REVALIDATION_ENABLED = os.getenv("CACHE_REVALIDATION_ENABLED", "true").lower() == "true"
+    # Период цикла (сек) и возраст записи, после которого её пора перепроверить (сек)
+    CACHE_REVALIDATION_INTERVAL = int(os.getenv("CACHE_REVALIDATION_INTERVAL", "300"))
+    CACHE_REVALIDATION_REFRESH_AFTER = int(os.getenv("CACHE_REVALIDATION_REFRESH_AFTER", "72000"))
+    # Максимум записей за цикл и число одновременных проверок
+    CACHE_REVALIDATION_BATCH = int(os.getenv("CACHE_REVALIDATION_BATCH", "50"))
+    CACHE_REVALIDATION_CONCURRENCY = int(os.getenv("CACHE_REVALIDATION_CONCURRENCY", "4"))
+    # Доля часового лимита VirusTotal, которую может расходовать ревалидация
+    CACHE_REVALIDATION_QUOTA_SHARE = float(os.getenv("CACHE_REVALIDATION_QUOTA_SHARE", "0.2"))
+
+class FileAnalysisConfig:
+    """Конфигурация анализа загружаемых файлов"""
+    # Каталог с дополнительными сигнатурными правилами (*.json)
+    SIGNATURE_RULES_DIR = os.getenv("SIGNATURE_RULES_DIR", "rules/signatures")
+    # Каталог с дополнительными записями таблицы типов файлов (*.json)
+    FILE_TYPES_DIR = os.getenv("FILE_TYPES_DIR", "rules/filetypes")
+    # Время хранения полного результата анализа загрузки по SHA-256 (сек, 0 - без кэша)
+    UPLOAD_RESULT_CACHE_TTL = int(os.getenv("UPLOAD_RESULT_CACHE_TTL", "86400"))
+    # Пул процессов для сканирования (0 - сканировать в потоках основного процесса)
+    FILE_ANALYSIS_WORKERS = int(os.getenv("FILE_ANALYSIS_WORKERS", "2"))
+    # Максимум задач в очереди пула (ожидающие + выполняющиеся); сверх лимита - 503
+    FILE_ANALYSIS_MAX_QUEUE = int(os.getenv("FILE_ANALYSIS_MAX_QUEUE", "8"))
+    # Таймаут сканирования одного файла (сек); зависший процесс перезапускается
+    FILE_ANALYSIS_JOB_TIMEOUT = float(os.getenv("FILE_ANALYSIS_JOB_TIMEOUT", "30"))
+    # Файлы не больше этого размера (байт) сканируются в потоке без передачи в пул
+    FILE_ANALYSIS_INLINE_MAX_BYTES = int(os.getenv("FILE_ANALYSIS_INLINE_MAX_BYTES", str(256 * 1024)))
+    FILE_ANALYSIS_START_METHOD = os.getenv("FILE_ANALYSIS_START_METHOD", "spawn")
+    # Каталог YARA-правил (*.yar, *.yara) и кэш скомпилированного байткода
+    YARA_RULES_DIR = os.getenv("YARA_RULES_DIR", "rules/yara")
+    YARA_CACHE_DIR = os.getenv("YARA_CACHE_DIR", "data/yara_cache")
+    # Период проверки изменений каталога правил (сек, 0 - без горячей перезагрузки)
+    YARA_RELOAD_INTERVAL = int(os.getenv("YARA_RELOAD_INTERVAL", "60"))
+    # Таймаут сканирования одного файла YARA-правилами (сек)
+    YARA_SCAN_TIMEOUT = int(os.getenv("YARA_SCAN_TIMEOUT", "10"))
+    # Оценка угрозы для правил без meta threat_score
+    YARA_DEFAULT_THREAT_SCORE = int(os.getenv("YARA_DEFAULT_THREAT_SCORE", "60"))
+    # Обход ZIP-архивов и ограничения против zip-бомб (общие для вложенных архивов)
+    ARCHIVE_INSPECTION_ENABLED = os.getenv("ARCHIVE_INSPECTION_ENABLED", "true").lower() == "true"
+    ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "1000"))
+    ARCHIVE_MAX_TOTAL_BYTES = int(os.getenv("ARCHIVE_MAX_TOTAL_BYTES", str(256 * 1024 * 1024)))
+    ARCHIVE_MAX_DEPTH = int(os.getenv("ARCHIVE_MAX_DEPTH", "3"))
+    # Максимальная степень сжатия файла; проверяется для файлов от ARCHIVE_RATIO_MIN_BYTES
+    ARCHIVE_MAX_RATIO = int(os.getenv("ARCHIVE_MAX_RATIO", "100"))
+    ARCHIVE_RATIO_MIN_BYTES = int(os.getenv("ARCHIVE_RATIO_MIN_BYTES", str(1024 * 1024)))
+
+class UrlHeuristicConfig:
+    """Конфигурация эвристического анализа URL"""
+    # Дополнительные правила (JSON: dangerous_patterns, suspicious_tlds) к встроенным
+    URL_HEURISTIC_RULES_FILE = os.getenv("URL_HEURISTIC_RULES_FILE", "rules/url_heuristics.json")
+
+class TrustedDomainConfig:
+    """Конфигурация списков доверенных доменов"""
+    # Каталог со списками доменов (*.txt, *.csv, *.list) и таблица trusted_domains
+    TRUSTED_DOMAINS_DIR = os.getenv("TRUSTED_DOMAINS_DIR", "rules/trusted_domains")
+    TRUSTED_DOMAINS_TABLE_ENABLED = os.getenv("TRUSTED_DOMAINS_TABLE_ENABLED", "true").lower() == "true"
+    # Полный Public Suffix List (https://publicsuffix.org/list/public_suffix_list.dat);
+    # без файла используется встроенная часть списка
+    PUBLIC_SUFFIX_LIST_FILE = os.getenv("PUBLIC_SUFFIX_LIST_FILE", "rules/public_suffix_list.dat")
+    # Период проверки изменений списков (сек, 0 - без горячей перезагрузки)
+    TRUSTED_DOMAINS_RELOAD_INTERVAL = int(os.getenv("TRUSTED_DOMAINS_RELOAD_INTERVAL", "60"))
+
+class ThreatFeedConfig:
+    """Конфигурация загрузки фидов угроз (списки URL и хэшей)"""
+    # Каталог, из которого админка и фоновые задачи берут файлы фидов
+    THREAT_FEEDS_DIR = os.getenv("THREAT_FEEDS_DIR", "data/feeds")
+    # Значения по умолчанию для строк фида без своих колонок
+    THREAT_FEED_URL_THREAT_TYPE = os.getenv("THREAT_FEED_URL_THREAT_TYPE", "malware")
+    THREAT_FEED_HASH_THREAT_TYPE = os.getenv("THREAT_FEED_HASH_THREAT_TYPE", "malware")
+    THREAT_FEED_SEVERITY = os.getenv("THREAT_FEED_SEVERITY", "high")
+
+class VerdictCacheConfig:
+    """Конфигурация кэша вердиктов уровня хоста/домена"""
+    # Время жизни свидетельств по хосту/домену (сек, 0 - кэш доменов выключен)
+    DOMAIN_VERDICT_TTL = int(os.getenv("DOMAIN_VERDICT_TTL", "21600"))
+    # Минимальная уверенность безопасного вердикта URL, чтобы он учитывался для домена
+    DOMAIN_VERDICT_MIN_CONFIDENCE = int(os.getenv("DOMAIN_VERDICT_MIN_CONFIDENCE", "70"))
+    # Сколько разных безопасных URL нужно, чтобы вердикт хоста/регистрируемого домена заменял проверку URL
+    DOMAIN_VERDICT_HOST_MIN_URLS = int(os.getenv("DOMAIN_VERDICT_HOST_MIN_URLS", "2"))
+    DOMAIN_VERDICT_DOMAIN_MIN_URLS = int(os.getenv("DOMAIN_VERDICT_DOMAIN_MIN_URLS", "5"))
+    # Доля URL, которые проверяются полностью даже при наличии вердикта домена
+    DOMAIN_VERDICT_SAMPLE_RATE = float(os.getenv("DOMAIN_VERDICT_SAMPLE_RATE", "0.02"))
+    # Потолок уверенности вердикта, выданного по домену
+    DOMAIN_VERDICT_MAX_CONFIDENCE = int(os.getenv("DOMAIN_VERDICT_MAX_CONFIDENCE", "80"))
+    DOMAIN_VERDICT_MEMORY_ENTRIES = int(os.getenv("DOMAIN_VERDICT_MEMORY_ENTRIES", "10000"))
+    # Сколько держать в памяти отметку об опасных URL хоста/домена (или её отсутствие), сек
+    DOMAIN_VERDICT_BAD_MEMORY_TTL = int(os.getenv("DOMAIN_VERDICT_BAD_MEMORY_TTL", "10"))
+
+class MetricsConfig:
+    """Конфигурация метрик Prometheus (/metrics)"""
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Bearer-токен для /metrics; без него доступ только с X-Admin-Token (ADMIN_API_TOKEN)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    # Открыть /metrics без токена (только если эндпоинт закрыт на уровне сети)
+    METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+    # Период снятия gauge-метрик: WebSocket, пул анализа, лимиты API, очередь задач (сек)
+    METRICS_SAMPLE_INTERVAL = int(os.getenv("METRICS_SAMPLE_INTERVAL", "15"))
+
+class TracingConfig:
+    """Конфигурация трассировки этапов анализа (timings / Server-Timing)"""
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+    # Заголовок и параметр запроса, которыми клиент включает трассу
+    TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace-Timings")
+    TRACE_QUERY_PARAM = os.getenv("TRACE_QUERY_PARAM", "timings")
+    # Доля запросов, трассируемых без запроса клиента (только в буфер для админки)
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+    # Сколько последних трасс хранить в памяти процесса
+    TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+class StartupConfig:
+    """Конфигурация запуска процесса: отложенное обслуживание после старта"""
+    # Через сколько секунд после готовности запускать полные проходы (кэш, логи) и прогрев (сек)
+    STARTUP_MAINTENANCE_DELAY = float(os.getenv("STARTUP_MAINTENANCE_DELAY", "5"))
+    # Компилировать сигнатуры фоном после старта (false - при первой проверке файла)
+    STARTUP_WARM_SIGNATURES = os.getenv("STARTUP_WARM_SIGNATURES", "true").lower() == "true"
+
+class SerializationConfig:
+    """Конфигурация сериализации JSON (ответы API, диск-кэш, payload в PostgreSQL)"""
+    # auto - orjson, если установлен; json - только стандартная библиотека
+    SERIALIZER = os.getenv("SERIALIZER", "auto").lower()
+
+class SearchConfig:
+    """Конфигурация поиска по таблицам угроз и кэша в админке (pg_trgm)"""
+    # Минимальная схожесть для нечетких совпадений (оператор % pg_trgm, 0..1)
+    SEARCH_SIMILARITY_THRESHOLD = float(os.getenv("SEARCH_SIMILARITY_THRESHOLD", "0.3"))
+    # Короче трех символов триграммный индекс не помогает - такие запросы не выполняются
+    SEARCH_MIN_TERM_LENGTH = int(os.getenv("SEARCH_MIN_TERM_LENGTH", "3"))
+    SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "200"))
+    # Глубина страниц: каждая страница читает offset + limit ближайших строк по индексу
+    SEARCH_MAX_OFFSET = int(os.getenv("SEARCH_MAX_OFFSET", "1000"))
+    # Создавать pg_trgm и GIN-индексы поиска при отложенном обслуживании после старта
+    SEARCH_ENSURE_INDEXES = os.getenv("SEARCH_ENSURE_INDEXES", "true").lower() == "true"
+
 # Создаем экземпляры конфигураций
 logging_config = LoggingConfig()
 security_config = SecurityConfig()
 external_config = ExternalAPIConfig()
 server_config = ServerConfig()
+websocket_config = WebSocketConfig()
+event_bus_config = EventBusConfig()
+background_job_config = BackgroundJobConfig()
+cache_revalidation_config = CacheRevalidationConfig()
+file_analysis_config = FileAnalysisConfig()
+url_heuristic_config = UrlHeuristicConfig()
+trusted_domain_config = TrustedDomainConfig()
+threat_feed_config = ThreatFeedConfig()
+verdict_cache_config = VerdictCacheConfig()
+metrics_config = MetricsConfig()
+tracing_config = TracingConfig()
+startup_config = StartupConfig()
+serialization_config = SerializationConfig()
+search_config = SearchConfig()
 
 # Для обратной совместимости
 config = ExternalAPIConfig()
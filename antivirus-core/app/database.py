@@ -8,12 +8,79 @@ from typing import Dict, List, Any, Optional, Tuple
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
 from pathlib import Path
+import time
 import psycopg2
 import psycopg2.extras
 
+from app.config import search_config
+from app.metrics import DB_CONNECT_ERRORS, DB_CONNECT_SECONDS
+from app.serialization import dumps, loads
+
 # Настраиваем логирование
 logger = logging.getLogger(__name__)
 
+# JSONB-колонки разбираются тем же сериализатором, что и остальные payload
+psycopg2.extras.register_default_jsonb(globally=True, loads=loads)
+
+# Таблицы угроз для загрузки фидов: (таблица, ключевая колонка, остальные колонки строки фида)
+THREAT_FEED_TABLES = {
+    "url": ("malicious_urls", "url", ("domain", "threat_type", "severity", "description")),
+    "hash": ("malicious_hashes", "hash", ("threat_type", "severity", "description")),
+}
+
+
+class _CopyRowStream:
+    """Файлоподобный поток для COPY ... FROM STDIN (text-формат) поверх итератора кортежей"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self.rows = 0
+
+    @staticmethod
+    def _escape(value: Any) -> str:
+        if value is None:
+            return "\\N"
+        return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    def read(self, size: int = -1) -> str:
+        chunks, length = [self._buffer], len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = "\t".join(self._escape(value) for value in row) + "\n"
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+# Таблицы поиска в админке: (выбираемые колонки, ключ строки, колонки с триграммным индексом, колонка свежести)
+SEARCH_TABLES = {
+    "malicious_urls": (
+        "url, domain, threat_type, severity, description, source, first_detected, last_updated, detection_count",
+        "url", ("url", "domain"), "last_updated"),
+    "cached_blacklist": (
+        "url_hash, url, domain, threat_type, details, source, first_seen, last_seen, hit_count",
+        "url_hash", ("url", "domain"), "last_seen"),
+    "cached_whitelist": (
+        "domain, details, detection_ratio, confidence, source, first_seen, last_seen, hit_count",
+        "domain", ("domain",), "last_seen"),
+}
+# Ключ advisory-блокировки: индексы поиска строит один воркер, остальные пропускают шаг
+SEARCH_INDEX_LOCK_ID = 7305110143
+
+# Поля вердикта, хранящиеся в отдельных колонках whitelist/blacklist: в payload они не дублируются
+WHITELIST_COLUMNS = ("details", "detection_ratio", "confidence", "source")
+BLACKLIST_COLUMNS = ("details", "threat_type", "source")
+
 class DatabaseManager:
     """
     Менеджер базы данных для PostgreSQL.
@@ -38,6 +105,9 @@ class DatabaseManager:
         if not (self.db_scheme.startswith("postgresql") or self.db_scheme.startswith("postgres")):
             raise ValueError(f"Only PostgreSQL is supported, got: {self.db_scheme}")
 
+        # Установлен ли pg_trgm (определяется при первом поиске или ensure_search_indexes)
+        self._trgm_available: Optional[bool] = None
+
         logger.info(f"Initializing PostgreSQL database: {self.db_url[:30]}...")
     
     def _get_connection(self):
@@ -63,6 +133,7 @@ class DatabaseManager:
         max_retries = 3
         retry_delay = 0.5
         
+        started = time.perf_counter()
         for attempt in range(max_retries):
             try:
                 conn = psycopg2.connect(
@@ -75,16 +146,18 @@ class DatabaseManager:
                 with conn.cursor() as test_cursor:
                     test_cursor.execute("SELECT 1")
                     test_cursor.fetchone()
+                DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
                 return conn
             except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                DB_CONNECT_ERRORS.inc()
                 if attempt < max_retries - 1:
                     logger.warning(f"PostgreSQL connection error, retrying ({attempt + 1}/{max_retries}): {e}")
-                    import time
                     time.sleep(retry_delay * (attempt + 1))
                     continue
                 logger.error(f"PostgreSQL connection error after {max_retries} attempts: {e}")
                 raise
             except Exception as e:
+                DB_CONNECT_ERRORS.inc()
                 logger.error(f"PostgreSQL connection error: {e}")
                 raise
     
@@ -677,6 +750,46 @@ class DatabaseManager:
             logger.error(f"Hash check error: {e}")
             return None
     
+    def is_malicious_hash(self, file_hash: str) -> bool:
+        """Есть ли хэш в malicious_hashes (без учета обнаружения - для проверки кэшированных вердиктов)."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1 FROM malicious_hashes WHERE hash = %s", (file_hash.lower(),))
+                return cursor.fetchone() is not None
+        except (psycopg2.Error, Exception) as e:
+            logger.error(f"Hash lookup error: {e}")
+            return False
+    
+    def check_hashes(self, file_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Проверяет набор хэшей одним запросом (например, все файлы архива). Возвращает {hash: запись}."""
+        hashes = sorted({file_hash.lower() for file_hash in file_hashes if file_hash})
+        if not hashes:
+            return {}
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                query = """
+                    SELECT hash, threat_type, severity, description, detection_count
+                    FROM malicious_hashes
+                    WHERE hash = ANY(%s)
+                """
+                cursor.execute(self._adapt_query(query), (hashes,))
+                found = {row["hash"]: dict(row) for row in cursor.fetchall()}
+                if found:
+                    query_update = """
+                        UPDATE malicious_hashes
+                        SET detection_count = detection_count + 1,
+                            last_updated = CURRENT_TIMESTAMP
+                        WHERE hash = ANY(%s)
+                    """
+                    cursor.execute(self._adapt_query(query_update), (list(found),))
+                    self._commit_if_needed(conn)
+                return found
+        except (psycopg2.Error, Exception) as e:
+            logger.error(f"Batch hash check error: {e}")
+            return {}
+
     def check_url(self, url: str) -> Optional[Dict[str, Any]]:
         """Проверяет URL в базе данных с улучшенной обработкой ошибок."""
         max_retries = 3
@@ -816,6 +929,85 @@ class DatabaseManager:
             logger.error(f"Add URL error: {e}")
             return False
     
+    def ingest_threat_feed(self, kind: str, rows, source: str, expire_missing: bool = True) -> Dict[str, int]:
+        """
+        Загружает фид угроз одной транзакцией: COPY во временную staging-таблицу и
+        множественный diff с malicious_urls/malicious_hashes.
+
+        rows - итератор кортежей (ключ, *колонки THREAT_FEED_TABLES[kind]), читается потоково.
+        Записи фида помечаются source; изменяются только записи того же source (ручные и
+        других фидов не трогаются), неизменившиеся строки не перезаписываются.
+        expire_missing - удалить записи этого source, которых больше нет в фиде.
+        Для URL в той же транзакции удаляются записи cached_whitelist доменов добавленных
+        и изменившихся угроз: проверка URL смотрит whitelist раньше malicious_urls.
+        """
+        table, key_column, columns = THREAT_FEED_TABLES[kind]
+        column_list = ", ".join(columns)
+        excluded = ", ".join(f"EXCLUDED.{column}" for column in columns)
+        current = ", ".join(f"m.{column}" for column in columns)
+        returning_domain = purge_whitelist = purged_count = ""
+        if kind == "url":
+            returning_domain = ", m.domain"
+            purge_whitelist = """, whitelisted AS (
+                    DELETE FROM cached_whitelist WHERE domain IN (SELECT domain FROM upsert)
+                    RETURNING 1
+                )"""
+            purged_count = ", (SELECT COUNT(*) FROM whitelisted) AS whitelist_purged"
+        stream = _CopyRowStream(rows)
+        conn = self._get_connection()
+        try:
+            conn.autocommit = False
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                CREATE TEMP TABLE feed_staging (
+                    key TEXT NOT NULL,
+                    {", ".join(f"{column} TEXT" for column in columns)}
+                ) ON COMMIT DROP
+            """)
+            cursor.copy_expert(f"COPY feed_staging (key, {column_list}) FROM STDIN", stream, size=1 << 16)
+            cursor.execute("CREATE INDEX ON feed_staging (key)")
+            cursor.execute("ANALYZE feed_staging")
+            # Дубликаты внутри фида схлопываются; ON CONFLICT обновляет только свои изменившиеся строки
+            cursor.execute(f"""
+                WITH feed AS (
+                    SELECT DISTINCT ON (key) key, {column_list} FROM feed_staging ORDER BY key
+                ), upsert AS (
+                    INSERT INTO {table} AS m ({key_column}, {column_list}, source, last_updated)
+                    SELECT key, {column_list}, %s, CURRENT_TIMESTAMP FROM feed
+                    ON CONFLICT ({key_column}) DO UPDATE SET
+                        {", ".join(f"{column} = EXCLUDED.{column}" for column in columns)},
+                        last_updated = CURRENT_TIMESTAMP
+                    WHERE m.source = EXCLUDED.source AND ({current}) IS DISTINCT FROM ({excluded})
+                    RETURNING (xmax = 0) AS inserted{returning_domain}
+                ){purge_whitelist}
+                SELECT COUNT(*) FILTER (WHERE inserted) AS inserted,
+                       COUNT(*) FILTER (WHERE NOT inserted) AS updated{purged_count}
+                FROM upsert
+            """, (source,))
+            counts = cursor.fetchone()
+            expired = 0
+            if expire_missing:
+                cursor.execute(f"""
+                    DELETE FROM {table} m
+                    WHERE m.source = %s
+                      AND NOT EXISTS (SELECT 1 FROM feed_staging s WHERE s.key = m.{key_column})
+                """, (source,))
+                expired = cursor.rowcount
+            conn.commit()
+            return {
+                "received": stream.rows,
+                "inserted": int(counts["inserted"] or 0),
+                "updated": int(counts["updated"] or 0),
+                "expired": expired,
+                "whitelist_purged": int(counts.get("whitelist_purged") or 0),
+            }
+        except (psycopg2.Error, Exception) as e:
+            conn.rollback()
+            logger.error(f"Threat feed ingestion error ({kind}, {source}): {e}")
+            raise
+        finally:
+            conn.close()
+
     # ===== LOCAL SECURITY CACHE METHODS =====
 
     def _extract_domain(self, value: str) -> Optional[str]:
@@ -834,39 +1026,41 @@ class DatabaseManager:
 
     # Метод _append_cache_file удалён - только PostgreSQL
 
-    def get_cached_security(self, url: str) -> Optional[Dict[str, Any]]:
-        """Возвращает сохраненный результат (whitelist/blacklist) для URL."""
+    @staticmethod
+    def _compact_payload(payload: Dict[str, Any], columns: Tuple[str, ...]) -> Optional[psycopg2.extras.Json]:
+        """Остаток ответа без полей, уже сохраненных в колонках (и без safe - он следует из таблицы)"""
+        extra = {key: value for key, value in payload.items() if key != "safe" and key not in columns}
+        return psycopg2.extras.Json(extra, dumps=dumps) if extra else None
+
+    @staticmethod
+    def _expand_payload(row: Dict[str, Any], columns: Tuple[str, ...], safe: bool) -> Dict[str, Any]:
+        """Собирает полный ответ из колонок и компактного payload (JSONB или TEXT до миграции 004)"""
+        raw = row.get("payload")
+        if not raw:
+            extra = {}
+        elif isinstance(raw, (str, bytes)):
+            extra = loads(raw)
+        else:
+            extra = dict(raw)
+        payload = {**extra, "safe": safe}
+        for column in columns:
+            if column in row:
+                payload[column] = row[column]
+        return payload
+
+    def get_cached_security(self, url: str, min_whitelist_confidence: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает сохраненный результат (whitelist/blacklist) для URL.
+
+        Сначала проверяется blacklist по самому URL (известный опасный путь важнее
+        вердикта домена), затем whitelist по домену - только записи с уверенностью
+        не ниже min_whitelist_confidence.
+        """
         domain = self._extract_domain(url)
         url_hash = self._hash_url(url)
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                if domain:
-                    query = "SELECT * FROM cached_whitelist WHERE domain = %s"
-                    cursor.execute(self._adapt_query(query), (domain,))
-                    row = cursor.fetchone()
-                    if row:
-                        query_update = """
-                            UPDATE cached_whitelist
-                            SET hit_count = hit_count + 1,
-                                last_seen = CURRENT_TIMESTAMP
-                            WHERE domain = %s
-                        """
-                        cursor.execute(self._adapt_query(query_update), (domain,))
-                        self._commit_if_needed(conn)
-                        payload = json.loads(row["payload"]) if row["payload"] else None
-                        return {
-                            "safe": True,
-                            "threat_type": None,
-                            "details": row["details"],
-                            "source": row["source"] or "local_whitelist",
-                            "detection_ratio": row["detection_ratio"],
-                            "confidence": row["confidence"],
-                            "storage": "whitelist",
-                            "domain": row["domain"],
-                            "cached_at": row["last_seen"],
-                            "payload": payload
-                        }
                 query = "SELECT * FROM cached_blacklist WHERE url_hash = %s"
                 cursor.execute(self._adapt_query(query), (url_hash,))
                 row = cursor.fetchone()
@@ -879,7 +1073,7 @@ class DatabaseManager:
                     """
                     cursor.execute(self._adapt_query(query_update), (url_hash,))
                     self._commit_if_needed(conn)
-                    payload = json.loads(row["payload"]) if row["payload"] else None
+                    payload = self._expand_payload(row, BLACKLIST_COLUMNS, safe=False)
                     return {
                         "safe": False,
                         "threat_type": row["threat_type"] or "malicious",
@@ -891,6 +1085,32 @@ class DatabaseManager:
                         "cached_at": row["last_seen"],
                         "payload": payload
                     }
+                if domain:
+                    query = "SELECT * FROM cached_whitelist WHERE domain = %s AND COALESCE(confidence, 0) >= %s"
+                    cursor.execute(self._adapt_query(query), (domain, min_whitelist_confidence))
+                    row = cursor.fetchone()
+                    if row:
+                        query_update = """
+                            UPDATE cached_whitelist
+                            SET hit_count = hit_count + 1,
+                                last_seen = CURRENT_TIMESTAMP
+                            WHERE domain = %s
+                        """
+                        cursor.execute(self._adapt_query(query_update), (domain,))
+                        self._commit_if_needed(conn)
+                        payload = self._expand_payload(row, WHITELIST_COLUMNS, safe=True)
+                        return {
+                            "safe": True,
+                            "threat_type": None,
+                            "details": row["details"],
+                            "source": row["source"] or "local_whitelist",
+                            "detection_ratio": row["detection_ratio"],
+                            "confidence": row["confidence"],
+                            "storage": "whitelist",
+                            "domain": row["domain"],
+                            "cached_at": row["last_seen"],
+                            "payload": payload
+                        }
         except (psycopg2.Error, Exception) as e:
             logger.error(f"Cache lookup error: {e}", exc_info=True)
         except json.JSONDecodeError as json_error:
@@ -905,20 +1125,21 @@ class DatabaseManager:
         detection_ratio = payload.get("detection_ratio")
         confidence = payload.get("confidence")
         source = payload.get("source", "external_apis")
-        serialized = json.dumps(payload, ensure_ascii=False)
+        serialized = self._compact_payload(payload, WHITELIST_COLUMNS)
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 query = """
-                    INSERT INTO cached_whitelist (domain, details, detection_ratio, confidence, source, payload)
-                    VALUES (%s, %s, %s, %s, %s, %s)
+                    INSERT INTO cached_whitelist (domain, details, detection_ratio, confidence, source, payload, revalidated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
                     ON CONFLICT(domain) DO UPDATE SET
                         details = EXCLUDED.details,
                         detection_ratio = EXCLUDED.detection_ratio,
                         confidence = EXCLUDED.confidence,
                         source = EXCLUDED.source,
                         payload = EXCLUDED.payload,
-                        last_seen = CURRENT_TIMESTAMP
+                        last_seen = CURRENT_TIMESTAMP,
+                        revalidated_at = CURRENT_TIMESTAMP
                 """
                 cursor.execute(self._adapt_query(query), (domain, details, detection_ratio, confidence, source, serialized))
                 self._commit_if_needed(conn)
@@ -945,13 +1166,13 @@ class DatabaseManager:
         details = payload.get("details")
         threat_type = payload.get("threat_type", "malicious")
         source = payload.get("source", "external_apis")
-        serialized = json.dumps(payload, ensure_ascii=False)
+        serialized = self._compact_payload(payload, BLACKLIST_COLUMNS)
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 query = """
-                    INSERT INTO cached_blacklist (url_hash, url, domain, threat_type, details, source, payload)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    INSERT INTO cached_blacklist (url_hash, url, domain, threat_type, details, source, payload, revalidated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
                     ON CONFLICT(url_hash) DO UPDATE SET
                         url = EXCLUDED.url,
                         domain = EXCLUDED.domain,
@@ -959,7 +1180,8 @@ class DatabaseManager:
                         details = EXCLUDED.details,
                         source = EXCLUDED.source,
                         payload = EXCLUDED.payload,
-                        last_seen = CURRENT_TIMESTAMP
+                        last_seen = CURRENT_TIMESTAMP,
+                        revalidated_at = CURRENT_TIMESTAMP
                 """
                 cursor.execute(self._adapt_query(query), (url_hash, url, domain, threat_type, details, source, serialized))
                 self._commit_if_needed(conn)
@@ -979,34 +1201,41 @@ class DatabaseManager:
             return False
 
     def get_cache_stats(self) -> Dict[str, Any]:
-        """Возвращает статистику локального кэша."""
+        """
+        Возвращает статистику локального кэша.
+
+        Значения берутся из cache_stats, которую ведут триггеры (migrations/004);
+        без нее - подсчет по таблицам целиком.
+        """
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) as count, SUM(hit_count) as hits FROM cached_whitelist")
-                whitelist_row = cursor.fetchone()
-                cursor.execute("SELECT COUNT(*) as count, SUM(hit_count) as hits FROM cached_blacklist")
-                blacklist_row = cursor.fetchone()
-                cursor.execute("""
-                    SELECT COALESCE(SUM(LENGTH(COALESCE(payload, '')) + LENGTH(COALESCE(details, '')) + LENGTH(COALESCE(url, ''))), 0) as sum_bytes
-                    FROM cached_blacklist
-                """)
-                blacklist_result = cursor.fetchone()
-                blacklist_bytes = blacklist_result["sum_bytes"] if blacklist_result else 0
-                cursor.execute("""
-                    SELECT COALESCE(SUM(LENGTH(COALESCE(payload, '')) + LENGTH(COALESCE(details, '')) + LENGTH(COALESCE(domain, ''))), 0) as sum_bytes
-                    FROM cached_whitelist
-                """)
-                whitelist_result = cursor.fetchone()
-                whitelist_bytes = whitelist_result["sum_bytes"] if whitelist_result else 0
-                total_entries = (whitelist_row["count"] or 0) + (blacklist_row["count"] or 0)
+                cursor.execute("SELECT to_regclass('cache_stats') IS NOT NULL AS ready")
+                if cursor.fetchone()["ready"]:
+                    cursor.execute("""
+                        SELECT store, SUM(entries) AS count, SUM(hits) AS hits, SUM(bytes) AS bytes
+                        FROM cache_stats GROUP BY store
+                    """)
+                    stores = {row["store"]: row for row in cursor.fetchall()}
+                else:
+                    stores = {}
+                    for store, table in (("whitelist", "cached_whitelist"), ("blacklist", "cached_blacklist")):
+                        cursor.execute(f"""
+                            SELECT COUNT(*) AS count, SUM(hit_count) AS hits, SUM(pg_column_size(t)) AS bytes
+                            FROM {table} t
+                        """)
+                        stores[store] = cursor.fetchone()
+                whitelist_row = stores.get("whitelist") or {}
+                blacklist_row = stores.get("blacklist") or {}
+                whitelist_entries = int(whitelist_row.get("count") or 0)
+                blacklist_entries = int(blacklist_row.get("count") or 0)
                 return {
-                    "whitelist_entries": whitelist_row["count"] or 0,
-                    "blacklist_entries": blacklist_row["count"] or 0,
-                    "whitelist_hits": whitelist_row["hits"] or 0,
-                    "blacklist_hits": blacklist_row["hits"] or 0,
-                    "bytes_estimated": int(whitelist_bytes + blacklist_bytes),
-                    "total_entries": total_entries
+                    "whitelist_entries": whitelist_entries,
+                    "blacklist_entries": blacklist_entries,
+                    "whitelist_hits": int(whitelist_row.get("hits") or 0),
+                    "blacklist_hits": int(blacklist_row.get("hits") or 0),
+                    "bytes_estimated": int((whitelist_row.get("bytes") or 0) + (blacklist_row.get("bytes") or 0)),
+                    "total_entries": whitelist_entries + blacklist_entries
                 }
         except (psycopg2.Error, Exception) as e:
             logger.error(f"Cache stats error: {e}")
@@ -1027,22 +1256,154 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 query = f"SELECT * FROM {table} ORDER BY last_seen ASC LIMIT %s"
                 cursor.execute(self._adapt_query(query), (limit,))
+                columns = WHITELIST_COLUMNS if store == 'whitelist' else BLACKLIST_COLUMNS
                 rows = []
                 for row in cursor.fetchall():
-                    payload = None
-                    if row["payload"]:
-                        try:
-                            payload = json.loads(row["payload"])
-                        except json.JSONDecodeError:
-                            payload = None
                     entry = dict(row)
-                    entry["payload"] = payload
+                    try:
+                        entry["payload"] = self._expand_payload(row, columns, safe=store == 'whitelist')
+                    except json.JSONDecodeError:
+                        entry["payload"] = None
                     rows.append(entry)
                 return rows
         except (psycopg2.Error, Exception) as e:
             logger.error(f"Fetch cached entries error: {e}")
             return []
 
+    def get_revalidation_candidates(self, limit: int, refresh_after_seconds: int) -> List[Dict[str, Any]]:
+        """
+        Возвращает записи whitelist/blacklist, которые пора перепроверить.
+
+        Кандидаты - записи, проверенные раньше refresh_after_seconds назад;
+        порядок - по популярности: hit_count, ослабленный давностью last_seen (в часах).
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                query = """
+                    SELECT store, cache_key, url, domain, hit_count, last_seen, revalidated_at
+                    FROM (
+                        SELECT 'whitelist' AS store, domain AS cache_key, NULL AS url, domain,
+                               hit_count, last_seen, revalidated_at
+                        FROM cached_whitelist
+                        WHERE COALESCE(revalidated_at, first_seen) < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                        UNION ALL
+                        SELECT 'blacklist' AS store, url_hash AS cache_key, url, domain,
+                               hit_count, last_seen, revalidated_at
+                        FROM cached_blacklist
+                        WHERE COALESCE(revalidated_at, first_seen) < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                    ) AS candidates
+                    ORDER BY COALESCE(hit_count, 1)
+                             / (1.0 + EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - last_seen)) / 3600.0) DESC
+                    LIMIT %s
+                """
+                cursor.execute(self._adapt_query(query), (refresh_after_seconds, refresh_after_seconds, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except (psycopg2.Error, Exception) as e:
+            logger.error(f"Fetch revalidation candidates error: {e}")
+            return []
+
+    def mark_cache_revalidated(self, store: str, cache_key: str) -> bool:
+        """Отмечает запись как перепроверенную без изменения вердикта."""
+        if store == 'whitelist':
+            query = "UPDATE cached_whitelist SET revalidated_at = CURRENT_TIMESTAMP WHERE domain = %s"
+        else:
+            query = "UPDATE cached_blacklist SET revalidated_at = CURRENT_TIMESTAMP WHERE url_hash = %s"
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self._adapt_query(query), (cache_key,))
+                self._commit_if_needed(conn)
+                return cursor.rowcount > 0
+        except (psycopg2.Error, Exception) as e:
+            logger.error(f"Mark cache revalidated error: {e}")
+            return False
+
+    def record_provider_usage(self, provider: str, requests: int = 1) -> bool:
+        """Учитывает запросы к внешнему API в поминутном счетчике provider_usage, общем для всех воркеров."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO provider_usage (provider, minute, requests)
+                    VALUES (%s, date_trunc('minute', CURRENT_TIMESTAMP), %s)
+                    ON CONFLICT (provider, minute)
+                    DO UPDATE SET requests = provider_usage.requests + EXCLUDED.requests
+                """, (provider, requests))
+                return True
+        except (psycopg2.Error, Exception) as e:
+            logger.warning(f"Record provider usage error: {e}")
+            return False
+
+    def get_provider_usage(self, window_seconds: int = 3600) -> Optional[Dict[str, int]]:
+        """Число запросов по провайдерам за последние window_seconds (по всем воркерам) или None при ошибке."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT provider, SUM(requests) AS requests
+                    FROM provider_usage
+                    WHERE minute > CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                    GROUP BY provider
+                """, (window_seconds,))
+                return {row["provider"]: int(row["requests"]) for row in cursor.fetchall()}
+        except (psycopg2.Error, Exception) as e:
+            logger.warning(f"Fetch provider usage error: {e}")
+            return None
+
+    def purge_provider_usage(self, keep_seconds: int = 86400) -> int:
+        """Удаляет счетчики provider_usage старше keep_seconds."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM provider_usage WHERE minute < CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')",
+                               (keep_seconds,))
+                return cursor.rowcount
+        except (psycopg2.Error, Exception) as e:
+            logger.warning(f"Purge provider usage error: {e}")
+            return 0
+
+    def remove_cached_whitelist_domain(self, domain: str) -> bool:
+        """Удаляет домен из cached_whitelist."""
+        try:
+            domain = self._extract_domain(domain)
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                query = "DELETE FROM cached_whitelist WHERE domain = %s"
+                cursor.execute(self._adapt_query(query), (domain,))
+                self._commit_if_needed(conn)
+                deleted = cursor.rowcount > 0
+                if deleted:
+                    logger.info(f"Removed domain from whitelist cache: {domain}")
+                return deleted
+        except (psycopg2.Error, Exception) as e:
+            logger.error(f"Remove cached whitelist domain error: {e}")
+            return False
+
+    def get_trusted_domains(self) -> List[Tuple[str, bool]]:
+        """Список доверенных доменов из таблицы trusted_domains: (домен, включая поддомены)."""
+        try:
+            with self._get_connection() as conn:
+                # Обычный курсор (кортежи вместо словарей) - списки бывают на сотни тысяч строк
+                cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+                cursor.execute("SELECT domain, include_subdomains FROM trusted_domains")
+                return [(domain, bool(include_subdomains)) for domain, include_subdomains in cursor.fetchall()]
+        except (psycopg2.Error, Exception) as e:
+            logger.error(f"Get trusted domains error: {e}")
+            return []
+
+    def get_trusted_domains_version(self) -> Optional[str]:
+        """Дешёвый признак изменения таблицы trusted_domains (число строк и время последнего изменения)."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) AS total, MAX(updated_at) AS updated FROM trusted_domains")
+                row = cursor.fetchone()
+                return f"{row['total']}:{row['updated']}" if row else None
+        except (psycopg2.Error, Exception) as e:
+            logger.warning(f"Get trusted domains version error: {e}")
+            return None
+
     # ===== STATISTICS AND ADMIN METHODS =====
     
     def get_database_stats(self) -> Dict[str, Any]:
@@ -1807,59 +2168,158 @@ class DatabaseManager:
         removed_blacklist = self.remove_cached_blacklist_url(url)
         return removed_malicious or removed_blacklist
     
-    def search_urls_in_database(self, search_term: str, limit: int = 100) -> Dict[str, List[Dict[str, Any]]]:
-        """Ищет URL в базе данных по частичному совпадению."""
-        results = {
-            "malicious_urls": [],
-            "cached_blacklist": [],
-            "cached_whitelist": []
-        }
-        search_lower = search_term.lower()
-        
+    def search_urls_in_database(self, search_term: str, limit: int = 100, offset: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+        """Ищет URL в базе данных по частичному совпадению (ранжированно, см. search)."""
+        found = self.search(search_term, limit=limit, offset=offset)
+        return {table: result["items"] for table, result in found["results"].items()}
+
+    def search(self, search_term: str, tables: Optional[List[str]] = None,
+               limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """
+        Поиск по malicious_urls, cached_blacklist и cached_whitelist с пагинацией.
+
+        С pg_trgm подстрока и нечеткие совпадения ищутся по GiST-индексам в порядке
+        триграммного расстояния (KNN), без сортировки всех совпадений; глубина
+        страниц ограничена SEARCH_MAX_OFFSET. Без расширения - LIKE по свежести записи.
+        Для каждой таблицы возвращаются items, has_more и next_offset.
+        """
+        tables = list(tables or SEARCH_TABLES)
+        unknown = [table for table in tables if table not in SEARCH_TABLES]
+        if unknown:
+            raise ValueError(f"Unknown search tables: {', '.join(unknown)}")
+        term = search_term.strip().lower()
+        limit = max(1, min(limit, search_config.SEARCH_MAX_LIMIT))
+        offset = max(0, min(offset, search_config.SEARCH_MAX_OFFSET))
+        results = {table: {"items": [], "has_more": False, "next_offset": None} for table in tables}
+        found = {"query": term, "ranked": False, "limit": limit, "offset": offset, "results": results}
+        if len(term) < search_config.SEARCH_MIN_TERM_LENGTH:
+            return found
+
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                
-                # Поиск в malicious_urls
-                query = """
-                    SELECT url, domain, threat_type, severity, description, 
-                           source, first_detected, last_updated, detection_count
-                    FROM malicious_urls
-                    WHERE url LIKE %s OR domain LIKE %s
-                    ORDER BY last_updated DESC
-                    LIMIT %s
-                """
-                cursor.execute(self._adapt_query(query), (f"%{search_lower}%", f"%{search_lower}%", limit))
-                results["malicious_urls"] = [dict(row) for row in cursor.fetchall()]
-                
-                # Поиск в cached_blacklist
-                query = """
-                    SELECT url_hash, url, domain, threat_type, details, source,
-                           first_seen, last_seen, hit_count
-                    FROM cached_blacklist
-                    WHERE url LIKE %s OR domain LIKE %s
-                    ORDER BY last_seen DESC
-                    LIMIT %s
-                """
-                cursor.execute(self._adapt_query(query), (f"%{search_lower}%", f"%{search_lower}%", limit))
-                results["cached_blacklist"] = [dict(row) for row in cursor.fetchall()]
-                
-                # Поиск в cached_whitelist
-                query = """
-                    SELECT domain, details, detection_ratio, confidence, source,
-                           first_seen, last_seen, hit_count
-                    FROM cached_whitelist
-                    WHERE domain LIKE %s
-                    ORDER BY last_seen DESC
-                    LIMIT %s
-                """
-                cursor.execute(self._adapt_query(query), (f"%{search_lower}%", limit))
-                results["cached_whitelist"] = [dict(row) for row in cursor.fetchall()]
-                
+                ranked = self._search_uses_trgm(cursor)
+                if ranked:
+                    cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, false)",
+                                   (str(search_config.SEARCH_SIMILARITY_THRESHOLD),))
+                found["ranked"] = ranked
+                for table in tables:
+                    items = self._search_table(cursor, table, term, limit + 1, offset, ranked)
+                    has_more = len(items) > limit
+                    results[table] = {
+                        "items": items[:limit],
+                        "has_more": has_more,
+                        "next_offset": offset + limit if has_more else None,
+                    }
         except (psycopg2.Error, Exception) as e:
             logger.error(f"Search URLs error: {e}")
-        
-        return results
+
+        return found
+
+    def _search_table(self, cursor, table: str, term: str, limit: int, offset: int,
+                      ranked: bool) -> List[Dict[str, Any]]:
+        select, key, columns, recency = SEARCH_TABLES[table]
+        # Подстрока ищется буквально: % и _ в URL не должны работать как шаблоны LIKE
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        if ranked:
+            # По каждой колонке две ветки с одним условием, которое служит условием индекса:
+            # нечеткие совпадения (%) и подстрока (LIKE). Условие через OR индекс не отсекает -
+            # оно проверялось бы на каждой строке обхода, и редкий терм читал бы всю таблицу.
+            # Каждая ветка берет ближайшие offset + limit строк (ORDER BY <->), лучшие строки
+            # страницы всегда среди кандидатов, остальные совпадения не ранжируются
+            branches = []
+            params: List[Any] = []
+            for column in columns:
+                for condition, value in ((f"{column} %% %s", term), (f"{column} LIKE %s", pattern)):
+                    branches.append(f"""
+                    (SELECT {select}, {key} AS search_key, {column} <-> %s AS distance
+                     FROM {table}
+                     WHERE {condition}
+                     ORDER BY {column} <-> %s
+                     LIMIT %s)""")
+                    params += [term, value, term, offset + limit]
+            query = f"""
+                SELECT * FROM (
+                    SELECT DISTINCT ON (search_key) *
+                    FROM ({" UNION ALL ".join(branches)}) AS candidates
+                    ORDER BY search_key, distance
+                ) AS best
+                ORDER BY distance, {recency} DESC
+                LIMIT %s OFFSET %s
+            """
+        else:
+            match = " OR ".join(f"{column} LIKE %s" for column in columns)
+            query = f"""
+                SELECT {select}
+                FROM {table}
+                WHERE {match}
+                ORDER BY {recency} DESC
+                LIMIT %s OFFSET %s
+            """
+            params = [pattern] * len(columns)
+        cursor.execute(query, (*params, limit, offset))
+        items = [dict(row) for row in cursor.fetchall()]
+        for item in items:
+            item.pop("search_key", None)
+            distance = item.pop("distance", None)
+            if distance is not None:
+                item["score"] = round(1 - float(distance), 3)
+        return items
+
+    def _search_uses_trgm(self, cursor) -> bool:
+        if self._trgm_available is None:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            self._trgm_available = cursor.fetchone() is not None
+        return self._trgm_available
+
+    def ensure_search_indexes(self) -> Dict[str, Any]:
+        """
+        Создает расширение pg_trgm и GiST-индексы поиска (CONCURRENTLY, без блокировки
+        записи). Индексы, оставшиеся невалидными после прерванной сборки, пересоздаются;
+        прежние GIN-индексы (не поддерживают сортировку по расстоянию) удаляются.
+        Выполняется одним воркером: пока другой держит advisory-блокировку, шаг пропускается -
+        иначе чужая идущая сборка (indisvalid = false) была бы удалена и начата заново.
+        """
+        created: List[str] = []
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (SEARCH_INDEX_LOCK_ID,))
+            if not cursor.fetchone()["acquired"]:
+                logger.info("Search indexes are being built by another worker, skipping")
+                return {"skipped": "locked", "created": created}
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except psycopg2.Error as e:
+                logger.warning(f"pg_trgm is not available, admin search falls back to LIKE: {e}")
+            self._trgm_available = None
+            if not self._search_uses_trgm(cursor):
+                return {"trgm": False, "created": created}
+
+            for table, (_, _, columns, _) in SEARCH_TABLES.items():
+                for column in columns:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS idx_{table}_{column}_trgm")
+                    name = f"idx_{table}_{column}_trgm_gist"
+                    cursor.execute("""
+                        SELECT i.indisvalid
+                        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = %s
+                    """, (name,))
+                    row = cursor.fetchone()
+                    if row and row["indisvalid"]:
+                        continue
+                    if row:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                    started = time.perf_counter()
+                    cursor.execute(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gist ({column} gist_trgm_ops)"
+                    )
+                    created.append(name)
+                    logger.info(f"Created search index {name} in {time.perf_counter() - started:.1f}s")
+            return {"trgm": True, "created": created}
+        finally:
+            # Закрытие сессии снимает advisory-блокировку
+            conn.close()
     
     def get_all_cached_whitelist(self, limit: int = 1000) -> List[Dict[str, Any]]:
         """Возвращает все записи из whitelist кэша."""
@@ -1876,11 +2336,10 @@ class DatabaseManager:
                 rows = []
                 for row in cursor.fetchall():
                     entry = dict(row)
-                    if entry["payload"]:
-                        try:
-                            entry["payload"] = json.loads(entry["payload"])
-                        except json.JSONDecodeError:
-                            entry["payload"] = None
+                    try:
+                        entry["payload"] = self._expand_payload(row, WHITELIST_COLUMNS, safe=True)
+                    except json.JSONDecodeError:
+                        entry["payload"] = None
                     rows.append(entry)
                 return rows
         except (psycopg2.Error, Exception) as e:
@@ -1902,11 +2361,10 @@ class DatabaseManager:
                 rows = []
                 for row in cursor.fetchall():
                     entry = dict(row)
-                    if entry["payload"]:
-                        try:
-                            entry["payload"] = json.loads(entry["payload"])
-                        except json.JSONDecodeError:
-                            entry["payload"] = None
+                    try:
+                        entry["payload"] = self._expand_payload(row, BLACKLIST_COLUMNS, safe=False)
+                    except json.JSONDecodeError:
+                        entry["payload"] = None
                     rows.append(entry)
                 return rows
         except (psycopg2.Error, Exception) as e:
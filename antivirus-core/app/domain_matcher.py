@@ -0,0 +1,331 @@
+# app/domain_matcher.py
+import asyncio
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import trusted_domain_config
+from app.logger import logger
+
+TRUSTED_LIST_EXTENSIONS = (".txt", ".csv", ".list")
+
+# Часть Public Suffix List на случай, если полный список (PUBLIC_SUFFIX_LIST_FILE) не загружен:
+# распространённые зоны и частные суффиксы хостингов, где поддомены принадлежат разным владельцам.
+# Полный список поставляется в rules/public_suffix_list.dat
+BUILTIN_PUBLIC_SUFFIXES = [
+    "com", "net", "org", "edu", "gov", "mil", "int", "info", "biz", "io", "co", "me", "dev", "app",
+    "xyz", "top", "click", "zip", "ru", "su", "рф", "by", "kz", "ua", "com.ua", "de", "fr", "it", "es",
+    "nl", "se", "ch", "pl", "eu", "us", "ca", "uk", "co.uk", "org.uk", "ac.uk", "gov.uk", "jp", "co.jp",
+    "ne.jp", "cn", "com.cn", "net.cn", "br", "com.br", "au", "com.au", "in", "co.in", "tr", "com.tr",
+    "*.ck", "!www.ck",
+    "github.io", "githubusercontent.com", "blogspot.com", "appspot.com", "herokuapp.com",
+    "cloudfront.net", "azurewebsites.net", "pages.dev", "workers.dev", "web.app", "firebaseapp.com",
+    "vercel.app", "netlify.app", "s3.amazonaws.com", "*.compute.amazonaws.com", "translate.goog",
+]
+
+
+def normalize_host(value: str) -> str:
+    """Хост из netloc/домена: без учётных данных, порта и завершающей точки, IDN - в punycode."""
+    host = (value or "").strip().lower()
+    if "@" in host:
+        host = host.rsplit("@", 1)[1]
+    if host.startswith("["):
+        return host.split("]", 1)[0] + "]"  # IPv6-литерал
+    if ":" in host:
+        host = host.split(":", 1)[0]
+    if host.endswith("."):
+        host = host.rstrip(".")
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return host
+
+
+class PublicSuffixList:
+    """
+    Public Suffix List: определение публичного суффикса и регистрируемого домена.
+
+    Правила хранятся в трёх множествах (обычные, wildcard "*.x", исключения
+    "!x"); суффиксы хоста проверяются от TLD к самому хосту - не больше трёх
+    обращений к множествам на метку.
+    """
+
+    def __init__(self, rules: Iterable[str], complete: bool = False):
+        # complete - загружен полный список (файл PSL), а не встроенная часть BUILTIN_PUBLIC_SUFFIXES
+        self.complete = complete
+        self.rules = set()
+        self.wildcards = set()
+        self.exceptions = set()
+        for rule in rules:
+            rule = rule.strip().lower()
+            if not rule or rule.startswith("//"):
+                continue
+            rule = rule.split()[0]
+            if rule.startswith("!"):
+                self.exceptions.add(normalize_host(rule[1:]))
+            elif rule.startswith("*."):
+                self.wildcards.add(normalize_host(rule[2:]))
+            else:
+                self.rules.add(normalize_host(rule))
+
+    @classmethod
+    def from_file(cls, path: str) -> "PublicSuffixList":
+        with open(path, encoding="utf-8") as fileobj:
+            return cls(fileobj, complete=True)
+
+    def __len__(self) -> int:
+        return len(self.rules) + len(self.wildcards) + len(self.exceptions)
+
+    def suffix_labels(self, suffixes: List[str]) -> int:
+        """
+        Число меток публичного суффикса. suffixes - суффиксы хоста от TLD к самому
+        хосту ("uk", "co.uk", "example.co.uk"); побеждает самое длинное правило.
+        """
+        count = 1  # правило по умолчанию "*": суффикс - последняя метка
+        for index, suffix in enumerate(suffixes):
+            if suffix in self.exceptions:
+                return index
+            if suffix in self.rules:
+                count = index + 1
+            if suffix in self.wildcards:
+                count = index + 2
+        return count
+
+    def public_suffix(self, host: str) -> str:
+        suffixes = host_suffixes(host)
+        return suffixes[min(self.suffix_labels(suffixes), len(suffixes)) - 1]
+
+    def registrable_domain(self, host: str) -> Optional[str]:
+        """Публичный суффикс плюс одна метка; None для самого суффикса, IP-адресов и пустых хостов."""
+        if not host or _is_ip(host):
+            return None
+        suffixes = host_suffixes(host)
+        count = self.suffix_labels(suffixes)
+        return suffixes[count] if count < len(suffixes) else None
+
+
+def host_suffixes(host: str) -> List[str]:
+    """Суффиксы хоста от TLD к самому хосту: a.b.com -> [com, b.com, a.b.com]."""
+    suffixes = []
+    candidate = ""
+    for label in reversed(host.split(".")):
+        candidate = f"{label}.{candidate}" if candidate else label
+        suffixes.append(candidate)
+    return suffixes
+
+
+def _is_ip(host: str) -> bool:
+    return host.startswith("[") or host.replace(".", "").isdigit()
+
+
+class TrustedDomainMatcher:
+    """
+    Неизменяемый набор доверенных доменов.
+
+    Хост и его родительские домены проверяются по хеш-множествам - O(число
+    меток) независимо от размера списка; PSL вычисляется только при совпадении. Подъём не выходит выше регистрируемого домена, поэтому
+    запись-суффикс ("github.io", "co.uk") доверяет только самому суффиксу,
+    а не сайтам разных владельцев под ним.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, bool]], psl: PublicSuffixList):
+        exact = set()
+        subtree = set()
+        for domain, include_subdomains in entries:
+            host = normalize_host(domain)
+            if not host:
+                continue
+            (subtree if include_subdomains else exact).add(host)
+        self.exact = frozenset(exact)
+        self.subtree = frozenset(subtree)
+        self.psl = psl
+
+    def __len__(self) -> int:
+        return len(self.exact) + len(self.subtree)
+
+    def match(self, domain: str) -> Optional[str]:
+        """Запись списка, которой соответствует домен, или None."""
+        host = normalize_host(domain)
+        if not host:
+            return None
+        if host in self.subtree or host in self.exact:
+            return host
+        # Родительские домены от ближайшего к TLD; PSL нужен только при совпадении
+        dot = host.find(".")
+        while dot >= 0:
+            candidate = host[dot + 1:]
+            if candidate in self.subtree:
+                registrable = self.psl.registrable_domain(host)
+                # Запись выше регистрируемого домена (публичный суффикс) не распространяется на хост
+                return candidate if registrable and len(candidate) >= len(registrable) else None
+            dot = host.find(".", dot + 1)
+        return None
+
+
+def parse_trusted_line(line: str) -> Optional[Tuple[str, bool]]:
+    """Строка списка: "example.com" (с поддоменами), "=example.com" (только домен) или "1,example.com"."""
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return None
+    if "," in line:
+        line = line.rsplit(",", 1)[1].strip()
+    if line.startswith("="):
+        return line[1:].strip(), False
+    return line.lstrip("*.").strip(), True
+
+
+def trusted_list_files(directory: Optional[str]) -> List[Path]:
+    if not directory or not Path(directory).is_dir():
+        return []
+    return sorted(p for p in Path(directory).rglob("*")
+                  if p.suffix.lower() in TRUSTED_LIST_EXTENSIONS and p.is_file())
+
+
+class TrustedDomainManager:
+    """
+    Загрузка списков доверенных доменов (файлы и таблица trusted_domains) и PSL
+    с горячей перезагрузкой.
+
+    Новый набор строится в потоке и подменяет текущий одним присваиванием -
+    проверки URL не блокируются и не видят частично загруженный список.
+    """
+
+    def __init__(self,
+                 lists_dir: str = trusted_domain_config.TRUSTED_DOMAINS_DIR,
+                 psl_file: str = trusted_domain_config.PUBLIC_SUFFIX_LIST_FILE,
+                 use_table: bool = trusted_domain_config.TRUSTED_DOMAINS_TABLE_ENABLED,
+                 reload_interval: int = trusted_domain_config.TRUSTED_DOMAINS_RELOAD_INTERVAL):
+        self.lists_dir = lists_dir
+        self.psl_file = psl_file
+        self.use_table = use_table
+        self.reload_interval = reload_interval
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._state: Optional[tuple] = None
+        self._load_info: Dict[str, Any] = {}
+        self._stats = {"checks": 0, "matches": 0}
+        self.current = TrustedDomainMatcher([], PublicSuffixList(BUILTIN_PUBLIC_SUFFIXES))
+        # Таблица читается при start(): при импорте модуля обращаемся только к файлам
+        self.load(use_table=False)
+
+    @property
+    def psl(self) -> PublicSuffixList:
+        return self.current.psl
+
+    def match(self, domain: str) -> Optional[str]:
+        matched = self.current.match(domain)
+        self._stats["checks"] += 1
+        if matched:
+            self._stats["matches"] += 1
+        return matched
+
+    def registrable_domain(self, domain: str) -> Optional[str]:
+        return self.current.psl.registrable_domain(normalize_host(domain))
+
+    def load(self, use_table: Optional[bool] = None) -> bool:
+        """Перечитывает списки и PSL. Возвращает True, если набор сменился."""
+        use_table = self.use_table if use_table is None else use_table
+        with self._lock:
+            state = self._source_state(use_table)
+            if state == self._state:
+                return False
+            started = time.perf_counter()
+            try:
+                psl = self._load_psl()
+                entries: List[Tuple[str, bool]] = []
+                for path in trusted_list_files(self.lists_dir):
+                    with open(path, encoding="utf-8", errors="replace") as fileobj:
+                        entries.extend(entry for entry in map(parse_trusted_line, fileobj) if entry)
+                table_entries = self._load_table() if use_table else []
+                entries.extend(table_entries)
+                matcher = TrustedDomainMatcher(entries, psl)
+            except Exception as e:
+                logger.error(f"Trusted domains load failed, keeping previous list: {e}")
+                self._load_info["last_error"] = str(e)
+                return False
+            self.current = matcher
+            self._state = state
+            self._load_info = {
+                "domains": len(matcher),
+                "table_domains": len(table_entries),
+                "public_suffix_rules": len(psl),
+                "load_ms": round((time.perf_counter() - started) * 1000, 1),
+                "loaded_at": time.time(),
+            }
+            logger.info(
+                f"Trusted domains loaded: {len(matcher)} domains, {len(psl)} public suffix rules "
+                f"in {self._load_info['load_ms']} ms"
+            )
+            return True
+
+    async def reload(self) -> bool:
+        return await asyncio.to_thread(self.load)
+
+    async def start(self):
+        if self.running:
+            return
+        await self.reload()
+        if self.reload_interval > 0:
+            self.running = True
+            self.task = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._load_info, **self._stats}
+
+    # ---------------------- Внутренние методы ----------------------
+
+    def _load_psl(self) -> PublicSuffixList:
+        if self.psl_file and Path(self.psl_file).is_file():
+            return PublicSuffixList.from_file(self.psl_file)
+        logger.warning(f"Public Suffix List {self.psl_file} not found, using built-in subset "
+                       f"(domain-level verdict cache limited to hosts)")
+        return PublicSuffixList(BUILTIN_PUBLIC_SUFFIXES)
+
+    @staticmethod
+    def _load_table() -> List[Tuple[str, bool]]:
+        from app.database import db_manager
+        return db_manager.get_trusted_domains() if db_manager else []
+
+    def _source_state(self, use_table: bool) -> tuple:
+        """Дешёвый признак изменения источников: mtime/размер файлов и версия таблицы."""
+        files = trusted_list_files(self.lists_dir)
+        if self.psl_file:
+            files.append(Path(self.psl_file))
+        state = []
+        for path in files:
+            try:
+                info = path.stat()
+                state.append((str(path), info.st_mtime_ns, info.st_size))
+            except OSError:
+                continue
+        table_version = None
+        if use_table:
+            from app.database import db_manager
+            table_version = db_manager.get_trusted_domains_version() if db_manager else None
+        return tuple(state), table_version
+
+    async def _watch_loop(self):
+        while self.running:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Trusted domains reload error: {e}")
+
+
+# Глобальный менеджер доверенных доменов
+trusted_domain_manager = TrustedDomainManager()
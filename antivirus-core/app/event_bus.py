@@ -0,0 +1,175 @@
+# app/event_bus.py
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from app.config import event_bus_config
+from app.logger import logger
+from app.pg_listener import PgListener
+
+# Лимит PostgreSQL на payload NOTIFY - 8000 байт, оставляем запас
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+class EventBus:
+    """
+    Шина событий между воркерами через PostgreSQL LISTEN/NOTIFY.
+
+    Событие сразу доставляется клиентам текущего процесса, а для остальных
+    воркеров накапливается в буфере: одинаковые события схлопываются по ключу,
+    и раз в EVENT_BUS_FLUSH_INTERVAL_MS буфер отправляется пачками NOTIFY.
+    Воркер игнорирует собственные уведомления по идентификатору узла.
+    """
+
+    def __init__(self,
+                 channel: str = event_bus_config.EVENT_BUS_CHANNEL,
+                 flush_interval_ms: int = event_bus_config.EVENT_BUS_FLUSH_INTERVAL_MS,
+                 max_batch: int = event_bus_config.EVENT_BUS_MAX_BATCH,
+                 enabled: bool = event_bus_config.EVENT_BUS_ENABLED):
+        self.channel = channel
+        self.flush_interval = max(flush_interval_ms, 0) / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self.enabled = enabled
+        self.node_id = uuid.uuid4().hex[:12]
+        self._ws_manager = None
+        self._listener: Optional[PgListener] = None
+        # dict сохраняет порядок вставки - события уходят в порядке первого появления
+        self._pending: Dict[Hashable, Tuple[Dict[str, Any], Optional[str]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stats = {"published": 0, "coalesced": 0, "notifies_sent": 0, "received": 0, "dropped": 0}
+
+    def attach(self, ws_manager) -> None:
+        """Подключает менеджер WebSocket, которому доставляются события."""
+        self._ws_manager = ws_manager
+
+    async def start(self, listener: Optional[PgListener]) -> None:
+        if not self.enabled or listener is None:
+            logger.info("[EVENT BUS] Cross-worker relay disabled, events are delivered locally only")
+            return
+        self._listener = listener
+        await listener.subscribe(self.channel, self._on_notify)
+        logger.info(f"[EVENT BUS] Started on channel '{self.channel}' (node={self.node_id})")
+
+    async def stop(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._flush_task = None
+        # Отправляем то, что осталось в буфере
+        await self._flush()
+        self._listener = None
+
+    async def publish(self, payload: Dict[str, Any], subscription: Optional[str] = None,
+                      coalesce_key: Optional[Hashable] = None) -> int:
+        """
+        Публикует событие всем воркерам. Возвращает число локальных адресатов.
+
+        coalesce_key - ключ схлопывания: из нескольких событий с одним ключом
+        в пределах окна отправки на другие воркеры уходит только последнее.
+        """
+        self._stats["published"] += 1
+        delivered = 0
+        if self._ws_manager is not None:
+            delivered = await self._ws_manager.broadcast(payload, subscription)
+
+        if self._listener is None:
+            return delivered
+
+        if coalesce_key is None:
+            coalesce_key = (subscription, json.dumps(payload, sort_keys=True, default=str))
+        else:
+            coalesce_key = (subscription, coalesce_key)
+        if coalesce_key in self._pending:
+            self._stats["coalesced"] += 1
+            # Перемещаем в конец, чтобы сохранить порядок последних версий
+            self._pending.pop(coalesce_key)
+        self._pending[coalesce_key] = (payload, subscription)
+
+        if len(self._pending) >= self.max_batch:
+            await self._flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+        return delivered
+
+    async def publish_verdict(self, url: str, result: Dict[str, Any]) -> int:
+        """Публикует вердикт проверки URL в подписку 'verdicts'."""
+        payload = {
+            "type": "verdict",
+            "url": url,
+            "safe": result.get("safe"),
+            "threat_type": result.get("threat_type"),
+            "source": result.get("source"),
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+        return await self.publish(payload, subscription="verdicts", coalesce_key=("verdict", url))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "relay_enabled": self._listener is not None,
+            "pending": len(self._pending),
+            **self._stats,
+        }
+
+    # ---------------------- Внутренние методы ----------------------
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._pending or self._listener is None:
+            self._pending.clear()
+            return
+        events = [{"p": payload, "s": subscription} for payload, subscription in self._pending.values()]
+        self._pending = {}
+        for message in self._build_messages(events):
+            if await self._listener.notify(self.channel, message):
+                self._stats["notifies_sent"] += 1
+            else:
+                self._stats["dropped"] += 1
+
+    def _build_messages(self, events: List[Dict[str, Any]]) -> List[str]:
+        """Разбивает события на NOTIFY-сообщения, укладывающиеся в лимит размера."""
+        prefix = f'{{"o":"{self.node_id}","e":['
+        suffix = "]}"
+        messages: List[str] = []
+        current: List[str] = []
+        size = len(prefix) + len(suffix)
+        for event in events:
+            encoded = json.dumps(event, ensure_ascii=False, default=str, separators=(",", ":"))
+            encoded_size = len(encoded.encode("utf-8")) + 1
+            if encoded_size + len(prefix) + len(suffix) > NOTIFY_PAYLOAD_LIMIT:
+                logger.warning(f"[EVENT BUS] Event too large for NOTIFY ({encoded_size} bytes), dropped")
+                self._stats["dropped"] += 1
+                continue
+            if current and size + encoded_size > NOTIFY_PAYLOAD_LIMIT:
+                messages.append(prefix + ",".join(current) + suffix)
+                current = []
+                size = len(prefix) + len(suffix)
+            current.append(encoded)
+            size += encoded_size
+        if current:
+            messages.append(prefix + ",".join(current) + suffix)
+        return messages
+
+    def _on_notify(self, raw: str) -> None:
+        try:
+            message = json.loads(raw)
+        except Exception as e:
+            logger.warning(f"[EVENT BUS] Malformed notification: {e}")
+            return
+        if message.get("o") == self.node_id or self._ws_manager is None:
+            return
+        for event in message.get("e", ()):
+            self._stats["received"] += 1
+            asyncio.ensure_future(self._ws_manager.broadcast(event.get("p") or {}, event.get("s")))
+
+
+# Глобальный экземпляр шины событий
+event_bus = EventBus()
@@ -6,6 +6,8 @@ from app.config import config
 class AbuseIPDBClient(BaseAPIClient):
     """Клиент для AbuseIPDB API"""
     
+    provider = "abuseipdb"
+    
     def __init__(self):
         super().__init__(config.ABUSEIPDB_API, config.ABUSEIPDB_API_KEY)
     
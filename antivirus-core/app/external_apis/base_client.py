@@ -5,29 +5,44 @@ from typing import Dict, Any, Optional
 import time
 from app.logger import logger
 from app.config import config
+from app.metrics import PROVIDER_RESPONSES
 
 class BaseAPIClient:
     """Базовый асинхронный клиент для внешних API"""
     
+    # Имя провайдера в метриках; лимит запросов на окно quota_window (None - не отслеживается)
+    provider = "unknown"
+    quota_limit: Optional[int] = None
+    quota_window = 3600
+    
     def __init__(self, base_url: str, api_key: str):
         self.base_url = base_url
         self.api_key = api_key
         self.session: Optional[aiohttp.ClientSession] = None
         self.request_times = []
+        # Сессия общая для параллельных вызовов: закрывается, когда выходит последний из них
+        self._session_users = 0
+        # Причина последнего неудачного запроса (timeout, connection, http_5xx, ...) для метрик и /health/hover
+        self.last_error: Optional[str] = None
     
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(
-                total=min(config.REQUEST_TIMEOUT, 20),  # общий таймаут
-                sock_connect=5,  # быстрое подключение
-                sock_read=10      # читаем быстро
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(
+                    total=min(config.REQUEST_TIMEOUT, 20),  # общий таймаут
+                    sock_connect=5,  # быстрое подключение
+                    sock_read=10      # читаем быстро
+                )
             )
-        )
+        self._session_users += 1
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        self._session_users -= 1
+        if self._session_users <= 0 and self.session:
+            self._session_users = 0
+            session, self.session = self.session, None
+            await session.close()
     
     def _check_rate_limit(self, max_requests: int, time_window: int = 3600) -> bool:
         """Проверка rate limiting"""
@@ -36,11 +51,34 @@ class BaseAPIClient:
         self.request_times = [t for t in self.request_times if now - t < time_window]
         
         if len(self.request_times) >= max_requests:
+            self.last_error = "quota_exhausted"
             return False
         
         self.request_times.append(now)
+        self._record_usage()
         return True
     
+    def _record_usage(self) -> None:
+        """Учитывает запрос в общем для воркеров счетчике provider_usage (в фоне, не задерживая запрос)"""
+        if not self.quota_limit:
+            return
+        from app.database import db_manager
+        if db_manager is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.run_in_executor(None, db_manager.record_provider_usage, self.provider)
+    
+    def quota_usage(self) -> Optional[tuple]:
+        """(использовано, лимит) за текущее окно или None, если лимит не отслеживается"""
+        if not self.quota_limit:
+            return None
+        now = time.time()
+        used = sum(1 for t in self.request_times if now - t < self.quota_window)
+        return used, self.quota_limit
+    
     async def _make_request(self, method: str, endpoint: str, 
                           params: Dict = None, data: Dict = None, 
                           max_retries: int = config.MAX_RETRIES) -> Optional[Dict[str, Any]]:
@@ -51,12 +89,14 @@ class BaseAPIClient:
         
         url = f"{self.base_url}{endpoint}"
         headers = self._get_headers()
+        self.last_error = None
         
         for attempt in range(max_retries):
             try:
                 async with self.session.request(
                     method, url, params=params, json=data, headers=headers
                 ) as response:
+                    PROVIDER_RESPONSES.labels(provider=self.provider, status=str(response.status)).inc()
                     
                     if response.status == 200:
                         return await response.json()
@@ -67,24 +107,29 @@ class BaseAPIClient:
                     elif response.status == 429:  # Rate limit
                         wait_time = 2 ** attempt  # Exponential backoff
                         logger.warning(f"Rate limit hit, waiting {wait_time}s")
+                        self.last_error = "rate_limited"
                         await asyncio.sleep(wait_time)
                         continue
                     elif response.status in (500, 502, 503, 504):
                         logger.error(f"Server error {response.status}, attempt {attempt + 1}")
+                        self.last_error = "http_5xx"
                         await asyncio.sleep(1)
                         continue
                     else:
                         error_text = await response.text()
                         logger.error(f"API error {response.status} for {endpoint}: {error_text[:500]}")
+                        self.last_error = "http_4xx"
                         return None
                         
             except aiohttp.ClientError as e:
                 logger.error(f"Request error (attempt {attempt + 1}): {e}")
+                self.last_error = "connection"
                 if attempt < max_retries - 1:
                     await asyncio.sleep(1)
                 continue
             except asyncio.TimeoutError:
                 logger.error(f"Timeout error (attempt {attempt + 1})")
+                self.last_error = "timeout"
                 if attempt < max_retries - 1:
                     await asyncio.sleep(1)
                 continue
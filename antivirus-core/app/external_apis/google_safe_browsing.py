@@ -6,6 +6,8 @@ from app.config import config
 class GoogleSafeBrowsingClient(BaseAPIClient):
     """Клиент для Google Safe Browsing API"""
     
+    provider = "google_safe_browsing"
+    
     def __init__(self):
         super().__init__(config.GOOGLE_SAFE_BROWSING_API, config.GOOGLE_SAFE_BROWSING_KEY)
     
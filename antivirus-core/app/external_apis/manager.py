@@ -1,8 +1,11 @@
 # app/external_apis/manager.py
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import asyncio
+import time
 from app.logger import logger
 from app.config import config, ENV_FILE_LOADED, ENV_FILE_PATH
+from app.metrics import observe_provider
+from app.startup_profile import startup_profile
 from .virustotal import VirusTotalClient
 from .google_safe_browsing import GoogleSafeBrowsingClient
 from .abuseipdb import AbuseIPDBClient
@@ -44,6 +47,17 @@ class ExternalAPIManager:
             logger.warning("VirusTotal API disabled (missing or placeholder key). Set VIRUSTOTAL_API_KEY in app/env.env")
         logger.info(f"[External APIs] Enabled map: {self.enabled_apis}")
 
+    def quota_usage(self) -> List[Tuple[str, int, int]]:
+        """(провайдер, использовано, лимит) для включённых API с отслеживаемым лимитом"""
+        usage = []
+        for name, client in (('virustotal', self.virustotal),
+                             ('google_safe_browsing', self.google_safe_browsing),
+                             ('abuseipdb', self.abuseipdb)):
+            quota = client.quota_usage() if self.enabled_apis.get(name) else None
+            if quota:
+                usage.append((name, quota[0], quota[1]))
+        return usage
+
     async def check_url_multiple_apis(self, url: str) -> Dict[str, Any]:
         """Проверка URL через несколько внешних API"""
         results = {}
@@ -91,15 +105,19 @@ class ExternalAPIManager:
     async def _safe_api_call_with_context(self, client, method_name, *args, api_name: str):
         """Безопасный вызов API с контекстным менеджером и улучшенной обработкой ошибок"""
         max_retries = 2
+        started = time.perf_counter()
         for attempt in range(max_retries):
             try:
                 async with client as c:
                     method = getattr(c, method_name)
                     result = await method(*args)
+                    # Клиент возвращает None и при ошибке запроса - причину сохраняет в last_error
+                    observe_provider(api_name, time.perf_counter() - started, c.last_error if result is None else None)
                     return result
             except asyncio.TimeoutError as e:
                 logger.warning(f"{api_name} API timeout (attempt {attempt + 1}/{max_retries}): {e}")
                 if attempt == max_retries - 1:
+                    observe_provider(api_name, time.perf_counter() - started, "timeout")
                     raise
                 await asyncio.sleep(0.5 * (attempt + 1))
             except Exception as e:
@@ -110,6 +128,7 @@ class ExternalAPIManager:
                     if attempt < max_retries - 1:
                         await asyncio.sleep(0.5 * (attempt + 1))
                         continue
+                observe_provider(api_name, time.perf_counter() - started, error_type)
                 raise
     
     async def check_file_hash_multiple_apis(self, file_hash: str) -> Dict[str, Any]:
@@ -343,5 +362,6 @@ class ExternalAPIManager:
         
         return sum(confidence_scores) // len(confidence_scores) if confidence_scores else 50
 
-# Глобальный экземпляр менеджера
-external_api_manager = ExternalAPIManager()
\ No newline at end of file
+# Глобальный экземпляр менеджера (клиенты не открывают сессий до первого запроса)
+with startup_profile.measure("external_apis.init"):
+    external_api_manager = ExternalAPIManager()
\ No newline at end of file
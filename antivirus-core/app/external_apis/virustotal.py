@@ -5,10 +5,14 @@ from typing import Dict, Any, Optional, List
 from .base_client import BaseAPIClient
 from app.config import config
 from app.logger import logger
+from app.tracing import span
 
 class VirusTotalClient(BaseAPIClient):
     """Клиент для VirusTotal API"""
     
+    provider = "virustotal"
+    quota_limit = config.VIRUSTOTAL_HOURLY_LIMIT
+    
     def __init__(self):
         super().__init__(config.VIRUSTOTAL_URL_API, config.VIRUSTOTAL_API_KEY)
     
@@ -27,7 +31,8 @@ class VirusTotalClient(BaseAPIClient):
         # Согласно API v3, идентификатор URL — это base64 без паддинга
         url_id = self._encode_url_id(url)
         endpoint = f"/urls/{url_id}"
-        response = await self._make_request("GET", endpoint)
+        with span("virustotal.lookup"):
+            response = await self._make_request("GET", endpoint)
         
         # КРИТИЧНО: Если response не None и содержит data - URL найден в базе
         if response and 'data' in response:
@@ -53,23 +58,28 @@ class VirusTotalClient(BaseAPIClient):
         }
 
         try:
-            async with self.session.post(submit_url, data=form_data, headers=headers) as resp:
-                text = await resp.text()
-                if resp.status in (200, 201):
-                    try:
-                        submit_resp = await resp.json()
-                    except Exception:
-                        logger.error(f"VirusTotal submit JSON parse error: {text}")
-                        return None
-                    if submit_resp and 'data' in submit_resp:
-                        analysis_id = submit_resp['data']['id']
-                        logger.info(f"URL submitted for analysis, ID: {analysis_id}")
-                        return await self._poll_analysis(analysis_id)
-                    logger.error(f"VirusTotal URL submission response without data: {submit_resp}")
-                    return None
-                else:
-                    logger.error(f"VirusTotal URL submission failed: HTTP {resp.status}, body={text}")
-                    return None
+            # Отправка и ожидание результата - отдельные этапы в трассе запроса
+            with span("virustotal.submit"):
+                async with self.session.post(submit_url, data=form_data, headers=headers) as resp:
+                    status = resp.status
+                    text = await resp.text()
+                    submit_resp = None
+                    if status in (200, 201):
+                        try:
+                            submit_resp = await resp.json()
+                        except Exception:
+                            logger.error(f"VirusTotal submit JSON parse error: {text}")
+                            return None
+            if status not in (200, 201):
+                logger.error(f"VirusTotal URL submission failed: HTTP {status}, body={text}")
+                return None
+            if not submit_resp or 'data' not in submit_resp:
+                logger.error(f"VirusTotal URL submission response without data: {submit_resp}")
+                return None
+            analysis_id = submit_resp['data']['id']
+            logger.info(f"URL submitted for analysis, ID: {analysis_id}")
+            with span("virustotal.poll"):
+                return await self._poll_analysis(analysis_id)
         except Exception as e:
             logger.error(f"VirusTotal URL submission exception: {e}", exc_info=True)
             return None
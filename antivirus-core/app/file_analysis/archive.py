@@ -0,0 +1,200 @@
+# app/file_analysis/archive.py
+import io
+import tempfile
+import zipfile
+import zlib
+from typing import Any, Dict, List, Optional
+
+from app.config import file_analysis_config
+from app.file_analysis.filetypes import file_type_detector
+from app.file_analysis.signatures import SignatureMatcher
+
+ZIP_MAGIC = b"PK\x03\x04"
+# Блок чтения файла архива и порог, после которого вложенный архив сбрасывается на диск
+MEMBER_CHUNK_SIZE = 256 * 1024
+NESTED_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class ArchiveBudget:
+    """
+    Общие ограничения на обход архива (включая вложенные) - защита от zip-бомб.
+
+    Размеры берутся из заголовков: zipfile не отдаёт больше байт, чем указано
+    в file_size, поэтому проверка до распаковки ограничивает реальный объём.
+    """
+
+    def __init__(self,
+                 max_members: int = file_analysis_config.ARCHIVE_MAX_MEMBERS,
+                 max_total_bytes: int = file_analysis_config.ARCHIVE_MAX_TOTAL_BYTES,
+                 max_depth: int = file_analysis_config.ARCHIVE_MAX_DEPTH,
+                 max_ratio: int = file_analysis_config.ARCHIVE_MAX_RATIO,
+                 ratio_min_bytes: int = file_analysis_config.ARCHIVE_RATIO_MIN_BYTES):
+        self.max_members = max_members
+        self.max_total_bytes = max_total_bytes
+        self.max_depth = max_depth
+        self.max_ratio = max_ratio
+        self.ratio_min_bytes = ratio_min_bytes
+        self.members = 0
+        self.total_bytes = 0
+        self.violations: List[Dict[str, str]] = []
+
+    def flag(self, kind: str, path: str = "") -> None:
+        self.violations.append({"type": kind, "path": path})
+
+    def ratio_exceeded(self, info: zipfile.ZipInfo) -> bool:
+        if info.file_size < self.ratio_min_bytes:
+            return False  # мелкие файлы с высокой степенью сжатия - норма
+        return info.file_size > max(info.compress_size, 1) * self.max_ratio
+
+
+def inspect_zip(source, matcher: Optional[SignatureMatcher] = None,
+                budget: Optional[ArchiveBudget] = None) -> Dict[str, Any]:
+    """
+    Обходит файлы ZIP-архива без распаковки на диск.
+
+    Каждый файл проходит через StreamingFileScanner (хеши, энтропия, сигнатуры);
+    вложенные архивы обходятся рекурсивно до ARCHIVE_MAX_DEPTH. source - буфер
+    (bytes, memoryview, mmap) или файловый объект с произвольным доступом.
+    """
+    budget = budget or ArchiveBudget()
+    members: List[Dict[str, Any]] = []
+    fileobj = _as_file(source)
+    try:
+        error = _walk_zip(fileobj, matcher, budget, members, depth=1, prefix="")
+    finally:
+        if fileobj is not source:
+            fileobj.close()
+    result = {
+        "members": members,
+        "member_count": budget.members,
+        "total_bytes": budget.total_bytes,
+        "violations": budget.violations,
+        "zip_bomb": any(v["type"] in ("compression_ratio", "total_bytes") for v in budget.violations),
+    }
+    if error:
+        result["error"] = error
+    return result
+
+
+def _walk_zip(fileobj, matcher, budget: ArchiveBudget, members: List[Dict[str, Any]],
+              depth: int, prefix: str) -> Optional[str]:
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if budget.members >= budget.max_members:
+                    budget.flag("max_members", prefix)
+                    break
+                budget.members += 1
+                _scan_member(archive, info, matcher, budget, depth, prefix, members)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def _scan_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, matcher, budget: ArchiveBudget,
+                 depth: int, prefix: str, members: List[Dict[str, Any]]) -> None:
+    """Сканирует файл архива и добавляет его в members (перед файлами вложенного архива)."""
+    # Импорт здесь: сканер сам вызывает inspect_zip для архивов
+    from app.file_analysis.scanner import StreamingFileScanner
+
+    path = prefix + info.filename
+    entry: Dict[str, Any] = {
+        "path": path,
+        "size": info.file_size,
+        "compressed_size": info.compress_size,
+        "depth": depth,
+    }
+    members.append(entry)
+    if info.flag_bits & 0x1:
+        entry["status"] = "encrypted"
+        return
+    if budget.ratio_exceeded(info):
+        budget.flag("compression_ratio", path)
+        entry["status"] = "skipped_ratio"
+        return
+    if budget.total_bytes + info.file_size > budget.max_total_bytes:
+        budget.flag("total_bytes", path)
+        entry["status"] = "skipped_budget"
+        return
+
+    scanner = StreamingFileScanner(matcher=matcher)
+    nested = None
+    try:
+        with archive.open(info) as stream:
+            while True:
+                chunk = stream.read(MEMBER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if scanner.size == 0 and chunk.startswith(ZIP_MAGIC):
+                    if depth < budget.max_depth:
+                        nested = tempfile.SpooledTemporaryFile(max_size=NESTED_SPOOL_SIZE)
+                    else:
+                        budget.flag("max_depth", path)
+                budget.total_bytes += len(chunk)
+                scanner.update(chunk)
+                if nested is not None:
+                    nested.write(chunk)
+        scan = scanner.result()
+        entry.update({
+            "status": "scanned",
+            "file_type": file_type_detector.detect(scan["head"])["type"],
+            "sha256": scan["sha256"],
+            "md5": scan["md5"],
+            "entropy": round(scan["entropy"], 3),
+            "signature_matches": scan["signature_matches"],
+        })
+        if nested is not None:
+            nested.seek(0)
+            nested_error = _walk_zip(nested, matcher, budget, members, depth + 1, path + "/")
+            if nested_error:
+                entry["nested_error"] = nested_error
+    except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError, EOFError) as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if nested is not None:
+            nested.close()
+
+
+def _as_file(source):
+    if hasattr(source, "seek") and hasattr(source, "read") and not isinstance(source, memoryview):
+        return source
+    return _BufferFile(source)
+
+
+class _BufferFile(io.RawIOBase):
+    """Файловый интерфейс только для чтения поверх буфера - без копирования всего архива."""
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._position:self._position + len(buffer)]
+        size = len(chunk)
+        buffer[:size] = chunk
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        self._view.release()
+        super().close()
@@ -0,0 +1,158 @@
+# app/file_analysis/entropy.py
+import math
+import struct
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy не обязателен - используется Counter (C-реализация подсчёта)
+    np = None
+
+# Размер блока для поблочной энтропии и порог "упакованного/зашифрованного" блока
+DEFAULT_BLOCK_SIZE = 64 * 1024
+HIGH_ENTROPY_THRESHOLD = 7.2
+
+# Сколько блоков обрабатывать за один вызов bincount (ограничивает временную память)
+_BLOCKS_PER_BATCH = 16
+
+
+class ByteHistogram:
+    """Накопительная гистограмма байтов (numpy.bincount или Counter)."""
+
+    def __init__(self):
+        self.total = 0
+        if np is not None:
+            self._counts = np.zeros(256, dtype=np.int64)
+        else:
+            self._counts = Counter()
+
+    def update(self, chunk) -> None:
+        if len(chunk) == 0:
+            return
+        if np is not None:
+            self._counts += np.bincount(np.frombuffer(chunk, dtype=np.uint8), minlength=256)
+        else:
+            self._counts.update(chunk)
+        self.total += len(chunk)
+
+    def merge(self, other: "ByteHistogram") -> None:
+        """Добавляет частоты другой гистограммы."""
+        if np is not None:
+            self._counts += other._counts
+        else:
+            self._counts.update(other._counts)
+        self.total += other.total
+
+    def counts(self) -> List[int]:
+        if np is not None:
+            return self._counts.tolist()
+        return [self._counts.get(i, 0) for i in range(256)]
+
+    def entropy(self) -> float:
+        return entropy_from_counts(self._counts if np is not None else self._counts.values(), self.total)
+
+
+def entropy_from_counts(counts, total: int) -> float:
+    """Энтропия Шеннона (бит на байт) по частотам байтов."""
+    if not total:
+        return 0.0
+    if np is not None and isinstance(counts, np.ndarray):
+        nonzero = counts[counts > 0] / total
+        return 0.0 - float((nonzero * np.log2(nonzero)).sum())
+    entropy = 0.0
+    for count in counts:
+        if count > 0:
+            probability = count / total
+            entropy -= probability * math.log2(probability)
+    return entropy
+
+
+def shannon_entropy(data) -> float:
+    """Энтропия буфера (bytes, bytearray, memoryview, mmap)."""
+    histogram = ByteHistogram()
+    histogram.update(data)
+    return histogram.entropy()
+
+
+def block_entropies(data, block_size: int = DEFAULT_BLOCK_SIZE) -> List[float]:
+    """Энтропия каждого блока block_size байт (последний неполный блок тоже учитывается)."""
+    length = len(data)
+    if not length:
+        return []
+    if np is None:
+        view = memoryview(data)
+        return [shannon_entropy(view[offset:offset + block_size]) for offset in range(0, length, block_size)]
+
+    arr = np.frombuffer(data, dtype=np.uint8)
+    full_blocks = length // block_size
+    result: List[float] = []
+    for start in range(0, full_blocks, _BLOCKS_PER_BATCH):
+        count = min(_BLOCKS_PER_BATCH, full_blocks - start)
+        batch = arr[start * block_size:(start + count) * block_size].reshape(count, block_size)
+        # Смещаем значения байтов на 256 * номер строки - один bincount даёт гистограммы всех строк
+        offsets = (np.arange(count, dtype=np.int64) * 256)[:, None]
+        histograms = np.bincount((batch + offsets).ravel(), minlength=count * 256).reshape(count, 256)
+        probabilities = histograms / block_size
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = np.where(probabilities > 0, probabilities * np.log2(probabilities), 0.0)
+        result.extend((0.0 - terms.sum(axis=1)).tolist())
+    if length % block_size:
+        result.append(shannon_entropy(arr[full_blocks * block_size:]))
+    return result
+
+
+def pe_section_entropies(data) -> List[Dict[str, Any]]:
+    """
+    Энтропия секций PE-файла по таблице секций.
+
+    Возвращает список {name, offset, size, entropy}; для не-PE или повреждённых
+    заголовков - пустой список. Данные секций читаются срезами без копирования.
+    """
+    sections = parse_pe_sections(data)
+    view = memoryview(data)
+    result = []
+    for section in sections:
+        start, size = section["offset"], section["size"]
+        if size <= 0 or start >= len(view):
+            continue
+        chunk = view[start:start + size]
+        result.append({**section, "entropy": round(shannon_entropy(chunk), 3)})
+    return result
+
+
+def parse_pe_sections(data) -> List[Dict[str, Any]]:
+    """Разбирает таблицу секций PE (имя, смещение и размер данных в файле)."""
+    try:
+        if len(data) < 0x40 or bytes(data[:2]) != b"MZ":
+            return []
+        pe_offset = struct.unpack_from("<I", data, 0x3C)[0]
+        if pe_offset + 24 > len(data) or bytes(data[pe_offset:pe_offset + 4]) != b"PE\x00\x00":
+            return []
+        number_of_sections = struct.unpack_from("<H", data, pe_offset + 6)[0]
+        optional_header_size = struct.unpack_from("<H", data, pe_offset + 20)[0]
+        table_offset = pe_offset + 24 + optional_header_size
+        sections = []
+        for index in range(min(number_of_sections, 96)):  # лимит формата PE - 96 секций
+            entry = table_offset + index * 40
+            if entry + 40 > len(data):
+                break
+            name = bytes(data[entry:entry + 8]).rstrip(b"\x00").decode("ascii", errors="replace")
+            raw_size, raw_pointer = struct.unpack_from("<II", data, entry + 16)
+            sections.append({"name": name, "offset": raw_pointer, "size": raw_size})
+        return sections
+    except (struct.error, ValueError):
+        return []
+
+
+def summarize_block_entropies(entropies: List[float], threshold: float = HIGH_ENTROPY_THRESHOLD) -> Optional[Dict[str, Any]]:
+    """Сводка поблочной энтропии: максимум и доля высокоэнтропийных блоков."""
+    if not entropies:
+        return None
+    high = sum(1 for value in entropies if value > threshold)
+    return {
+        "blocks": len(entropies),
+        "max": round(max(entropies), 3),
+        "high_entropy_blocks": high,
+        "high_entropy_ratio": round(high / len(entropies), 3),
+    }
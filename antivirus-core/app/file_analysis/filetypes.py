@@ -0,0 +1,208 @@
+# app/file_analysis/filetypes.py
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import file_analysis_config
+from app.logger import logger
+
+# Сколько байт заголовка нужно для определения типа (со смещениями вроде tar/ISO)
+DETECTION_HEAD_SIZE = 4096
+
+# Встроенная таблица типов. magic - байты по смещению offset; contains - дополнительная
+# строка в заголовке (уточнение контейнера); keywords - текстовые признаки скрипта
+# (без учёта регистра, проверяются, только если двоичная сигнатура не найдена).
+# risk_score - вклад типа в _calculate_risk_score, behavior_score - в поведенческий анализ.
+BUILTIN_FILE_TYPES: List[Dict[str, Any]] = [
+    # Исполняемые файлы
+    {"type": "win_pe", "magic": b"MZ", "category": "executable", "mime": "application/vnd.microsoft.portable-executable",
+     "risk_score": 60, "behavior_score": 5},
+    {"type": "elf", "magic": b"\x7fELF", "category": "executable", "mime": "application/x-executable",
+     "risk_score": 55, "behavior_score": 5},
+    {"type": "macho", "magic": b"\xcf\xfa\xed\xfe", "category": "executable", "mime": "application/x-mach-binary",
+     "risk_score": 55, "behavior_score": 5},
+    {"type": "macho", "magic": b"\xce\xfa\xed\xfe", "category": "executable", "mime": "application/x-mach-binary",
+     "risk_score": 55, "behavior_score": 5},
+    {"type": "macho", "magic": b"\xfe\xed\xfa\xcf", "category": "executable", "mime": "application/x-mach-binary",
+     "risk_score": 55, "behavior_score": 5},
+    {"type": "macho_universal", "magic": b"\xca\xfe\xba\xbe", "category": "executable", "mime": "application/x-mach-binary",
+     "risk_score": 55, "behavior_score": 5},
+    {"type": "dex", "magic": b"dex\n", "category": "executable", "mime": "application/vnd.android.dex",
+     "risk_score": 50},
+    {"type": "wasm", "magic": b"\x00asm", "category": "executable", "mime": "application/wasm", "risk_score": 30},
+    {"type": "windows_shortcut", "magic": b"L\x00\x00\x00\x01\x14\x02\x00", "category": "executable",
+     "mime": "application/x-ms-shortcut", "risk_score": 50},
+    # Документы
+    {"type": "pdf", "magic": b"%PDF", "category": "document", "mime": "application/pdf", "risk_score": 20},
+    {"type": "ole_document", "magic": b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "category": "document",
+     "mime": "application/x-ole-storage", "risk_score": 40},
+    {"type": "rtf", "magic": b"{\\rtf", "category": "document", "mime": "application/rtf", "risk_score": 30},
+    {"type": "office_openxml", "magic": b"PK\x03\x04", "contains": b"[Content_Types].xml", "category": "document",
+     "mime": "application/vnd.openxmlformats-officedocument", "risk_score": 30},
+    # Архивы
+    {"type": "zip_archive", "magic": b"PK\x03\x04", "category": "archive", "mime": "application/zip", "risk_score": 30},
+    {"type": "zip_archive", "magic": b"PK\x05\x06", "category": "archive", "mime": "application/zip", "risk_score": 30},
+    {"type": "java_archive", "magic": b"PK\x03\x04", "contains": b"META-INF/", "category": "archive",
+     "mime": "application/java-archive", "risk_score": 45},
+    {"type": "android_package", "magic": b"PK\x03\x04", "contains": b"AndroidManifest.xml", "category": "archive",
+     "mime": "application/vnd.android.package-archive", "risk_score": 45},
+    {"type": "rar_archive", "magic": b"Rar!\x1a\x07", "category": "archive", "mime": "application/vnd.rar", "risk_score": 30},
+    {"type": "7z_archive", "magic": b"7z\xbc\xaf\x27\x1c", "category": "archive", "mime": "application/x-7z-compressed",
+     "risk_score": 30},
+    {"type": "gzip", "magic": b"\x1f\x8b", "category": "archive", "mime": "application/gzip", "risk_score": 25},
+    {"type": "bzip2", "magic": b"BZh", "category": "archive", "mime": "application/x-bzip2", "risk_score": 25},
+    {"type": "xz", "magic": b"\xfd7zXZ\x00", "category": "archive", "mime": "application/x-xz", "risk_score": 25},
+    {"type": "cab_archive", "magic": b"MSCF", "category": "archive", "mime": "application/vnd.ms-cab-compressed",
+     "risk_score": 35},
+    {"type": "tar_archive", "magic": b"ustar", "offset": 257, "category": "archive", "mime": "application/x-tar",
+     "risk_score": 25},
+    # Скрипты (shebang)
+    {"type": "shell_script", "magic": b"#!/bin/bash", "category": "script", "mime": "text/x-shellscript",
+     "risk_score": 50, "behavior_score": 15},
+    {"type": "shell_script", "magic": b"#!/bin/sh", "category": "script", "mime": "text/x-shellscript",
+     "risk_score": 50, "behavior_score": 15},
+    {"type": "shell_script", "magic": b"#!/usr/bin/env bash", "category": "script", "mime": "text/x-shellscript",
+     "risk_score": 50, "behavior_score": 15},
+    {"type": "shell_script", "magic": b"#!/usr/bin/env sh", "category": "script", "mime": "text/x-shellscript",
+     "risk_score": 50, "behavior_score": 15},
+    {"type": "python_script", "magic": b"#!/usr/bin/env python", "category": "script", "mime": "text/x-python",
+     "risk_score": 40, "behavior_score": 10},
+    {"type": "python_script", "magic": b"#!/usr/bin/python", "category": "script", "mime": "text/x-python",
+     "risk_score": 40, "behavior_score": 10},
+    {"type": "perl_script", "magic": b"#!/usr/bin/perl", "category": "script", "mime": "text/x-perl",
+     "risk_score": 40, "behavior_score": 10},
+    # Скрипты без сигнатуры - по ключевым словам в заголовке
+    {"type": "powershell_script", "keywords": [b"powershell", b"invoke-expression", b"new-object net.webclient",
+                                               b"set-executionpolicy", b"[system.convert]::frombase64string"],
+     "category": "script", "mime": "text/x-powershell", "risk_score": 70, "behavior_score": 20},
+    {"type": "batch_script", "keywords": [b"@echo off"], "category": "script", "mime": "application/x-bat",
+     "risk_score": 50, "behavior_score": 15},
+    {"type": "vbscript", "keywords": [b"wscript.shell", b"createobject(", b"wscript.createobject"],
+     "category": "script", "mime": "text/vbscript", "risk_score": 60, "behavior_score": 15},
+    {"type": "html", "keywords": [b"<!doctype html", b"<html"], "category": "document", "mime": "text/html",
+     "risk_score": 20},
+    # Изображения
+    {"type": "png", "magic": b"\x89PNG\r\n\x1a\n", "category": "image", "mime": "image/png", "risk_score": 5},
+    {"type": "jpeg", "magic": b"\xff\xd8\xff", "category": "image", "mime": "image/jpeg", "risk_score": 5},
+    {"type": "gif", "magic": b"GIF8", "category": "image", "mime": "image/gif", "risk_score": 5},
+]
+
+UNKNOWN_TYPE: Dict[str, Any] = {"type": "unknown", "category": "unknown", "mime": "application/octet-stream",
+                                "risk_score": 10, "behavior_score": 0}
+
+
+def load_file_type_files(directory: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Загружает дополнительные типы из *.json в каталоге.
+
+    Формат - список объектов: type, magic (строка) или magic_hex, offset, contains
+    или contains_hex, keywords (список строк), category, mime, risk_score,
+    behavior_score, priority.
+    """
+    if not directory or not Path(directory).is_dir():
+        return []
+    entries: List[Dict[str, Any]] = []
+    for type_file in sorted(Path(directory).glob("*.json")):
+        try:
+            raw_entries = json.loads(type_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            logger.error(f"Failed to load file type table from {type_file}: {e}")
+            continue
+        for raw in raw_entries if isinstance(raw_entries, list) else []:
+            try:
+                entry = {key: raw[key] for key in ("type", "category", "mime", "risk_score", "behavior_score",
+                                                   "offset", "priority", "description") if key in raw}
+                if "magic_hex" in raw:
+                    entry["magic"] = bytes.fromhex(raw["magic_hex"])
+                elif "magic" in raw:
+                    entry["magic"] = raw["magic"].encode("latin-1")
+                if "contains_hex" in raw:
+                    entry["contains"] = bytes.fromhex(raw["contains_hex"])
+                elif "contains" in raw:
+                    entry["contains"] = raw["contains"].encode("latin-1")
+                if "keywords" in raw:
+                    entry["keywords"] = [keyword.lower().encode("utf-8") for keyword in raw["keywords"]]
+                if not entry.get("type") or not (entry.get("magic") or entry.get("keywords")):
+                    continue
+                entries.append(entry)
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                logger.warning(f"Skipping invalid file type entry in {type_file.name}: {e}")
+    return entries
+
+
+class FileTypeDetector:
+    """
+    Определение типа файла по таблице сигнатур (magic numbers).
+
+    Сигнатуры с нулевым смещением индексируются по первому байту - для заголовка
+    проверяются только записи с тем же первым байтом и записи с ненулевым
+    смещением. Из совпавших выбирается самая специфичная (priority, по умолчанию
+    длина magic + contains: OOXML/JAR/APK уточняют ZIP). Текстовые признаки
+    скриптов ищутся в заголовке в нижнем регистре, только если двоичной
+    сигнатуры нет. Читается не больше DETECTION_HEAD_SIZE байт.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = [self._normalize(entry) for entry in entries]
+        # Версия таблицы (меняется вместе с оценками типов) - часть ключа кэша результатов загрузок
+        self.version = hashlib.sha256(repr(sorted(repr(sorted(entry.items())) for entry in self.entries)).encode()).hexdigest()[:16]
+        self._by_first_byte: Dict[int, List[Dict[str, Any]]] = {}
+        self._with_offset: List[Dict[str, Any]] = []
+        self._keyword_entries: List[Dict[str, Any]] = []
+        self._by_type: Dict[str, Dict[str, Any]] = {}
+        for entry in self.entries:
+            self._by_type[entry["type"]] = entry  # записи из файлов переопределяют оценки встроенных
+            if entry.get("magic"):
+                if entry["offset"] == 0:
+                    self._by_first_byte.setdefault(entry["magic"][0], []).append(entry)
+                else:
+                    self._with_offset.append(entry)
+            elif entry.get("keywords"):
+                self._keyword_entries.append(entry)
+        # Текстовые признаки проверяются по убыванию priority (HTA раньше общего HTML)
+        self._keyword_entries.sort(key=lambda entry: entry["priority"], reverse=True)
+
+    @staticmethod
+    def _normalize(entry: Dict[str, Any]) -> Dict[str, Any]:
+        normalized = {**UNKNOWN_TYPE, "offset": 0, **entry}
+        normalized.setdefault("priority", len(normalized.get("magic", b"")) + len(normalized.get("contains", b"")))
+        return normalized
+
+    def detect(self, head: bytes) -> Dict[str, Any]:
+        """Тип по первым байтам файла: {type, category, mime, risk_score, behavior_score}."""
+        head = bytes(head[:DETECTION_HEAD_SIZE])
+        if not head:
+            return dict(UNKNOWN_TYPE)
+        best = None
+        for entry in self._by_first_byte.get(head[0], []) + self._with_offset:
+            if not head.startswith(entry["magic"], entry["offset"]):
+                continue
+            if entry.get("contains") and entry["contains"] not in head:
+                continue
+            if best is None or entry["priority"] > best["priority"]:
+                best = entry
+        if best is None and self._keyword_entries:
+            lowered = head.lower()
+            for entry in self._keyword_entries:
+                if any(keyword in lowered for keyword in entry["keywords"]):
+                    best = entry
+                    break
+        if best is None:
+            return dict(UNKNOWN_TYPE)
+        return {key: best[key] for key in ("type", "category", "mime", "risk_score", "behavior_score")}
+
+    def risk_score(self, file_type: str) -> int:
+        return self._by_type.get(file_type, UNKNOWN_TYPE)["risk_score"]
+
+    def behavior_score(self, file_type: str) -> int:
+        return self._by_type.get(file_type, UNKNOWN_TYPE)["behavior_score"]
+
+
+def load_file_type_detector(directory: Optional[str] = None) -> FileTypeDetector:
+    """Встроенная таблица плюс записи из каталога (записи из файлов проверяются в том же индексе)."""
+    return FileTypeDetector(BUILTIN_FILE_TYPES + load_file_type_files(directory))
+
+
+# Глобальный детектор типов файлов
+file_type_detector = load_file_type_detector(file_analysis_config.FILE_TYPES_DIR)
@@ -0,0 +1,191 @@
+# app/file_analysis/scanner.py
+import hashlib
+import io
+import mmap
+import os
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from app.file_analysis.archive import ZIP_MAGIC, inspect_zip
+from app.file_analysis.entropy import (
+    DEFAULT_BLOCK_SIZE,
+    ByteHistogram,
+    pe_section_entropies,
+    summarize_block_entropies,
+)
+from app.file_analysis.signatures import SignatureMatcher
+from app.file_analysis.yara_rules import CompiledYaraRules
+
+# Размер блока потоковой обработки и размер заголовка для определения типа файла
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+HEAD_SIZE = 4096
+
+
+class FileTooLargeError(Exception):
+    """Файл превышает допустимый размер."""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"File too large: {size} bytes (limit {limit})")
+        self.size = size
+        self.limit = limit
+
+    def __reduce__(self):
+        # Исключение передаётся из процесса пула анализа - восстанавливаем по исходным аргументам
+        return self.__class__, (self.size, self.limit)
+
+
+class StreamingFileScanner:
+    """
+    Однопроходный анализ файла по блокам.
+
+    За один проход обновляются SHA-256/MD5/SHA-1, гистограммы байтов (по блокам
+    block_size и общая - для энтропии) и поиск всех сигнатур скомпилированным
+    SignatureMatcher (совпадения на границе блоков находятся за счёт хвоста).
+    YARA-правилам и обходу ZIP-архивов (inspect_archives) нужен буфер целиком -
+    они запускаются в scan_bytes.
+    """
+
+    def __init__(self, matcher: Optional[SignatureMatcher] = None,
+                 head_size: int = HEAD_SIZE, block_size: int = DEFAULT_BLOCK_SIZE,
+                 yara_rules: Optional[CompiledYaraRules] = None, inspect_archives: bool = False):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self._sha1 = hashlib.sha1()
+        # Общая гистограмма собирается из гистограмм блоков - байты считаются один раз
+        self._histogram = ByteHistogram()
+        self._block_histogram = ByteHistogram()
+        self._block_size = block_size
+        self._block_entropies: List[float] = []
+        self._head_size = head_size
+        self._head = bytearray()
+        self.size = 0
+        self.matcher = matcher
+        self._match_state = matcher.new_state() if matcher else None
+        self.yara_rules = yara_rules
+        self.inspect_archives = inspect_archives
+
+    def update(self, chunk) -> None:
+        """Обрабатывает очередной блок (bytes, bytearray или memoryview)."""
+        if not chunk:
+            return
+        self._sha256.update(chunk)
+        self._md5.update(chunk)
+        self._sha1.update(chunk)
+        self._update_histograms(chunk)
+        if len(self._head) < self._head_size:
+            self._head += chunk[:self._head_size - len(self._head)]
+        self.size += len(chunk)
+        if self.matcher:
+            self.matcher.feed(self._match_state, chunk)
+
+    def _update_histograms(self, chunk) -> None:
+        view = memoryview(chunk)
+        position = 0
+        while position < len(view):
+            take = min(self._block_size - self._block_histogram.total, len(view) - position)
+            self._block_histogram.update(view[position:position + take])
+            position += take
+            if self._block_histogram.total >= self._block_size:
+                self._close_block()
+
+    def _close_block(self) -> None:
+        self._block_entropies.append(self._block_histogram.entropy())
+        self._histogram.merge(self._block_histogram)
+        self._block_histogram = ByteHistogram()
+
+    def histogram(self) -> List[int]:
+        return self._histogram.counts()
+
+    def result(self) -> Dict[str, Any]:
+        """Итог сканирования: хеши, размер, заголовок, энтропия и найденные сигнатуры."""
+        if self._block_histogram.total:
+            self._close_block()
+        return {
+            "sha256": self._sha256.hexdigest(),
+            "md5": self._md5.hexdigest(),
+            "sha1": self._sha1.hexdigest(),
+            "size": self.size,
+            "head": bytes(self._head),
+            "entropy": self._histogram.entropy(),
+            "block_entropy": summarize_block_entropies(self._block_entropies),
+            "pe_sections": [],
+            "signature_matches": dict(self._match_state.matches) if self._match_state else {},
+        }
+
+
+def scan_bytes(data, scanner: StreamingFileScanner, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Сканирует буфер блоками без копирования (через memoryview)."""
+    with memoryview(data) as view:
+        for offset in range(0, len(view), chunk_size):
+            scanner.update(view[offset:offset + chunk_size])
+        result = scanner.result()
+        # Буфер доступен целиком - считаем энтропию секций PE (признак упаковщика)
+        if result["head"].startswith(b"MZ"):
+            result["pe_sections"] = pe_section_entropies(view)
+        if scanner.yara_rules is not None:
+            result["yara"] = scanner.yara_rules.match(view)
+        if scanner.inspect_archives and result["head"].startswith(ZIP_MAGIC):
+            result["archive"] = inspect_zip(view, scanner.matcher)
+    return result
+
+
+def scan_fileobj(fileobj: BinaryIO, scanner: StreamingFileScanner, max_size: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Сканирует файловый объект (в том числе SpooledTemporaryFile загрузки).
+
+    Файлы в памяти читаются через getbuffer() без копирования, файлы на диске
+    отображаются в память через mmap; размер проверяется до начала сканирования.
+    Для прочих объектов - чтение блоками с проверкой размера по ходу.
+    """
+    raw = getattr(fileobj, "_file", fileobj)  # SpooledTemporaryFile хранит данные в _file
+
+    if isinstance(raw, io.BytesIO):
+        buffer = raw.getbuffer()
+        try:
+            _check_size(len(buffer), max_size)
+            return scan_bytes(buffer, scanner, chunk_size)
+        finally:
+            buffer.release()
+
+    fd = None
+    try:
+        fd = raw.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+    if fd is not None:
+        raw.flush()
+        size = os.fstat(fd).st_size
+        _check_size(size, max_size)
+        if size == 0:
+            return scanner.result()
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+            return scan_bytes(mapped, scanner, chunk_size)
+
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        _check_size(scanner.size + len(chunk), max_size)
+        scanner.update(chunk)
+    return scanner.result()
+
+
+def sha256_fileobj(fileobj: BinaryIO) -> str:
+    """SHA-256 файлового объекта без остальных этапов сканирования (для поиска в кэше результатов)."""
+    raw = getattr(fileobj, "_file", fileobj)
+    if isinstance(raw, io.BytesIO):
+        buffer = raw.getbuffer()
+        try:
+            return hashlib.sha256(buffer).hexdigest()
+        finally:
+            buffer.release()
+    fileobj.seek(0)
+    digest = hashlib.file_digest(fileobj, "sha256")
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _check_size(size: int, max_size: Optional[int]) -> None:
+    if max_size is not None and size > max_size:
+        raise FileTooLargeError(size, max_size)
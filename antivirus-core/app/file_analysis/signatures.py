@@ -0,0 +1,239 @@
+# app/file_analysis/signatures.py
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.logger import logger
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick не обязателен - используется regex по префиксному дереву
+    ahocorasick = None
+
+# Встроенные правила: сигнатуры ("rule") и поведенческие строки ("behavioral", без учёта регистра)
+BUILTIN_RULES: List[Dict[str, Any]] = [
+    {"name": "suspicious_pe_header", "pattern": b"MZ", "description": "Windows PE executable detected",
+     "threat_score": 20, "category": "rule"},
+    {"name": "powershell_script", "pattern": b"powershell", "description": "PowerShell script detected",
+     "threat_score": 30, "category": "rule"},
+    {"name": "base64_encoded", "pattern": b"base64", "description": "Base64 encoded content detected",
+     "threat_score": 15, "category": "rule"},
+    {"name": "suspicious_urls", "pattern": b"http://", "description": "HTTP URLs detected (potentially suspicious)",
+     "threat_score": 10, "category": "rule"},
+] + [
+    {"name": f"behavior_{pattern.decode().replace(' ', '_').replace('.', '_')}", "pattern": pattern,
+     "description": f"Suspicious string: {pattern.decode()}", "threat_score": 10,
+     "category": "behavioral", "nocase": True}
+    for pattern in (b"cmd.exe", b"powershell", b"reg add", b"net user",
+                    b"schtasks", b"wmic", b"rundll32", b"certutil")
+]
+
+# Сколько совпадений одного правила учитывать (дальше только счётчик не растёт)
+MAX_HITS_PER_RULE = 1000
+
+
+def load_rule_files(directory: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Загружает правила из *.json в каталоге.
+
+    Формат файла - список объектов: name, pattern (строка) или hex (байты в hex),
+    description, threat_score, category ("rule" | "behavioral"), nocase.
+    """
+    if not directory:
+        return []
+    path = Path(directory)
+    if not path.is_dir():
+        return []
+    rules: List[Dict[str, Any]] = []
+    for rule_file in sorted(path.glob("*.json")):
+        try:
+            entries = json.loads(rule_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            logger.error(f"Failed to load signature rules from {rule_file}: {e}")
+            continue
+        for entry in entries if isinstance(entries, list) else []:
+            try:
+                if "hex" in entry:
+                    pattern = bytes.fromhex(entry["hex"])
+                else:
+                    pattern = entry["pattern"].encode("utf-8")
+                if not pattern or not entry.get("name"):
+                    continue
+                rules.append({
+                    "name": entry["name"],
+                    "pattern": pattern,
+                    "description": entry.get("description", entry["name"]),
+                    "threat_score": int(entry.get("threat_score", 10)),
+                    "category": entry.get("category", "rule"),
+                    "nocase": bool(entry.get("nocase", False)),
+                })
+            except (KeyError, ValueError, TypeError) as e:
+                logger.warning(f"Skipping invalid signature rule in {rule_file.name}: {e}")
+    return rules
+
+
+def load_signature_rules(directory: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Встроенные правила плюс правила из каталога (одноимённые правила из файлов заменяют встроенные)."""
+    by_name: Dict[str, Dict[str, Any]] = {rule["name"]: rule for rule in BUILTIN_RULES}
+    for rule in load_rule_files(directory):
+        by_name[rule["name"]] = rule
+    return list(by_name.values())
+
+
+class SignatureMatcher:
+    """
+    Скомпилированный поиск всех сигнатур за один линейный проход.
+
+    Основной движок - автомат Ахо-Корасик (pyahocorasick); без него - регулярное
+    выражение, построенное по префиксному дереву сигнатур. Сигнатуры без учёта
+    регистра ищутся во втором автомате по тексту в нижнем регистре.
+    Поддерживается потоковый режим: состояние (MatchState) хранит хвост предыдущего блока.
+    """
+
+    def __init__(self, rules: Iterable[Dict[str, Any]]):
+        self.rules: List[Dict[str, Any]] = list(rules)
+        self.version = self._compute_version(self.rules)
+        self.backend = "aho-corasick" if ahocorasick is not None else "regex"
+        # Уникальные сигнатуры -> имена правил (одна сигнатура может быть в нескольких правилах)
+        exact: Dict[bytes, List[str]] = {}
+        nocase: Dict[bytes, List[str]] = {}
+        for rule in self.rules:
+            pattern = rule["pattern"]
+            if rule.get("nocase"):
+                nocase.setdefault(pattern.lower(), []).append(rule["name"])
+            else:
+                exact.setdefault(pattern, []).append(rule["name"])
+        self._exact = _CompiledPatterns(exact)
+        self._nocase = _CompiledPatterns(nocase)
+        self.max_pattern_length = max((len(rule["pattern"]) for rule in self.rules), default=0)
+
+    @staticmethod
+    def _compute_version(rules: List[Dict[str, Any]]) -> str:
+        digest = hashlib.sha256()
+        for rule in sorted(rules, key=lambda r: r["name"]):
+            digest.update(json.dumps(
+                [rule["name"], rule["pattern"].hex(), rule.get("threat_score"), rule.get("category"), bool(rule.get("nocase"))]
+            ).encode())
+        return digest.hexdigest()[:16]
+
+    def new_state(self) -> "MatchState":
+        return MatchState()
+
+    def feed(self, state: "MatchState", chunk) -> None:
+        """Обрабатывает очередной блок данных, продолжая поиск с учётом хвоста предыдущего."""
+        if not chunk or not self.rules:
+            state.offset += len(chunk)
+            return
+        tail_length = len(state.tail)
+        window = state.tail + bytes(chunk)
+        base = state.offset - tail_length
+        # Совпадения, целиком лежащие в хвосте, уже были учтены на предыдущем шаге
+        for start, names in self._exact.find(window, tail_length):
+            state.record(names, base + start)
+        if self._nocase.patterns:
+            for start, names in self._nocase.find(window.lower(), tail_length):
+                state.record(names, base + start)
+        keep = self.max_pattern_length - 1
+        state.tail = window[-keep:] if keep > 0 else b""
+        state.offset += len(chunk)
+
+    def scan(self, data) -> Dict[str, Dict[str, int]]:
+        """Поиск по буферу целиком. Возвращает {имя правила: {offset, count}}."""
+        state = self.new_state()
+        self.feed(state, data)
+        return state.matches
+
+    def rules_by_category(self, category: str) -> List[Dict[str, Any]]:
+        return [rule for rule in self.rules if rule.get("category", "rule") == category]
+
+
+class MatchState:
+    """Состояние потокового поиска: хвост, смещение и найденные правила."""
+
+    __slots__ = ("tail", "offset", "matches")
+
+    def __init__(self):
+        self.tail = b""
+        self.offset = 0
+        self.matches: Dict[str, Dict[str, int]] = {}
+
+    def record(self, names: Iterable[str], offset: int) -> None:
+        for name in names:
+            hit = self.matches.get(name)
+            if hit is None:
+                self.matches[name] = {"offset": offset, "count": 1}
+            elif hit["count"] < MAX_HITS_PER_RULE:
+                hit["count"] += 1
+
+
+class _CompiledPatterns:
+    """Набор сигнатур одного режима регистра, скомпилированный в автомат или regex."""
+
+    def __init__(self, patterns: Dict[bytes, List[str]]):
+        self.patterns = patterns
+        self._automaton = None
+        self._regex = None
+        self._prefixes: Dict[bytes, List[bytes]] = {}
+        if not patterns:
+            return
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for pattern, names in patterns.items():
+                # latin-1 отображает байты в символы один к одному - смещения совпадают
+                automaton.add_word(pattern.decode("latin-1"), (len(pattern), tuple(names)))
+            automaton.make_automaton()
+            self._automaton = automaton
+        else:
+            self._regex = re.compile(_trie_regex(patterns.keys()), re.DOTALL)
+            # Regex в каждой позиции берёт самое длинное совпадение - более короткие
+            # сигнатуры, являющиеся его префиксами, добавляются отдельно
+            for pattern in patterns:
+                self._prefixes[pattern] = [p for p in patterns if p != pattern and pattern.startswith(p)]
+
+    def find(self, window: bytes, min_end: int) -> Iterable[Tuple[int, List[str]]]:
+        """Совпадения, заканчивающиеся после позиции min_end: (начало, имена правил)."""
+        if self._automaton is not None:
+            for end_index, (length, names) in self._automaton.iter(window.decode("latin-1")):
+                if end_index + 1 > min_end:
+                    yield end_index - length + 1, names
+            return
+        if self._regex is None:
+            return
+        search = self._regex.search
+        # Совпадение может начинаться не раньше, чем за (длина - 1) до конца хвоста
+        position = max(0, min_end - max(len(p) for p in self.patterns) + 1)
+        while True:
+            match = search(window, position)
+            if match is None:
+                return
+            start = match.start()
+            found = match.group(0)
+            for pattern in [found] + self._prefixes.get(found, []):
+                if start + len(pattern) > min_end:
+                    yield start, self.patterns[pattern]
+            position = start + 1
+
+
+def _trie_regex(patterns: Iterable[bytes]) -> bytes:
+    """Строит регулярное выражение по префиксному дереву (ветвление только по первому байту)."""
+    trie: Dict[Any, Any] = {}
+    for pattern in patterns:
+        node = trie
+        for byte in pattern:
+            node = node.setdefault(byte, {})
+        node[None] = True
+
+    def build(node: Dict[Any, Any]) -> bytes:
+        terminal = None in node
+        keys = sorted(key for key in node if key is not None)
+        if not keys:
+            return b""
+        alternatives = [re.escape(bytes((key,))) + build(node[key]) for key in keys]
+        if len(alternatives) == 1 and not terminal:
+            return alternatives[0]
+        body = b"(?:" + b"|".join(alternatives) + b")"
+        return body + b"?" if terminal else body
+
+    return build(trie)
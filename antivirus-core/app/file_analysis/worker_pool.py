@@ -0,0 +1,269 @@
+# app/file_analysis/worker_pool.py
+import asyncio
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from app.config import file_analysis_config
+from app.file_analysis.scanner import FileTooLargeError, StreamingFileScanner, scan_bytes, scan_fileobj
+from app.file_analysis.signatures import SignatureMatcher
+from app.file_analysis.yara_rules import worker_rules
+from app.logger import logger
+
+
+class FileAnalysisBusyError(Exception):
+    """Очередь анализа файлов переполнена - новые задачи не принимаются."""
+
+
+class FileAnalysisTimeoutError(Exception):
+    """Сканирование файла не уложилось в отведённое время."""
+
+
+# ---------------------- Код, выполняемый в процессах пула ----------------------
+
+# Набор сигнатур компилируется один раз при старте процесса-обработчика
+_worker_matcher: Optional[SignatureMatcher] = None
+
+
+def _init_worker(rules: List[Dict[str, Any]]) -> None:
+    global _worker_matcher
+    _worker_matcher = SignatureMatcher(rules)
+
+
+def _worker_scanner(yara_path: Optional[str]) -> StreamingFileScanner:
+    return StreamingFileScanner(matcher=_worker_matcher, yara_rules=worker_rules(yara_path),
+                                inspect_archives=file_analysis_config.ARCHIVE_INSPECTION_ENABLED)
+
+
+def _scan_path_job(path: str, max_size: Optional[int], yara_path: Optional[str] = None) -> Dict[str, Any]:
+    """Сканирует файл по пути (файл отображается в память через mmap)."""
+    with open(path, "rb") as fileobj:
+        return scan_fileobj(fileobj, _worker_scanner(yara_path), max_size)
+
+
+def _scan_shared_memory_job(name: str, size: int, yara_path: Optional[str] = None) -> Dict[str, Any]:
+    """Сканирует буфер из разделяемой памяти без копирования в процесс."""
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        with segment.buf[:size] as view:
+            return scan_bytes(view, _worker_scanner(yara_path))
+    finally:
+        segment.close()
+
+
+# ---------------------- Пул в основном процессе ----------------------
+
+class FileAnalysisPool:
+    """
+    Пул процессов для CPU-ёмкого сканирования загруженных файлов.
+
+    Хеширование, энтропия и поиск сигнатур выполняются вне event loop, поэтому
+    крупная загрузка не задерживает проверки URL и WebSocket. Данные передаются
+    без сериализации содержимого: файлы на диске - по пути (для безымянных
+    временных файлов - через /proc/<pid>/fd), буферы в памяти - через
+    разделяемую память. Число задач в очереди ограничено (FileAnalysisBusyError),
+    у каждой задачи есть таймаут; зависший процесс завершается вместе с пулом,
+    и пул пересоздаётся.
+    """
+
+    def __init__(self,
+                 workers: int = file_analysis_config.FILE_ANALYSIS_WORKERS,
+                 max_queue: int = file_analysis_config.FILE_ANALYSIS_MAX_QUEUE,
+                 job_timeout: float = file_analysis_config.FILE_ANALYSIS_JOB_TIMEOUT,
+                 inline_max_bytes: int = file_analysis_config.FILE_ANALYSIS_INLINE_MAX_BYTES):
+        self.workers = max(workers, 0)
+        self.max_queue = max(max_queue, 1)
+        self.job_timeout = job_timeout
+        self.inline_max_bytes = inline_max_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._rules: List[Dict[str, Any]] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+        self._stats = {"completed": 0, "failed": 0, "timeouts": 0, "rejected": 0, "restarts": 0}
+        self._scan_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def start(self, rules: List[Dict[str, Any]]) -> None:
+        """Запускает пул; каждый процесс один раз компилирует переданный набор правил."""
+        self._rules = list(rules)
+        if not self.enabled:
+            logger.info("File analysis pool disabled (FILE_ANALYSIS_WORKERS=0), scanning in threads")
+            return
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._executor = self._create_executor()
+        logger.info(f"File analysis pool started: {self.workers} workers, queue limit {self.max_queue}")
+
+    def stop(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        logger.info("File analysis pool stopped")
+
+    def should_offload(self, size: int) -> bool:
+        """Небольшие файлы дешевле просканировать в потоке, чем передавать в процесс."""
+        return self._executor is not None and size > self.inline_max_bytes
+
+    async def scan_fileobj(self, fileobj: BinaryIO, max_size: Optional[int] = None,
+                           yara_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Сканирует файловый объект загрузки (SpooledTemporaryFile) в процессе пула.
+
+        yara_path - скомпилированный набор YARA-правил; процесс загружает его при смене версии.
+        """
+        raw = getattr(fileobj, "_file", fileobj)
+        if isinstance(raw, io.BytesIO):
+            buffer = raw.getbuffer()
+            try:
+                return await self.scan_buffer(buffer, max_size, yara_path)
+            finally:
+                buffer.release()
+
+        raw.flush()
+        size = os.fstat(raw.fileno()).st_size
+        if max_size is not None and size > max_size:
+            raise FileTooLargeError(size, max_size)
+        path = self._shareable_path(raw)
+        if path:
+            return await self._submit(_scan_path_job, path, max_size, yara_path)
+
+        # Путь недоступен (не Linux) - копируем во временный файл, который прочитает процесс
+        spool = await asyncio.to_thread(self._copy_to_tempfile, raw)
+        try:
+            return await self._submit(_scan_path_job, spool, max_size, yara_path)
+        finally:
+            os.unlink(spool)
+
+    async def scan_buffer(self, data, max_size: Optional[int] = None,
+                          yara_path: Optional[str] = None) -> Dict[str, Any]:
+        """Сканирует буфер в памяти, передавая его процессу через разделяемую память."""
+        size = len(data)
+        if max_size is not None and size > max_size:
+            raise FileTooLargeError(size, max_size)
+        self._check_capacity()  # не копируем данные, если задача всё равно будет отклонена
+        # Создание сегмента и копирование (с первыми обращениями к страницам) - вне event loop
+        segment = await asyncio.to_thread(self._copy_to_shared_memory, data)
+        try:
+            return await self._submit(_scan_shared_memory_job, segment.name, size, yara_path)
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def get_stats(self) -> Dict[str, Any]:
+        completed = self._stats["completed"]
+        return {
+            "enabled": self._executor is not None,
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_queue": self.max_queue,
+            "job_timeout": self.job_timeout,
+            "avg_scan_ms": round(self._scan_seconds / completed * 1000, 1) if completed else None,
+            **self._stats,
+        }
+
+    # ---------------------- Внутренние методы ----------------------
+
+    def _check_capacity(self) -> None:
+        if self._pending >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise FileAnalysisBusyError(f"File analysis queue is full ({self._pending} pending)")
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn: процессы не наследуют потоки и соединения основного процесса
+        context = multiprocessing.get_context(file_analysis_config.FILE_ANALYSIS_START_METHOD)
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_init_worker, initargs=(self._rules,),
+        )
+
+    async def _submit(self, func, *args) -> Dict[str, Any]:
+        self._check_capacity()
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                executor = self._executor
+                if executor is None:
+                    raise FileAnalysisBusyError("File analysis pool is not running")
+                started = time.monotonic()
+                future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+                try:
+                    result = await asyncio.wait_for(future, timeout=self.job_timeout)
+                except asyncio.TimeoutError:
+                    self._stats["timeouts"] += 1
+                    self._restart(executor, "job timeout")
+                    raise FileAnalysisTimeoutError(f"File scan exceeded {self.job_timeout}s")
+                except BrokenProcessPool:
+                    self._stats["failed"] += 1
+                    self._restart(executor, "worker crashed")
+                    raise
+                except Exception:
+                    self._stats["failed"] += 1
+                    raise
+                self._stats["completed"] += 1
+                self._scan_seconds += time.monotonic() - started
+                return result
+        finally:
+            self._pending -= 1
+
+    def _restart(self, executor: ProcessPoolExecutor, reason: str) -> None:
+        """Завершает процессы пула (зависшую задачу иначе не остановить) и создаёт новый пул."""
+        if executor is not self._executor:
+            return  # пул уже пересоздан другой задачей
+        logger.warning(f"Restarting file analysis pool: {reason}")
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._create_executor()
+        self._stats["restarts"] += 1
+
+    @staticmethod
+    def _shareable_path(raw) -> Optional[str]:
+        """Путь, по которому процесс пула откроет тот же файл без копирования."""
+        name = getattr(raw, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            return name
+        fd_path = f"/proc/{os.getpid()}/fd/{raw.fileno()}"
+        return fd_path if os.path.exists(fd_path) else None
+
+    @staticmethod
+    def _copy_to_shared_memory(data) -> shared_memory.SharedMemory:
+        segment = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        segment.buf[:len(data)] = data
+        return segment
+
+    @staticmethod
+    def _copy_to_tempfile(raw) -> str:
+        raw.seek(0)
+        with tempfile.NamedTemporaryFile(prefix="upload_", delete=False) as spool:
+            while True:
+                chunk = raw.read(1024 * 1024)
+                if not chunk:
+                    break
+                spool.write(chunk)
+            return spool.name
+
+
+def fileobj_size(fileobj: BinaryIO) -> int:
+    """Размер файлового объекта загрузки без чтения содержимого."""
+    raw = getattr(fileobj, "_file", fileobj)
+    if isinstance(raw, io.BytesIO):
+        return raw.getbuffer().nbytes
+    try:
+        return os.fstat(raw.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        position = raw.tell()
+        size = raw.seek(0, os.SEEK_END)
+        raw.seek(position)
+        return size
+
+
+# Глобальный пул анализа файлов
+file_analysis_pool = FileAnalysisPool()
@@ -0,0 +1,329 @@
+# app/file_analysis/yara_rules.py
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import file_analysis_config
+from app.logger import logger
+
+try:
+    import yara
+except ImportError:  # yara-python не обязателен - без него работают только сигнатуры SignatureMatcher
+    yara = None
+
+YARA_EXTENSIONS = (".yar", ".yara")
+COMPILED_SUFFIX = ".yarc"
+# Сколько последних скомпилированных наборов хранить в кэше (процессы пула могут ещё использовать старый)
+KEEP_COMPILED = 3
+
+
+def rule_files(directory: Optional[str]) -> List[Path]:
+    if not directory or not Path(directory).is_dir():
+        return []
+    return sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in YARA_EXTENSIONS and p.is_file())
+
+
+def rules_fingerprint(directory: str, files: List[Path]) -> str:
+    """Хеш содержимого всех файлов правил - версия набора и ключ кэша скомпилированных правил."""
+    digest = hashlib.sha256(getattr(yara, "YARA_VERSION", "").encode())
+    for path in files:
+        digest.update(str(path.relative_to(directory)).encode())
+        digest.update(b"\x00")
+        digest.update(path.read_bytes())
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+class CompiledYaraRules:
+    """
+    Неизменяемый скомпилированный набор YARA-правил.
+
+    Сканирование держит ссылку на свой экземпляр, поэтому замена набора при
+    перезагрузке не затрагивает уже идущие проверки.
+    """
+
+    def __init__(self, rules, version: str, path: Optional[str] = None):
+        self.rules = rules
+        self.version = version
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledYaraRules":
+        """Загружает скомпилированный набор из кэша (используется процессами пула)."""
+        return cls(yara.load(path), Path(path).stem, path)
+
+    def match(self, data, timeout: int = file_analysis_config.YARA_SCAN_TIMEOUT) -> Dict[str, Any]:
+        """Сканирует буфер (bytes, memoryview, mmap). Возвращает совпадения и время сканирования."""
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"version": self.version, "matches": []}
+        try:
+            for match in self.rules.match(data=data, timeout=timeout):
+                result["matches"].append({
+                    "rule": match.rule,
+                    "namespace": match.namespace,
+                    "tags": list(match.tags),
+                    "meta": dict(match.meta),
+                    "strings": len(match.strings),
+                })
+        except yara.TimeoutError:
+            result["error"] = "timeout"
+        except yara.Error as e:
+            result["error"] = str(e)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        # Стоимость правил доступна, только если libyara собрана с поддержкой профилирования
+        try:
+            result["rule_costs"] = {
+                f"{item['namespace']}:{item['rule']}": item["cost"] for item in self.rules.profiling_info()
+            }
+        except Exception:
+            pass
+        return result
+
+
+class YaraRuleManager:
+    """
+    Загрузка каталогов YARA-правил с кэшем скомпилированного байткода.
+
+    Набор компилируется один раз и сохраняется в YARA_CACHE_DIR под именем,
+    равным хешу содержимого файлов правил, - повторный запуск и процессы пула
+    загружают готовый байткод. Изменения каталога отслеживаются в фоне:
+    новый набор компилируется в потоке и подменяется одной операцией
+    присваивания, ошибки компиляции оставляют прежний набор в работе.
+    Ведётся статистика времени сканирования и срабатываний по правилам.
+    """
+
+    def __init__(self,
+                 rules_dir: str = file_analysis_config.YARA_RULES_DIR,
+                 cache_dir: str = file_analysis_config.YARA_CACHE_DIR,
+                 reload_interval: int = file_analysis_config.YARA_RELOAD_INTERVAL):
+        self.rules_dir = rules_dir
+        self.cache_dir = Path(cache_dir)
+        self.reload_interval = reload_interval
+        self.current: Optional[CompiledYaraRules] = None
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._files_state: Optional[tuple] = None
+        self._load_info: Dict[str, Any] = {}
+        self._scan_stats = {"scans": 0, "timeouts": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        self._rule_stats: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def available(self) -> bool:
+        return yara is not None
+
+    @property
+    def compiled_path(self) -> Optional[str]:
+        current = self.current
+        return current.path if current else None
+
+    @property
+    def pool_compatible(self) -> bool:
+        """
+        Могут ли процессы пула сканировать тем же набором: правил нет или байткод
+        сохранен в кэше. Если сохранить не удалось, пул сканировал бы без YARA.
+        """
+        current = self.current
+        return current is None or current.path is not None
+
+    def load(self, force: bool = False) -> bool:
+        """Загружает набор правил (из кэша или компилируя). Возвращает True, если набор сменился."""
+        if yara is None:
+            return False
+        with self._lock:
+            files = rule_files(self.rules_dir)
+            self._files_state = self._stat_files(files)
+            if not files:
+                if self.current is not None:
+                    logger.info("YARA rules directory is empty, YARA scanning disabled")
+                self.current = None
+                return False
+            version = rules_fingerprint(self.rules_dir, files)
+            if self.current is not None and self.current.version == version and not force:
+                return False
+            started = time.perf_counter()
+            try:
+                compiled, from_cache = self._load_or_compile(files, version)
+            except yara.Error as e:
+                logger.error(f"YARA rules compilation failed, keeping previous ruleset: {e}")
+                self._load_info["last_error"] = str(e)
+                return False
+            self.current = compiled  # атомарная подмена: идущие проверки дорабатывают со старым набором
+            self._rule_stats = {}
+            self._load_info = {
+                "version": version,
+                "files": len(files),
+                "from_cache": from_cache,
+                "load_ms": round((time.perf_counter() - started) * 1000, 1),
+                "loaded_at": time.time(),
+            }
+            logger.info(
+                f"YARA ruleset {version} loaded: {len(files)} files, "
+                f"{'cached bytecode' if from_cache else 'compiled'} in {self._load_info['load_ms']} ms"
+            )
+            return True
+
+    async def reload(self, force: bool = False) -> bool:
+        return await asyncio.to_thread(self.load, force)
+
+    async def start(self):
+        if self.running or yara is None:
+            if yara is None:
+                logger.info("yara-python is not installed, YARA rule packs disabled")
+            return
+        await self.reload()
+        if self.reload_interval > 0:
+            self.running = True
+            self.task = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def match(self, data) -> Optional[Dict[str, Any]]:
+        current = self.current
+        return current.match(data) if current else None
+
+    def record(self, result: Optional[Dict[str, Any]]) -> None:
+        """Учитывает результат сканирования (в том числе выполненного в процессе пула)."""
+        if not result:
+            return
+        stats = self._scan_stats
+        stats["scans"] += 1
+        stats["total_ms"] += result.get("elapsed_ms", 0.0)
+        stats["max_ms"] = max(stats["max_ms"], result.get("elapsed_ms", 0.0))
+        if result.get("error") == "timeout":
+            stats["timeouts"] += 1
+        elif result.get("error"):
+            stats["errors"] += 1
+        for match in result.get("matches", []):
+            rule = self._rule_stats.setdefault(f"{match['namespace']}:{match['rule']}", {"matches": 0, "cost": 0})
+            rule["matches"] += 1
+        for name, cost in (result.get("rule_costs") or {}).items():
+            self._rule_stats.setdefault(name, {"matches": 0, "cost": 0})["cost"] = cost
+
+    def profile_files(self, data, timeout: int = file_analysis_config.YARA_SCAN_TIMEOUT) -> List[Dict[str, Any]]:
+        """
+        Время сканирования образца каждым файлом правил по отдельности - поиск медленных правил.
+
+        Компилирует каждый файл отдельно, поэтому вызывается по запросу администратора,
+        а не при обычном сканировании.
+        """
+        if yara is None:
+            return []
+        report = []
+        for path in rule_files(self.rules_dir):
+            entry: Dict[str, Any] = {"file": str(path.relative_to(self.rules_dir))}
+            try:
+                rules = yara.compile(filepath=str(path))
+                started = time.perf_counter()
+                entry["matches"] = len(rules.match(data=data, timeout=timeout))
+                entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            except yara.TimeoutError:
+                entry["error"] = "timeout"
+                entry["elapsed_ms"] = timeout * 1000
+            except yara.Error as e:
+                entry["error"] = str(e)
+            report.append(entry)
+        return sorted(report, key=lambda item: item.get("elapsed_ms", 0), reverse=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self._scan_stats
+        top_rules = sorted(self._rule_stats.items(), key=lambda item: (item[1]["cost"], item[1]["matches"]), reverse=True)
+        return {
+            "available": self.available,
+            "ruleset": self._load_info,
+            "scans": stats["scans"],
+            "timeouts": stats["timeouts"],
+            "errors": stats["errors"],
+            "avg_scan_ms": round(stats["total_ms"] / stats["scans"], 3) if stats["scans"] else None,
+            "max_scan_ms": round(stats["max_ms"], 3),
+            "rules": [{"rule": name, **values} for name, values in top_rules[:20]],
+        }
+
+    # ---------------------- Внутренние методы ----------------------
+
+    def _load_or_compile(self, files: List[Path], version: str):
+        cached = self.cache_dir / f"{version}{COMPILED_SUFFIX}"
+        if cached.exists():
+            try:
+                return CompiledYaraRules.load(str(cached)), True
+            except yara.Error as e:
+                logger.warning(f"Compiled YARA cache {cached.name} is unreadable, recompiling: {e}")
+
+        # Пространство имён - путь файла относительно каталога (одноимённые правила в разных файлах не конфликтуют)
+        filepaths = {str(path.relative_to(self.rules_dir).with_suffix("")): str(path) for path in files}
+        rules = yara.compile(filepaths=filepaths)
+        path = None
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Запись во временный файл и переименование - процессы пула не увидят недописанный файл
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            os.close(fd)
+            rules.save(tmp_path)
+            os.replace(tmp_path, cached)
+            path = str(cached)
+            self._prune_cache(keep=cached)
+        except (OSError, yara.Error) as e:
+            logger.warning(f"Failed to store compiled YARA rules in {self.cache_dir}: {e}")
+        return CompiledYaraRules(rules, version, path), False
+
+    def _prune_cache(self, keep: Path) -> None:
+        compiled = sorted(self.cache_dir.glob(f"*{COMPILED_SUFFIX}"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for stale in [p for p in compiled if p != keep][KEEP_COMPILED - 1:]:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _stat_files(files: List[Path]) -> tuple:
+        state = []
+        for path in files:
+            try:
+                info = path.stat()
+                state.append((str(path), info.st_mtime_ns, info.st_size))
+            except OSError:
+                continue
+        return tuple(state)
+
+    async def _watch_loop(self):
+        """Дешёвая проверка (mtime/размер файлов); при изменениях - перезагрузка набора."""
+        while self.running:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                state = await asyncio.to_thread(lambda: self._stat_files(rule_files(self.rules_dir)))
+                if state != self._files_state:
+                    await self.reload()
+            except Exception as e:
+                logger.error(f"YARA rules reload error: {e}")
+
+
+# ---------------------- Процессы пула анализа ----------------------
+
+_worker_rules: Optional[CompiledYaraRules] = None
+
+
+def worker_rules(path: Optional[str]) -> Optional[CompiledYaraRules]:
+    """Набор правил в процессе пула: загружается из кэша при первой задаче с новой версией."""
+    global _worker_rules
+    if not path or yara is None:
+        return None
+    if _worker_rules is None or _worker_rules.path != path:
+        _worker_rules = CompiledYaraRules.load(path)
+    return _worker_rules
+
+
+# Глобальный менеджер YARA-правил
+yara_rule_manager = YaraRuleManager()
@@ -4,6 +4,7 @@ import logging.handlers
 from datetime import datetime
 from pathlib import Path
 from app.config import logging_config
+from app.startup_profile import startup_profile
 
 def setup_logging():
     """Настройка логирования для приложения с ротацией."""
@@ -70,8 +71,8 @@ def cleanup_old_logs():
     except Exception as e:
         logging.getLogger(__name__).error(f"Error cleaning up old logs: {e}")
 
-# Глобальный логгер
-logger = setup_logging()
-
-# Очищаем старые логи при запуске
-cleanup_old_logs()
\ No newline at end of file
+# Глобальный логгер (очистка старых логов - отложенная задача после запуска сервера).
+# Настройка остается при импорте: хендлеры нужны до первого сообщения любого модуля,
+# а стоит она доли миллисекунды (шаг logging.setup в профиле запуска)
+with startup_profile.measure("logging.setup"):
+    logger = setup_logging()
\ No newline at end of file
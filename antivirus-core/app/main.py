@@ -1,6 +1,7 @@
 # app/main.py
 import asyncio
 import contextlib
+import secrets
 import time
 import os
 from datetime import datetime
@@ -36,17 +37,33 @@ def _load_env_file():
 
 _load_env_file()
 
+# Профиль запуска импортируется первым: замеры начинаются до загрузки остальных модулей
+from app.startup_profile import startup_profile
+
 from fastapi import FastAPI, HTTPException, File, UploadFile, Request, Depends, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
-from app.logger import logger
+startup_profile.checkpoint("import.framework", kind="import")
+
+from app.logger import logger, cleanup_old_logs
 import psycopg2
-from app.security import jwt_auth
+from app.security import jwt_auth, url_recheck_auth
 from app.websocket_manager import WebSocketManager, ClientConnection
+from app.config import websocket_config, security_config, metrics_config, tracing_config, startup_config, search_config
+from app.file_analysis.scanner import FileTooLargeError
+from app.file_analysis.worker_pool import FileAnalysisBusyError, FileAnalysisTimeoutError, file_analysis_pool
+from app.file_analysis.yara_rules import yara_rule_manager
+from app.domain_matcher import trusted_domain_manager
+from app.metrics import mark_process_dead, metrics_sampler, provider_health, render as render_metrics
+from app.tracing import should_trace, trace_request
+from app.cache import disk_cache
+from app.responses import FastJSONResponse
+from app.pg_listener import pg_listener
+from app.event_bus import event_bus
 from app.schemas import (
     CheckResponse,
     UrlCheckRequest,
@@ -59,7 +76,9 @@ from app.schemas import (
 from app.validators import security_validator
 from app.external_apis.manager import external_api_manager
 from app.admin_ui import router as admin_ui_router
-from app.background_jobs import background_job_manager
+from app.background_jobs import background_job_manager, PRIORITY_HIGH, PRIORITY_LOW
+from app.threat_feeds import threat_feed_loader
+from app.cache_revalidator import cache_revalidator
 from app.auth import auth_manager
 from app.routes.payments import router as payments_router
 
@@ -76,6 +95,17 @@ except Exception as import_error:
             return {"safe": None, "details": "Service unavailable", "source": "error"}
         async def analyze_uploaded_file(self, file_content, original_filename):
             return {"safe": None, "details": "Service unavailable", "source": "error"}
+        async def analyze_upload_stream(self, fileobj, original_filename, max_size=None):
+            return {"safe": None, "details": "Service unavailable", "source": "error"}
+        def clear_cache(self):
+            pass
+        def purge_stale_cache_entries(self):
+            return 0
+        def warm_up_signatures(self):
+            pass
+        @staticmethod
+        def _normalize_url_for_analysis(url):
+            return url
     analysis_service = DummyAnalysisService()
 
 try:
@@ -84,6 +114,8 @@ except Exception as import_error:
     logger.critical(f"Failed to import db_manager: {import_error}", exc_info=True)
     db_manager = None
 
+startup_profile.checkpoint("import.app", kind="import")
+
 def check_feature_access(request: Request, required_feature: str) -> bool:
     """Проверяет доступ к конкретной функции через JWT токен"""
     user_info = getattr(request.state, 'user_info', None)
@@ -152,7 +184,7 @@ async def handle_ws_message(client: ClientConnection, message: Dict[str, Any]) -
             channels = [str(ch) for ch in payload]
         elif isinstance(payload, dict):
             channels = [str(ch) for ch in payload.get("channels", [])]
-        client.subscriptions = set(channels)
+        ws_manager.set_subscriptions(client, channels)
         await ws_manager.send_json(client, {
             "type": "subscribed",
             "channels": list(client.subscriptions),
@@ -218,6 +250,11 @@ async def handle_ws_message(client: ClientConnection, message: Dict[str, Any]) -
             logger.info(f"[WS] Sent analysis_result for {url} to client {client.id}")
         except Exception as send_error:
             logger.error(f"[WS] Failed to send analysis_result for {url}: {send_error}", exc_info=True)
+
+        try:
+            await event_bus.publish_verdict(url, result)
+        except Exception as bus_error:
+            logger.warning(f"[EVENT BUS] Failed to publish verdict for {url}: {bus_error}")
         return
 
     if msg_type == "analyze_file_hash":
@@ -263,7 +300,31 @@ async def websocket_cleanup_task() -> None:
             await ws_manager.remove_stale_clients()
         except Exception as exc:
             logger.error(f"[WS] Cleanup task error: {exc}", exc_info=True)
-        await asyncio.sleep(30)
+        await asyncio.sleep(websocket_config.WS_SWEEP_INTERVAL)
+
+async def deferred_startup_maintenance() -> None:
+    """
+    Полные проходы (старые логи, устаревшие записи диск-кэша) и прогрев сигнатур.
+    Запускаются после старта, когда сервер уже принимает запросы.
+    """
+    await asyncio.sleep(startup_config.STARTUP_MAINTENANCE_DELAY)
+    steps = [
+        ("maintenance.cleanup_old_logs", cleanup_old_logs),
+        ("maintenance.clear_expired_cache", disk_cache.clear_expired),
+        ("maintenance.backfill_disk_cache_index", disk_cache.backfill_index_columns),
+        ("maintenance.purge_local_only_cache", analysis_service.purge_stale_cache_entries),
+    ]
+    if db_manager and search_config.SEARCH_ENSURE_INDEXES:
+        steps.append(("maintenance.ensure_search_indexes", db_manager.ensure_search_indexes))
+    if startup_config.STARTUP_WARM_SIGNATURES:
+        steps.append(("maintenance.warm_signatures", analysis_service.warm_up_signatures))
+    for name, step in steps:
+        try:
+            with startup_profile.measure(name, kind="background"):
+                await asyncio.to_thread(step)
+        except Exception as exc:
+            logger.warning(f"Startup maintenance step {name} failed: {exc}")
+    logger.info("Startup maintenance finished")
 
 # Схемы для аутентификации
 class RegisterRequest(BaseModel):
@@ -279,6 +340,7 @@ app = FastAPI(
     title="Antivirus Core API",
     description="API ядра для антивирусного расширения браузера", 
     version="0.3.0",
+    default_response_class=FastJSONResponse,
 )
 
 ws_manager = WebSocketManager()
@@ -407,7 +469,7 @@ app.add_middleware(GZipMiddleware, minimum_size=500)
 @app.get("/ws/health")
 async def websocket_health_check():
     """Проверка доступности WebSocket endpoint."""
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=200,
         content={
             "status": "ok",
@@ -518,7 +580,7 @@ async def filter_invalid_requests(request: Request, call_next):
     valid_methods = {"GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD"}
     if request.method not in valid_methods:
         logger.warning(f"Invalid HTTP method: {request.method}")
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=400,
             content={"detail": "Invalid HTTP method"},
             headers={"Access-Control-Allow-Origin": "*"}
@@ -534,7 +596,7 @@ async def filter_invalid_requests(request: Request, call_next):
     # Исключаем наши легитимные admin эндпоинты
     if (any(request.url.path.startswith(path) for path in malicious_paths) and not request.url.path.startswith("/admin/stats") and not request.url.path.startswith("/admin/api-keys") and not request.url.path.startswith("/admin/add")):
         logger.warning(f"Blocked suspicious path: {request.url.path}")
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=404,
             content={"detail": "Not found"},
             headers={"Access-Control-Allow-Origin": "*"}
@@ -564,6 +626,7 @@ async def jwt_auth_middleware(request: Request, call_next):
         "/health",
         "/health/minimal",
         "/health/hover",
+        "/metrics",  # Защищён METRICS_TOKEN или X-Admin-Token, не JWT
         "/docs",
         "/redoc",
         "/openapi.json",
@@ -621,7 +684,7 @@ async def jwt_auth_middleware(request: Request, call_next):
             return await call_next(request)
         else:
             # Для защищённых путей требуется токен
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=401,
                 content={"detail": "Authorization token required"},
                 headers={"Access-Control-Allow-Origin": "*", "WWW-Authenticate": "Bearer"}
@@ -637,7 +700,7 @@ async def jwt_auth_middleware(request: Request, call_next):
             request.state.user_info = None
             return await call_next(request)
         else:
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=401, 
                 content={"detail": "Invalid or expired token"},
                 headers={"Access-Control-Allow-Origin": "*", "WWW-Authenticate": "Bearer"}
@@ -672,7 +735,7 @@ async def error_handling_middleware(request: Request, call_next):
     except HTTPException as e:
         # Передаем HTTP исключения как есть
         logger.warning(f"HTTP error {e.status_code}: {e.detail} for {request.url.path}")
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=e.status_code,
             content={"detail": e.detail, "error_code": e.status_code},
             headers={"Access-Control-Allow-Origin": "*"}
@@ -710,7 +773,7 @@ async def error_handling_middleware(request: Request, call_next):
             error_detail["error_type"] = error_type
             error_detail["error_message"] = error_message[:200]  # Ограничиваем длину
         
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content=error_detail,
             headers={"Access-Control-Allow-Origin": "*"}
@@ -720,7 +783,7 @@ async def error_handling_middleware(request: Request, call_next):
 async def health_check():
     """КРИТИЧНО: Минимальный health check БЕЗ зависимостей от БД или внешних API"""
     try:
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=200,
             content={
                 "status": "success",
@@ -734,7 +797,7 @@ async def health_check():
     except Exception as e:
         # Даже health check должен обрабатывать ошибки
         logger.error(f"Health check error: {e}", exc_info=True)
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=200,  # Все равно 200, чтобы показать что сервер жив
             content={
                 "status": "error",
@@ -747,7 +810,7 @@ async def health_check():
 @app.get("/health/minimal")
 async def minimal_health_check():
     """КРИТИЧНО: Абсолютно минимальный health check - только проверка что сервер отвечает"""
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=200,
         content={"status": "ok"},
         headers={"Access-Control-Allow-Origin": "*"}
@@ -766,26 +829,39 @@ async def health_check_hover(request: Request):
         # 1. Проверка соединения с БД
         if db_manager:
             test_url = "https://example.com"
-        try:
-            db_test = db_manager.check_url(test_url)
-            health_status["components"]["database"] = "connected"
-        except (psycopg2.OperationalError, psycopg2.InterfaceError, AttributeError) as db_error:
-            error_msg = str(db_error).lower()
-            health_status["components"]["database"] = f"error: {str(db_error)[:50]}"
-            health_status["status"] = "degraded"
-        except Exception as db_error:
-            logger.warning(f"Hover health check: DB error: {db_error}")
-            health_status["components"]["database"] = f"error: {str(db_error)[:50]}"
-            health_status["status"] = "degraded"
+            try:
+                await asyncio.to_thread(db_manager.check_url, test_url)
+                health_status["components"]["database"] = "connected"
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, AttributeError) as db_error:
+                health_status["components"]["database"] = f"error: {str(db_error)[:50]}"
+                health_status["status"] = "degraded"
+            except Exception as db_error:
+                logger.warning(f"Hover health check: DB error: {db_error}")
+                health_status["components"]["database"] = f"error: {str(db_error)[:50]}"
+                health_status["status"] = "degraded"
         else:
             health_status["components"]["database"] = "unavailable"
             health_status["status"] = "degraded"
         
-        # 2. Проверка внешних API (быстрая проверка доступности)
+        # 2. Состояние внешних API без реальных запросов: включённые провайдеры,
+        # расход лимитов и ошибки последних вызовов (подряд)
         try:
-            import asyncio
-            # Быстрая проверка без реального запроса
-            health_status["components"]["external_apis"] = "available"
+            providers = provider_health()
+            quotas = {name: {"used": used, "limit": limit} for name, used, limit in external_api_manager.quota_usage()}
+            apis = {}
+            for name, enabled in external_api_manager.enabled_apis.items():
+                state = providers.get(name, {})
+                apis[name] = {
+                    "enabled": enabled,
+                    "consecutive_errors": state.get("consecutive_errors", 0),
+                    "last_error_kind": state.get("last_error_kind"),
+                    "quota": quotas.get(name),
+                }
+            enabled_apis = [name for name, info in apis.items() if info["enabled"]]
+            failing = [name for name in enabled_apis if apis[name]["consecutive_errors"] >= 3]
+            health_status["components"]["external_apis"] = apis
+            if not enabled_apis or len(failing) == len(enabled_apis):
+                health_status["status"] = "degraded"
         except Exception as api_error:
             health_status["components"]["external_apis"] = f"error: {str(api_error)[:50]}"
             health_status["status"] = "degraded"
@@ -814,7 +890,7 @@ async def health_check_hover(request: Request):
         
         status_code = 200 if health_status["status"] == "healthy" else (503 if health_status["status"] == "unhealthy" else 200)
         
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=status_code,
             content={
                 **health_status,
@@ -825,7 +901,7 @@ async def health_check_hover(request: Request):
         )
     except Exception as e:
         logger.error(f"Hover health check failed: {e}", exc_info=True)
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content={
                 "status": "unhealthy",
@@ -835,6 +911,27 @@ async def health_check_hover(request: Request):
             headers={"Access-Control-Allow-Origin": "*"}
         )
 
+def _token_matches(received: str, expected: str) -> bool:
+    """Сравнение токенов за постоянное время; пустой ожидаемый токен не совпадает ни с чем"""
+    return bool(expected) and secrets.compare_digest(received.encode(), expected.encode())
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """
+    Метрики Prometheus (в многопроцессном режиме - по всем воркерам).
+    Доступ: Authorization: Bearer METRICS_TOKEN или X-Admin-Token; без токена - только
+    при METRICS_PUBLIC=true. Метрики раскрывают квоты провайдеров и состояние очередей.
+    """
+    if not metrics_config.METRICS_PUBLIC:
+        auth_header = request.headers.get("Authorization", "")
+        bearer = auth_header[7:] if auth_header.startswith("Bearer ") else ""
+        if not (_token_matches(bearer, metrics_config.METRICS_TOKEN)
+                or _token_matches(request.headers.get("X-Admin-Token", ""), os.getenv("ADMIN_API_TOKEN", ""))):
+            raise HTTPException(status_code=401, detail="Invalid metrics token",
+                                headers={"WWW-Authenticate": "Bearer"})
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/auth/validate")
 async def validate_key(request: Request):
     """Проверка валидности JWT токена для клиентских приложений"""
@@ -883,6 +980,11 @@ async def admin_ui_refresh():
         "Last-Modified": "Thu, 01 Jan 1970 00:00:00 GMT"
     })
 
+def _trace_requested(request: Request) -> bool:
+    """Клиент просит трассу этапов: заголовок TRACE_HEADER или параметр TRACE_QUERY_PARAM"""
+    flag = request.headers.get(tracing_config.TRACE_HEADER) or request.query_params.get(tracing_config.TRACE_QUERY_PARAM)
+    return (flag or "").lower() in ("1", "true", "yes")
+
 @app.post("/check/url", response_model=CheckResponse)
 async def check_url_secure(
     url_request: UrlCheckRequest,
@@ -908,7 +1010,7 @@ async def check_url_secure(
             validation_error = security_validator.validate_url(url_str)
         except Exception as validation_ex:
             logger.error(f"URL validation error: {validation_ex}", exc_info=True)
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=400,
                 content={"detail": f"Invalid URL format: {str(validation_ex)}", "safe": None, "source": "validation_error"},
                 headers={"Access-Control-Allow-Origin": "*"}
@@ -916,7 +1018,7 @@ async def check_url_secure(
         
         if validation_error:
             logger.warning(f"[CHECK_URL] Validation error ({'HOVER' if is_hover else 'POPUP'}): {validation_error}")
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=400,
                 content={"detail": validation_error, "safe": None, "source": "validation_error"},
                 headers={"Access-Control-Allow-Origin": "*"}
@@ -930,18 +1032,21 @@ async def check_url_secure(
         if is_hover:
             logger.debug(f"[CHECK_URL HOVER] Starting analysis with external APIs")
         
-        # КРИТИЧНО: Используем асинхронный вызов с обработкой ошибок
-        try:
-            result = await analysis_service.analyze_url(url_str, use_external_apis=use_external_apis)
-        except Exception as analysis_error:
-            logger.error(f"Analysis service error for {url_str}: {analysis_error}", exc_info=True)
-            # Возвращаем безопасный результат вместо падения
-            result = {
-                "safe": None,
-                "threat_type": None,
-                "details": f"Analysis temporarily unavailable: {type(analysis_error).__name__}",
-                "source": "error"
-            }
+        # Трасса этапов анализа: по запросу клиента (timings в ответе) или выборочно (только для админки)
+        trace_requested = _trace_requested(request)
+        with trace_request(f"check_url {url_str[:200]}", should_trace(trace_requested)) as trace:
+            # КРИТИЧНО: Используем асинхронный вызов с обработкой ошибок
+            try:
+                result = await analysis_service.analyze_url(url_str, use_external_apis=use_external_apis)
+            except Exception as analysis_error:
+                logger.error(f"Analysis service error for {url_str}: {analysis_error}", exc_info=True)
+                # Возвращаем безопасный результат вместо падения
+                result = {
+                    "safe": None,
+                    "threat_type": None,
+                    "details": f"Analysis temporarily unavailable: {type(analysis_error).__name__}",
+                    "source": "error"
+                }
         
         # КРИТИЧНО: Проверяем что result валиден
         if not result or not isinstance(result, dict):
@@ -1005,9 +1110,20 @@ async def check_url_secure(
         except Exception as persist_error:
             logger.warning(f"Failed to persist URL verdict to cache DB for {url_str}: {persist_error}")
 
-        return JSONResponse(
+        # Рассылаем вердикт подписчикам 'verdicts' на всех воркерах
+        try:
+            await event_bus.publish_verdict(url_str, response_data)
+        except Exception as bus_error:
+            logger.warning(f"[EVENT BUS] Failed to publish verdict for {url_str}: {bus_error}")
+
+        headers = {"Access-Control-Allow-Origin": "*"}
+        if trace is not None and trace_requested:
+            response_data = {**response_data, "timings": trace.to_dict()}
+            headers["Server-Timing"] = trace.server_timing()
+            headers["Timing-Allow-Origin"] = "*"
+        return FastJSONResponse(
             content=response_data,
-            headers={"Access-Control-Allow-Origin": "*"}
+            headers=headers
         )
     except HTTPException:
         raise
@@ -1020,7 +1136,7 @@ async def check_url_secure(
             f"Traceback:\n{error_trace}",
             exc_info=True
         )
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content={
                 "detail": f"Internal server error: {type(e).__name__}",
@@ -1038,6 +1154,27 @@ async def scan_url_alias(
 ):
     return await check_url_secure(url_request, request)
 
+@app.post("/check/url/recheck")
+async def request_url_recheck(url_request: UrlCheckRequest,
+                              user_info: Dict[str, Any] = Depends(url_recheck_auth)):
+    """
+    Перепроверка URL по запросу пользователя (например, при несогласии с вердиктом).
+    Задача тратит квоту внешних API, поэтому нужен JWT и действует лимит
+    URL_RECHECK_PER_MINUTE на пользователя. Задача ставится с высоким
+    приоритетом - впереди массовых обновлений кэша; дедупликация идёт по
+    нормализованному URL.
+    """
+    validation_error = security_validator.validate_url(str(url_request.url))
+    if validation_error:
+        raise HTTPException(status_code=400, detail=validation_error)
+    url_str = analysis_service._normalize_url_for_analysis(str(url_request.url))
+    queued = await asyncio.to_thread(
+        background_job_manager.add_job, "url_recheck", {"url": url_str}, PRIORITY_HIGH
+    )
+    if not queued:
+        raise HTTPException(status_code=503, detail="Recheck queue is unavailable")
+    return {"status": "queued", "url": url_str}
+
 @app.post("/check/file", response_model=CheckResponse)  
 async def check_file_secure(
     file_request: FileCheckRequest,
@@ -1066,21 +1203,34 @@ async def check_uploaded_file(file: UploadFile = File(...)):
     try:
         logger.info(f"File upload started: {file.filename}")
         
-        # Валидация размера файла
-        file_content = await file.read()
-        size_validation = security_validator.validate_file_size(len(file_content))
-        if size_validation:
-            raise HTTPException(status_code=413, detail=size_validation)
-        
         # Валидация имени файла
         sanitized_filename = security_validator.sanitize_filename(file.filename or "unknown")
         
-        result = await analysis_service.analyze_uploaded_file(file_content, sanitized_filename)
+        # Файл не читается целиком: сканер проходит по нему блоками (mmap для файлов на диске),
+        # размер проверяется до начала сканирования
+        try:
+            result = await analysis_service.analyze_upload_stream(
+                file.file, sanitized_filename, max_size=security_config.MAX_FILE_SIZE_BYTES
+            )
+        except FileTooLargeError as size_error:
+            size_validation = security_validator.validate_file_size(size_error.size)
+            raise HTTPException(
+                status_code=413,
+                detail=size_validation or f"File too large. Maximum size: {security_config.MAX_FILE_SIZE_MB} MB"
+            )
+        except FileAnalysisBusyError:
+            raise HTTPException(
+                status_code=503,
+                detail="File analysis queue is full, retry later",
+                headers={"Retry-After": "5"}
+            )
+        except FileAnalysisTimeoutError:
+            raise HTTPException(status_code=504, detail="File analysis timed out")
         
         return {
             "status": "success",
             "filename": sanitized_filename,
-            "file_size": len(file_content),
+            "file_size": result.get("file_size"),
             **result
         }
     except HTTPException:
@@ -1155,6 +1305,85 @@ async def check_domain(domain: str):
         raise HTTPException(status_code=500, detail=f"Domain check error: {str(e)}")
 
 # Упрощенные административные эндпоинты
+@app.get("/admin/startup-profile")
+async def get_startup_profile():
+    """Профиль запуска процесса: этапы инициализации, время до готовности, фоновое обслуживание."""
+    return {"status": "success", "pid": os.getpid(), "profile": startup_profile.report()}
+
+@app.get("/admin/disk-cache/stats")
+async def get_disk_cache_stats():
+    """Статистика диск-кэша: записи по пространству ключей, source и вердикту."""
+    stats = await asyncio.to_thread(disk_cache.get_stats)
+    breakdown = await asyncio.to_thread(disk_cache.get_breakdown)
+    return {"status": "success", "stats": stats, "breakdown": breakdown}
+
+@app.post("/admin/disk-cache/purge")
+async def purge_disk_cache(namespace: Optional[str] = None, source: Optional[str] = None,
+                           safe: Optional[bool] = None):
+    """Выборочная очистка диск-кэша по пространству ключей (url, hash, verdict...), source и/или вердикту."""
+    if namespace is None and source is None and safe is None:
+        raise HTTPException(status_code=400, detail="Specify namespace, source or safe")
+    deleted = await asyncio.to_thread(disk_cache.delete_where, namespace, source, safe)
+    # Вердикты в памяти сервиса живут несколько минут - сбрасываем, чтобы очистка подействовала сразу
+    analysis_service.clear_cache()
+    return {"status": "success", "deleted": deleted,
+            "filters": {"namespace": namespace, "source": source, "safe": safe}}
+
+@app.get("/admin/feeds")
+async def get_threat_feeds():
+    """Результаты последних загрузок фидов угроз в этом процессе."""
+    return {"status": "success", "feeds_dir": str(threat_feed_loader.feeds_dir),
+            "feeds": threat_feed_loader.last_results}
+
+@app.post("/admin/feeds/ingest")
+async def ingest_threat_feed(file: str, kind: str, source: str, expire_missing: bool = True,
+                             threat_type: Optional[str] = None, severity: Optional[str] = None,
+                             repeat_interval: Optional[int] = None):
+    """
+    Загрузка фида угроз (файл из THREAT_FEEDS_DIR) в malicious_urls / malicious_hashes.
+    С repeat_interval (сек) ставится периодическая фоновая задача, иначе загрузка выполняется сразу.
+    """
+    try:
+        path = threat_feed_loader.resolve(file)
+        if repeat_interval:
+            job_data = {"file": file, "kind": kind, "source": source, "expire_missing": expire_missing,
+                        "threat_type": threat_type, "severity": severity}
+            if not background_job_manager.add_job("threat_feed_ingest", job_data, priority=PRIORITY_LOW,
+                                                  repeat_interval=repeat_interval):
+                raise HTTPException(status_code=500, detail="Failed to schedule feed ingestion")
+            return {"status": "success", "scheduled": True, "repeat_interval": repeat_interval}
+        result = await asyncio.to_thread(threat_feed_loader.ingest, path, kind, source, expire_missing,
+                                         threat_type, severity)
+        return {"status": "success", "result": result}
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Threat feed ingestion error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to ingest threat feed")
+
+@app.get("/admin/search")
+async def search_threats(q: str, table: Optional[str] = None, limit: int = 50, offset: int = 0):
+    """
+    Поиск URL/доменов по malicious_urls, cached_blacklist и cached_whitelist (или одной таблице).
+    Результаты ранжированы по триграммному расстоянию (pg_trgm, KNN по GiST); следующая страница - next_offset.
+    """
+    if not db_manager:
+        raise HTTPException(status_code=503, detail="Database is not configured")
+    if len(q.strip()) < search_config.SEARCH_MIN_TERM_LENGTH:
+        raise HTTPException(status_code=400,
+                            detail=f"Query must be at least {search_config.SEARCH_MIN_TERM_LENGTH} characters")
+    if offset > search_config.SEARCH_MAX_OFFSET:
+        raise HTTPException(status_code=400, detail=f"offset must not exceed {search_config.SEARCH_MAX_OFFSET}")
+    try:
+        found = await asyncio.to_thread(db_manager.search, q, [table] if table else None, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", **found}
+
 @app.get("/admin/stats")
 async def get_database_stats():
     """Получение статистики базы данных."""
@@ -1504,7 +1733,7 @@ async def check_hover_analysis(request: Request):
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
     """Обработчик 404 ошибок"""
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=404,
         content={
             "detail": f"Маршрут не найден: {request.url.path}",
@@ -1848,6 +2077,7 @@ async def bind_api_key(request: Request, bind_request: BindApiKeyRequest):
 @app.on_event("startup")
 async def startup_event():
     """Инициализация при старте сервера"""
+    startup_profile.checkpoint("server.boot")
     logger.info("🚀 AVQON Server starting up...")
     
     # КРИТИЧНО: Проверяем что база данных инициализирована и таблицы созданы
@@ -1893,6 +2123,43 @@ async def startup_event():
         except Exception as reset_error:
             logger.warning(f"Failed to reset rate limits: {reset_error}")
     
+    startup_profile.checkpoint("startup.database")
+
+    # Общее LISTEN-соединение: шина событий между воркерами и пробуждение очереди задач
+    try:
+        event_bus.attach(ws_manager)
+        if db_manager:
+            await pg_listener.start(db_manager.db_url)
+        await event_bus.start(pg_listener if db_manager else None)
+    except Exception as bus_error:
+        logger.error(f"Failed to start event bus: {bus_error}", exc_info=True)
+
+    startup_profile.checkpoint("startup.event_bus")
+
+    # YARA-правила: загрузка скомпилированного набора из кэша и слежение за каталогом правил
+    try:
+        await yara_rule_manager.start()
+    except Exception as yara_error:
+        logger.error(f"Failed to load YARA rules: {yara_error}", exc_info=True)
+
+    startup_profile.checkpoint("startup.yara_rules")
+
+    # Списки доверенных доменов (файлы и таблица trusted_domains) с горячей перезагрузкой
+    try:
+        await trusted_domain_manager.start()
+    except Exception as trusted_error:
+        logger.error(f"Failed to load trusted domains: {trusted_error}", exc_info=True)
+
+    startup_profile.checkpoint("startup.trusted_domains")
+
+    # Пул процессов для сканирования загруженных файлов (сигнатуры компилируются в каждом процессе)
+    try:
+        file_analysis_pool.start(getattr(analysis_service, "_yara_rules", []))
+    except Exception as pool_error:
+        logger.error(f"Failed to start file analysis pool: {pool_error}", exc_info=True)
+
+    startup_profile.checkpoint("startup.file_analysis_pool")
+
     # Запускаем фоновый менеджер задач
     try:
         await background_job_manager.start()
@@ -1900,6 +2167,22 @@ async def startup_event():
     except Exception as bg_error:
         logger.error(f"Failed to start background job manager: {bg_error}")
 
+    # Запускаем фоновую перепроверку популярных записей кэша
+    try:
+        if db_manager:
+            await cache_revalidator.start()
+    except Exception as reval_error:
+        logger.error(f"Failed to start cache revalidator: {reval_error}")
+
+    # Периодические gauge-метрики (WebSocket, пул анализа, лимиты API, очередь задач)
+    try:
+        metrics_sampler.attach(ws_manager)
+        await metrics_sampler.start()
+    except Exception as metrics_error:
+        logger.error(f"Failed to start metrics sampler: {metrics_error}")
+
+    startup_profile.checkpoint("startup.background_tasks")
+
     # Запускаем WebSocket cleanup task
     try:
         if not hasattr(app.state, 'ws_cleanup_task') or not app.state.ws_cleanup_task:
@@ -1947,6 +2230,12 @@ async def startup_event():
         app.state.yookassa_session = None
         logger.error(f"❌ Failed to initialize YooKassa session: {e}", exc_info=True)
     
+    # Профиль холодного старта; полные проходы по таблицам - фоном, когда сервер уже принимает запросы
+    startup_profile.checkpoint("startup.routes_and_payments")
+    startup_profile.mark_ready()
+    startup_profile.log_report()
+    app.state.maintenance_task = asyncio.create_task(deferred_startup_maintenance())
+    
 <<<<<<< HEAD
 <<<<<<< HEAD
     logger.info("✅ AVQON Server startup complete")
@@ -1966,6 +2255,10 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"Shutdown error: {e}")
 
+    maintenance_task = getattr(app.state, "maintenance_task", None)
+    if maintenance_task and not maintenance_task.done():
+        maintenance_task.cancel()
+
     cleanup_task = getattr(app.state, "ws_cleanup_task", None)
     if cleanup_task:
         cleanup_task.cancel()
@@ -1976,11 +2269,39 @@ async def shutdown_event():
                 logger.error(f"WebSocket cleanup task stop error: {e}", exc_info=True)
         app.state.ws_cleanup_task = None
 
+    try:
+        await cache_revalidator.stop()
+    except Exception as e:
+        logger.error(f"Cache revalidator stop error: {e}")
+
+    try:
+        await event_bus.stop()
+        await pg_listener.stop()
+    except Exception as exc:
+        logger.error(f"Event bus stop error: {exc}", exc_info=True)
+
+    try:
+        await trusted_domain_manager.stop()
+    except Exception as e:
+        logger.error(f"Trusted domains watcher stop error: {e}")
+
+    try:
+        await yara_rule_manager.stop()
+        file_analysis_pool.stop()
+    except Exception as exc:
+        logger.error(f"File analysis pool stop error: {exc}", exc_info=True)
+
     try:
         await ws_manager.close_all()
     except Exception as exc:
         logger.error(f"Error closing WebSocket clients: {exc}", exc_info=True)
 
+    try:
+        await metrics_sampler.stop()
+        mark_process_dead()
+    except Exception as e:
+        logger.error(f"Metrics sampler stop error: {e}")
+
     # 🔥 ЗАКРЫВАЕМ YooKassa session В КОНЦЕ
     session = getattr(app.state, "yookassa_session", None)
     if session and not session.closed:
@@ -0,0 +1,261 @@
+# app/metrics.py
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import metrics_config
+from app.logger import logger
+from app.tracing import record_span
+
+try:
+    import prometheus_client
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:  # prometheus-client не обязателен - без него метрики не собираются
+    prometheus_client = None
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Многопроцессный режим (несколько воркеров uvicorn): каждый процесс пишет значения в файлы
+# каталога PROMETHEUS_MULTIPROC_DIR, /metrics любого воркера суммирует их
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Границы гистограмм (сек): от кэша в памяти до таймаута внешних API
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class _NoopMetric:
+    """Заглушка метрики, когда prometheus-client не установлен или метрики выключены."""
+
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+def _enabled() -> bool:
+    return prometheus_client is not None and metrics_config.METRICS_ENABLED
+
+
+def _counter(name: str, documentation: str, labels=()):
+    return Counter(name, documentation, labels) if _enabled() else _NoopMetric()
+
+
+def _histogram(name: str, documentation: str, labels=(), buckets=FAST_BUCKETS):
+    return Histogram(name, documentation, labels, buckets=buckets) if _enabled() else _NoopMetric()
+
+
+def _gauge(name: str, documentation: str, labels=(), mode: str = "livesum"):
+    return Gauge(name, documentation, labels, multiprocess_mode=mode) if _enabled() else _NoopMetric()
+
+
+# ---------------------- Анализ URL ----------------------
+
+URL_ANALYSIS_SECONDS = _histogram(
+    "antivirus_url_analysis_seconds", "Полное время analyze_url", ["source"], buckets=SLOW_BUCKETS)
+URL_VERDICTS = _counter(
+    "antivirus_url_verdicts_total", "Итоговые вердикты по источнику", ["source", "safe"])
+URL_STAGE_SECONDS = _histogram(
+    "antivirus_url_stage_seconds", "Время этапов analyze_url", ["stage"])
+CACHE_LOOKUPS = _counter(
+    "antivirus_cache_lookups_total", "Обращения к уровням кэша вердиктов", ["tier", "result"])
+
+# ---------------------- Внешние API ----------------------
+
+PROVIDER_SECONDS = _histogram(
+    "antivirus_provider_request_seconds", "Время вызова внешнего API", ["provider"], buckets=SLOW_BUCKETS)
+PROVIDER_ERRORS = _counter(
+    "antivirus_provider_errors_total", "Ошибки внешних API", ["provider", "kind"])
+PROVIDER_RESPONSES = _counter(
+    "antivirus_provider_http_responses_total", "HTTP-ответы внешних API по статусу", ["provider", "status"])
+PROVIDER_QUOTA_USED = _gauge(
+    "antivirus_provider_quota_used", "Запросы к API за текущее окно лимита", ["provider"], mode="livesum")
+PROVIDER_QUOTA_LIMIT = _gauge(
+    "antivirus_provider_quota_limit", "Лимит запросов к API на окно (на процесс)", ["provider"], mode="max")
+
+# ---------------------- Хранилища ----------------------
+
+DISK_CACHE_SECONDS = _histogram(
+    "antivirus_disk_cache_op_seconds", "Время операций DiskCache", ["op"])
+DISK_CACHE_RESULTS = _counter(
+    "antivirus_disk_cache_results_total", "Результаты DiskCache.get", ["result"])
+DB_CONNECT_SECONDS = _histogram(
+    "antivirus_db_connect_seconds", "Время получения соединения с PostgreSQL")
+DB_CONNECT_ERRORS = _counter(
+    "antivirus_db_connect_errors_total", "Ошибки подключения к PostgreSQL")
+
+# ---------------------- WebSocket, фоновые задачи, пул анализа ----------------------
+
+WS_CONNECTIONS = _gauge("antivirus_websocket_connections", "Открытые WebSocket-подключения")
+WS_QUEUED_MESSAGES = _gauge("antivirus_websocket_queued_messages", "Сообщения в очередях отправки WebSocket")
+WS_EVICTIONS = _counter("antivirus_websocket_evictions_total", "Отключения медленных WebSocket-клиентов")
+JOB_LAG_SECONDS = _histogram(
+    "antivirus_background_job_lag_seconds", "Задержка между плановым запуском задачи и её захватом",
+    ["job_type"], buckets=LAG_BUCKETS)
+JOB_SECONDS = _histogram(
+    "antivirus_background_job_seconds", "Время выполнения фоновой задачи", ["job_type"], buckets=SLOW_BUCKETS)
+JOB_RESULTS = _counter(
+    "antivirus_background_jobs_total", "Завершённые фоновые задачи", ["job_type", "status"])
+JOBS_DUE = _gauge("antivirus_background_jobs_due", "Задачи, ожидающие выполнения (срок наступил)", mode="max")
+JOBS_OLDEST_DUE_SECONDS = _gauge(
+    "antivirus_background_jobs_oldest_due_seconds", "Возраст самой старой просроченной задачи", mode="max")
+FILE_POOL_PENDING = _gauge("antivirus_file_analysis_pending", "Задачи в пуле анализа файлов")
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Замер времени блока (или функции - как декоратор) в гистограмму."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def stage(name: str):
+    """Этап analyze_url: гистограмма этапов и span в трассе запроса (если она включена)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        URL_STAGE_SECONDS.labels(stage=name).observe(elapsed)
+        record_span(name, elapsed, started)
+
+
+def cache_lookup(tier: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(tier=tier, result="hit" if hit else "miss").inc()
+
+
+def observe_verdict(result: Optional[Dict[str, Any]], seconds: float) -> None:
+    result = result or {}
+    source = str(result.get("source") or "unknown")
+    safe = result.get("safe")
+    URL_ANALYSIS_SECONDS.labels(source=source).observe(seconds)
+    URL_VERDICTS.labels(source=source, safe="unknown" if safe is None else str(bool(safe)).lower()).inc()
+
+
+# ---------------------- Состояние внешних API для /health/hover ----------------------
+
+_provider_health: Dict[str, Dict[str, Any]] = {}
+
+
+def observe_provider(provider: str, seconds: float, error: Optional[str] = None) -> None:
+    """Учитывает вызов внешнего API: метрики и состояние для проверки здоровья."""
+    PROVIDER_SECONDS.labels(provider=provider).observe(seconds)
+    record_span(f"provider.{provider}", seconds)
+    state = _provider_health.setdefault(provider, {"consecutive_errors": 0, "last_success": None, "last_error": None})
+    if error:
+        PROVIDER_ERRORS.labels(provider=provider, kind=error).inc()
+        state["consecutive_errors"] += 1
+        state["last_error"] = time.time()
+        state["last_error_kind"] = error
+    else:
+        state["consecutive_errors"] = 0
+        state["last_success"] = time.time()
+
+
+def provider_health() -> Dict[str, Dict[str, Any]]:
+    return {name: dict(state) for name, state in _provider_health.items()}
+
+
+# ---------------------- Экспорт ----------------------
+
+def render() -> Tuple[bytes, str]:
+    """Текст метрик в формате Prometheus (в многопроцессном режиме - сумма по всем воркерам)."""
+    if not _enabled():
+        return b"# metrics disabled: prometheus-client is not installed or METRICS_ENABLED=false\n", CONTENT_TYPE_LATEST
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Удаляет файлы live-gauge завершившегося воркера (многопроцессный режим)."""
+    if _enabled() and MULTIPROCESS:
+        try:
+            multiprocess.mark_process_dead(os.getpid())
+        except Exception as e:
+            logger.warning(f"Failed to mark metrics process dead: {e}")
+
+
+class MetricsSampler:
+    """
+    Периодически переносит состояние процесса (WebSocket, пул анализа, лимиты
+    API, очередь фоновых задач) в gauge-метрики. Работает в каждом воркере:
+    в многопроцессном режиме значения суммируются при экспорте.
+    """
+
+    def __init__(self, interval: int = metrics_config.METRICS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        self.ws_manager = None
+
+    def attach(self, ws_manager) -> None:
+        """Подключает менеджер WebSocket, чьи подключения и очереди попадают в метрики."""
+        self.ws_manager = ws_manager
+
+    async def start(self):
+        if self.running or not _enabled() or self.interval <= 0:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def sample(self) -> None:
+        from app.external_apis.manager import external_api_manager
+        from app.file_analysis.worker_pool import file_analysis_pool
+
+        if self.ws_manager is not None:
+            ws_stats = self.ws_manager.get_stats()
+            WS_CONNECTIONS.set(ws_stats["connections"])
+            WS_QUEUED_MESSAGES.set(ws_stats["queued_messages"])
+        FILE_POOL_PENDING.set(file_analysis_pool.get_stats()["pending"])
+        for name, used, limit in external_api_manager.quota_usage():
+            PROVIDER_QUOTA_USED.labels(provider=name).set(used)
+            PROVIDER_QUOTA_LIMIT.labels(provider=name).set(limit)
+
+        from app.background_jobs import background_job_manager
+        if background_job_manager.running:
+            queue = await asyncio.to_thread(background_job_manager.get_queue_stats)
+            if queue:
+                JOBS_DUE.set(queue["due"])
+                JOBS_OLDEST_DUE_SECONDS.set(queue["oldest_due_seconds"])
+
+    async def _loop(self):
+        while self.running:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.warning(f"Metrics sampling error: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Глобальный сборщик периодических метрик
+metrics_sampler = MetricsSampler()
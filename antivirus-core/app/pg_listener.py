@@ -0,0 +1,170 @@
+# app/pg_listener.py
+import asyncio
+import threading
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from app.logger import logger
+
+
+class PgListener:
+    """
+    Выделенное соединение PostgreSQL для LISTEN/NOTIFY.
+
+    Соединение регистрируется в event loop через add_reader, поэтому уведомления
+    обрабатываются без опроса. Для NOTIFY используется отдельное соединение,
+    запросы к нему выполняются в пуле потоков.
+    """
+
+    def __init__(self, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.db_url: Optional[str] = None
+        self._conn = None
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._callbacks: Dict[str, List[Callable[[str], None]]] = {}
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        self.running = False
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.closed
+
+    async def start(self, db_url: str) -> None:
+        """Открывает LISTEN-соединение и подписывается на все зарегистрированные каналы."""
+        if self.running:
+            return
+        self.db_url = db_url
+        self._loop = asyncio.get_running_loop()
+        self.running = True
+        try:
+            await self._connect()
+            logger.info(f"[PG LISTEN] Listener started, channels: {list(self._callbacks)}")
+        except Exception as e:
+            logger.error(f"[PG LISTEN] Initial connection failed, will retry: {e}")
+            self._schedule_reconnect()
+
+    async def stop(self) -> None:
+        self.running = False
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        self._close_listen_connection()
+        with self._publish_lock:
+            if self._publish_conn is not None:
+                try:
+                    self._publish_conn.close()
+                except Exception:
+                    pass
+                self._publish_conn = None
+        logger.info("[PG LISTEN] Listener stopped")
+
+    async def subscribe(self, channel: str, callback: Callable[[str], None]) -> None:
+        """Регистрирует обработчик payload для канала (вызывается в потоке event loop)."""
+        first = channel not in self._callbacks
+        self._callbacks.setdefault(channel, []).append(callback)
+        if first and self.connected:
+            await asyncio.to_thread(self._listen, channel)
+
+    async def notify(self, channel: str, payload: str) -> bool:
+        """Отправляет NOTIFY. Возвращает False, если отправить не удалось."""
+        if not self.db_url:
+            return False
+        try:
+            await asyncio.to_thread(self._notify_sync, channel, payload)
+            return True
+        except Exception as e:
+            logger.warning(f"[PG LISTEN] NOTIFY {channel} failed: {e}")
+            return False
+
+    # ---------------------- Внутренние методы ----------------------
+
+    async def _connect(self) -> None:
+        conn = await asyncio.to_thread(self._open_connection)
+        self._conn = conn
+        for channel in list(self._callbacks):
+            await asyncio.to_thread(self._listen, channel)
+        self._loop.add_reader(conn.fileno(), self._on_readable)
+
+    def _open_connection(self):
+        conn = psycopg2.connect(self.db_url, connect_timeout=5)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _listen(self, channel: str) -> None:
+        with self._conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{channel}"')
+
+    def _notify_sync(self, channel: str, payload: str) -> None:
+        with self._publish_lock:
+            for attempt in range(2):
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = self._open_connection()
+                try:
+                    with self._publish_conn.cursor() as cursor:
+                        cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+                    return
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    try:
+                        self._publish_conn.close()
+                    except Exception:
+                        pass
+                    self._publish_conn = None
+                    if attempt == 1:
+                        raise
+
+    def _on_readable(self) -> None:
+        try:
+            self._conn.poll()
+        except Exception as e:
+            logger.error(f"[PG LISTEN] Connection lost: {e}")
+            self._close_listen_connection()
+            self._schedule_reconnect()
+            return
+        while self._conn.notifies:
+            notification = self._conn.notifies.pop(0)
+            for callback in self._callbacks.get(notification.channel, ()):
+                try:
+                    callback(notification.payload)
+                except Exception as e:
+                    logger.error(f"[PG LISTEN] Handler error for {notification.channel}: {e}", exc_info=True)
+
+    def _close_listen_connection(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            if self._loop and not self._conn.closed:
+                self._loop.remove_reader(self._conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _schedule_reconnect(self) -> None:
+        if not self.running or (self._reconnect_task and not self._reconnect_task.done()):
+            return
+        self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self) -> None:
+        delay = self._reconnect_delay
+        while self.running:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                logger.info("[PG LISTEN] Reconnected")
+                return
+            except Exception as e:
+                logger.warning(f"[PG LISTEN] Reconnect failed: {e}")
+                self._close_listen_connection()
+                delay = min(delay * 2, self._max_reconnect_delay)
+
+
+# Глобальный экземпляр LISTEN-соединения
+pg_listener = PgListener()
@@ -0,0 +1,13 @@
+# app/responses.py
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from app.serialization import dumps_bytes
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, сериализующий тело через app.serialization (orjson, если установлен)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
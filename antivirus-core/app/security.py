@@ -5,12 +5,14 @@ JWT аутентификация для FastAPI - заменяет старый
 from fastapi import HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Dict, Any, Optional
+from app.config import security_config
 from app.jwt_auth import JWTAuth
 from app.logger import logger
 
 class RateLimiter:
     """Rate limiter для JWT токенов (опционально)"""
-    def __init__(self): 
+    def __init__(self, per_minute_limit: int = 100):
+        self.per_minute_limit = per_minute_limit
         self._cache = {}
     
     def is_rate_limited(self, user_id: int, endpoint: str) -> bool:
@@ -25,8 +27,8 @@ class RateLimiter:
             now = int(time())
             window_start = now - minute_window_seconds
             
-            # Простой лимит: 100 запросов в минуту на пользователя
-            per_minute_limit = 100
+            # Простой лимит: per_minute_limit запросов в минуту на пользователя
+            per_minute_limit = self.per_minute_limit
             
             # Очистка старых отметок
             timestamps = [t for t in self._cache.get(key, []) if t >= window_start]
@@ -122,3 +124,5 @@ class JWTAuthDependency(HTTPBearer):
 # Инициализация
 rate_limiter = RateLimiter()
 jwt_auth = JWTAuthDependency(rate_limiter)
+# Перепроверки URL тратят квоту внешних API - отдельный, более строгий лимит
+url_recheck_auth = JWTAuthDependency(RateLimiter(security_config.URL_RECHECK_PER_MINUTE))
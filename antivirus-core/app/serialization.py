@@ -0,0 +1,77 @@
+# app/serialization.py
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Union
+
+from app.config import serialization_config
+from app.logger import logger
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен - без него используется стандартный json
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """Типы, которых нет в JSON: даты, Decimal из PostgreSQL, множества, байты"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).decode("utf-8", "replace")
+    return str(obj)
+
+
+def _select_backend() -> str:
+    requested = serialization_config.SERIALIZER
+    if requested == "json":
+        return "json"
+    if orjson is None:
+        if requested == "orjson":
+            logger.warning("SERIALIZER=orjson, but orjson is not installed - using stdlib json")
+        return "json"
+    return "orjson"
+
+
+# Выбранная реализация: "orjson" или "json"
+BACKEND = _select_backend()
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Компактный JSON в UTF-8 (тела ответов, сообщения WebSocket)."""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # Целые за пределами 64 бит и прочая экзотика - через стандартный json
+            pass
+    return _stdlib_dumps(obj).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """Компактный JSON строкой (диск-кэш, колонки payload в PostgreSQL)."""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Разбор JSON; ошибки формата - ValueError (как json.JSONDecodeError у stdlib)."""
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
@@ -2,53 +2,79 @@
 import asyncio
 import hashlib
 import time
-import re
 import os
 import tempfile
 import subprocess
+import threading
 from typing import Dict, Any, Optional, List
-from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib.parse import urlparse
 
 from app.database import db_manager
 from app.external_apis.manager import external_api_manager
 from app.logger import logger
 from app.validators import security_validator
 from app.cache import disk_cache
+from app.domain_matcher import trusted_domain_manager
+from app.verdict_cache import domain_verdict_cache
+from app.metrics import cache_lookup, observe_verdict, stage
+from app.url_heuristics import ParsedURL, normalize_url, parse_url, url_heuristic_engine
+from app.file_analysis.scanner import FileTooLargeError, StreamingFileScanner, scan_bytes, scan_fileobj, sha256_fileobj
+from app.file_analysis.entropy import HIGH_ENTROPY_THRESHOLD, shannon_entropy
+from app.file_analysis.signatures import SignatureMatcher, load_signature_rules
+from app.file_analysis.worker_pool import file_analysis_pool, fileobj_size
+from app.file_analysis.yara_rules import yara_rule_manager
+from app.file_analysis.filetypes import file_type_detector
+from app.config import file_analysis_config, verdict_cache_config
+from app.startup_profile import startup_profile
 
 class AnalysisService:
     """
     Улучшенный сервис анализа с интеграцией внешних API
     """
     
-    # КРИТИЧНО: Whitelist доверенных доменов для немедленного определения как безопасных
-    TRUSTED_DOMAINS = {
-        'google.com', 'youtube.com', 'github.com', 'microsoft.com',
-        'apple.com', 'mozilla.org', 'wikipedia.org', 'stackoverflow.com',
-        'amazon.com', 'facebook.com', 'twitter.com', 'linkedin.com',
-        'reddit.com', 'netflix.com', 'spotify.com', 'discord.com',
-        'cloudflare.com', 'akamai.com', 'fastly.com'
-    }
-    
-    # Доверенные поддомены (любой поддомен этих доменов также доверенный)
-    TRUSTED_DOMAIN_SUFFIXES = [
-        '.google.com', '.youtube.com', '.github.com', '.microsoft.com',
-        '.apple.com', '.mozilla.org', '.wikipedia.org', '.stackoverflow.com',
-        '.amazon.com', '.facebook.com', '.twitter.com', '.linkedin.com',
-        '.cloudflare.com', '.akamai.com', '.fastly.com'
-    ]
-    
     def __init__(self, use_external_apis: bool = True):
         self.use_external_apis = use_external_apis
         # Простой in-memory кэш: ключ -> (истекает_в_мс, результат)
         self._cache: Dict[str, Any] = {}
         self._cache_ttl_seconds = 300
-        # КРИТИЧНО: Очищаем старые данные с source: local_only при инициализации
+        # YARA-подобные правила (сигнатуры) загружаются и компилируются в один автомат при первом обращении
+        self._rules: Optional[List[Dict[str, Any]]] = None
+        self._matcher: Optional[SignatureMatcher] = None
+        self._signatures_lock = threading.Lock()
+    
+    @property
+    def _yara_rules(self) -> List[Dict[str, Any]]:
+        if self._rules is None:
+            with self._signatures_lock:
+                if self._rules is None:
+                    with startup_profile.measure("signatures.load", kind="lazy"):
+                        self._rules = self._load_yara_rules()
+        return self._rules
+    
+    @property
+    def _signature_matcher(self) -> SignatureMatcher:
+        if self._matcher is None:
+            rules = self._yara_rules
+            with self._signatures_lock:
+                if self._matcher is None:
+                    with startup_profile.measure("signatures.compile", kind="lazy"):
+                        self._matcher = SignatureMatcher(rules)
+                    logger.info(f"Signature matcher: {len(rules)} rules, backend={self._matcher.backend}")
+        return self._matcher
+    
+    def warm_up_signatures(self):
+        """Заранее загружает и компилирует сигнатуры, чтобы первая проверка файла не ждала компиляции"""
+        return self._signature_matcher
+    
+    def purge_stale_cache_entries(self):
+        """
+        Удаляет из диск-кэша старые вердикты с source: local_only (DELETE по индексу source).
+        Запускается фоном после старта, когда старые записи уже получили индексируемые колонки.
+        """
         try:
             disk_cache.delete_by_source("local_only")
         except Exception as e:
             logger.warning(f"Failed to clean old cache entries: {e}")
-        # YARA правила (простые сигнатуры)
-        self._yara_rules = self._load_yara_rules()
     
     def clear_cache(self):
         """Очищает in-memory кэш анализа URL"""
@@ -56,19 +82,13 @@ class AnalysisService:
         logger.info("In-memory cache cleared")
     
     def _is_trusted_domain(self, domain: str) -> bool:
-        """Проверяет, является ли домен доверенным"""
+        """Проверяет, является ли домен доверенным (списки app.domain_matcher)"""
         if not domain:
             return False
-        domain_lower = domain.lower().strip()
-        # Прямое совпадение
-        if domain_lower in self.TRUSTED_DOMAINS:
-            logger.debug(f"Trusted domain match (exact): {domain_lower}")
+        matched = trusted_domain_manager.match(domain)
+        if matched:
+            logger.debug(f"Trusted domain match: {domain} -> {matched}")
             return True
-        # Проверка поддоменов (например, www.google.com, mail.google.com)
-        for suffix in self.TRUSTED_DOMAIN_SUFFIXES:
-            if domain_lower.endswith(suffix):
-                logger.debug(f"Trusted domain match (suffix): {domain_lower} ends with {suffix}")
-                return True
         return False
 
     # ---------------------- Утилиты нормализации и защиты ----------------------
@@ -112,51 +132,24 @@ class AnalysisService:
         - удаление UTM/трекерных параметров
         - доменно-специфические правила (Google, YouTube и т.п.)
         """
-        try:
-            parts = urlsplit(url)
-            scheme = parts.scheme
-            netloc = parts.netloc.lower()
-            path = parts.path or ""
-            query = parts.query or ""
-
-            # Парсим параметры
-            query_pairs = parse_qsl(query, keep_blank_values=True)
-
-            # Общие трекинг-параметры
-            tracking_prefixes = ("utm_",)
-            tracking_exact = {
-                "gclid", "fbclid", "yclid", "mc_cid", "mc_eid",
-                "utm_referrer", "_hsenc", "_hsmi", "spm"
-            }
-
-            def is_tracking_param(name: str) -> bool:
-                return name.startswith(tracking_prefixes) or name in tracking_exact
+        return AnalysisService._parse_url_for_analysis(url).url
 
-            domain = netloc
-
-            # Google search: удаляем все параметры, анализируем только домен и путь
-            if "google." in domain:
-                filtered_pairs: List = []
-            # YouTube: для watch-ссылок оставляем только v (id видео)
-            elif "youtube.com" in domain or domain == "youtu.be":
-                keep_names = {"v"}
-                filtered_pairs = [(k, v) for (k, v) in query_pairs if k in keep_names]
-            else:
-                # Удаляем трекинг-параметры
-                filtered_pairs = [(k, v) for (k, v) in query_pairs if not is_tracking_param(k)]
-
-            normalized_query = urlencode(filtered_pairs, doseq=True)
-
-            # Фрагмент всегда удаляем
-            normalized = urlunsplit((scheme, netloc, path, normalized_query, ""))
-            return normalized
+    @staticmethod
+    def _parse_url_for_analysis(url: str) -> ParsedURL:
+        """Однократный разбор и нормализация URL; результат используется и эвристикой."""
+        try:
+            return normalize_url(parse_url(url))
         except Exception:
-            # В случае ошибки возвращаем исходный URL
-            return url
+            # В случае ошибки анализируем исходный URL
+            try:
+                return parse_url(url)
+            except Exception:
+                return ParsedURL(url, "", "", "", "", [])
 
     def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
         # Сначала проверяем in-memory кэш
         item = self._cache.get(key)
+        cache_lookup("memory", bool(item))
         if item:
             expires_at_ms, value = item
             if time.time() * 1000 > expires_at_ms:
@@ -182,6 +175,7 @@ class AnalysisService:
         
         # Затем проверяем диск-кэш
         disk_result = disk_cache.get(key)
+        cache_lookup("disk", bool(disk_result))
         if disk_result:
             # КРИТИЧНО: Проверяем что кэшированный результат валиден
             # Игнорируем результаты с safe: True если source не "combined" или "external_apis"
@@ -210,47 +204,47 @@ class AnalysisService:
         disk_cache.set(key, value, self._cache_ttl_seconds)
 
     def _load_yara_rules(self) -> List[Dict[str, Any]]:
-        """Загружает простые YARA-подобные правила для детектирования"""
-        return [
-            {
-                "name": "suspicious_pe_header",
-                "pattern": b"MZ",
-                "description": "Windows PE executable detected",
-                "threat_score": 20
-            },
-            {
-                "name": "powershell_script",
-                "pattern": b"powershell",
-                "description": "PowerShell script detected",
-                "threat_score": 30
-            },
-            {
-                "name": "base64_encoded",
-                "pattern": b"base64",
-                "description": "Base64 encoded content detected",
-                "threat_score": 15
-            },
-            {
-                "name": "suspicious_urls",
-                "pattern": b"http://",
-                "description": "HTTP URLs detected (potentially suspicious)",
-                "threat_score": 10
-            }
-        ]
+        """Загружает YARA-подобные правила: встроенные и из каталога SIGNATURE_RULES_DIR"""
+        return load_signature_rules(file_analysis_config.SIGNATURE_RULES_DIR)
+
+    def _new_file_scanner(self) -> StreamingFileScanner:
+        """Создает однопроходный сканер с общим скомпилированным набором сигнатур и текущими YARA-правилами"""
+        return StreamingFileScanner(matcher=self._signature_matcher, yara_rules=yara_rule_manager.current,
+                                    inspect_archives=file_analysis_config.ARCHIVE_INSPECTION_ENABLED)
 
-    def _scan_with_yara_rules(self, file_content: bytes) -> Dict[str, Any]:
-        """Сканирование файла с помощью простых YARA-подобных правил"""
+    def _scan_with_yara_rules(self, matches: Dict[str, Dict[str, int]],
+                              yara_scan: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Оценка по YARA-подобным правилам и совпадениям YARA-пакетов (по результатам сканера)"""
         detected_rules = []
         total_threat_score = 0
         
-        for rule in self._yara_rules:
-            if rule["pattern"] in file_content:
+        for rule in self._signature_matcher.rules_by_category("rule"):
+            hit = matches.get(rule["name"])
+            if hit:
                 detected_rules.append({
                     "rule_name": rule["name"],
                     "description": rule["description"],
-                    "threat_score": rule["threat_score"]
+                    "threat_score": rule["threat_score"],
+                    "offset": hit["offset"],
+                    "count": hit["count"]
                 })
                 total_threat_score += rule["threat_score"]
+
+        for match in (yara_scan or {}).get("matches", []):
+            meta = match.get("meta", {})
+            try:
+                threat_score = int(meta.get("threat_score", file_analysis_config.YARA_DEFAULT_THREAT_SCORE))
+            except (TypeError, ValueError):
+                threat_score = file_analysis_config.YARA_DEFAULT_THREAT_SCORE
+            detected_rules.append({
+                "rule_name": match["rule"],
+                "description": meta.get("description", match["rule"]),
+                "threat_score": threat_score,
+                "namespace": match["namespace"],
+                "tags": match["tags"],
+                "engine": "yara"
+            })
+            total_threat_score += threat_score
         
         return {
             "detected_rules": detected_rules,
@@ -266,39 +260,67 @@ class AnalysisService:
             use_external_apis: Использовать ли внешние API
             ignore_database: Если True, игнорирует записи в БД и делает новый анализ
         """
+        logger.info(f"🔍 Analyzing URL: {url} (ignore_db={ignore_database})")
+        # Нормализация URL
+        started = time.perf_counter()
+        parsed_url = self._parse_url_for_analysis(url)
+        cached = None if ignore_database else self._get_cached_url_result(parsed_url.url)
+        if cached is not None:
+            # Вердикт из кэша результатов уже учтён в кэше доменов, когда был получен
+            observe_verdict(cached, time.perf_counter() - started)
+            return cached
+        result = await self._analyze_parsed_url(parsed_url, use_external_apis, ignore_database)
+        observe_verdict(result, time.perf_counter() - started)
+        # Итоговый вердикт - свидетельство для кэша вердиктов хоста/домена
+        await domain_verdict_cache.record(parsed_url.url, parsed_url.domain, result)
+        return result
+
+    def _get_cached_url_result(self, url: str) -> Optional[Dict[str, Any]]:
+        """Кэшированный результат анализа URL или None"""
+        # КРИТИЧНО: Кэш - но НЕ возвращаем кэшированные результаты с safe: True
+        # если они были созданы без проверки внешних API
+        cache_key = f"url:{url}"
+        try:
+            with stage("result_cache"):
+                cached = self._cache_get(cache_key)
+        except Exception as e:
+            logger.warning(f"Result cache check failed for {url}: {e}")
+            return None
+        if cached is None:
+            return None
+        # КРИТИЧНО: Если кэшированный результат имеет safe: True, но source не "combined" или "external_apis",
+        # значит он был создан без проверки внешних API - игнорируем его
+        # Также игнорируем любые результаты с source: "local_only" (старые данные)
+        cached_safe = cached.get("safe")
+        cached_source = cached.get("source", "")
+        if cached_source == "local_only":
+            logger.warning(f"Ignoring cached result with invalid source=local_only for {url}, re-analyzing")
+            # Удаляем из кэша и продолжаем анализ
+            self._cache.pop(cache_key, None)
+            disk_cache.delete(cache_key)
+            return None
+        if cached_safe is True and cached_source not in ("combined", "external_apis"):
+            logger.warning(f"Ignoring cached safe=True result with source={cached_source} for {url}, re-analyzing")
+            # Удаляем из кэша и продолжаем анализ
+            self._cache.pop(cache_key, None)
+            disk_cache.delete(cache_key)
+            return None
+        return cached
+
+    async def _analyze_parsed_url(self, parsed_url: ParsedURL, use_external_apis: Optional[bool],
+                                  ignore_database: bool) -> Dict[str, Any]:
+        url = parsed_url.url
         try:
-            logger.info(f"🔍 Analyzing URL: {url} (ignore_db={ignore_database})")
-            # Нормализация URL
-            url = self._normalize_url_for_analysis(url)
-            
-            # КРИТИЧНО: Кэш - но НЕ возвращаем кэшированные результаты с safe: True
-            # если они были созданы без проверки внешних API
             cache_key = f"url:{url}"
-            cached = self._cache_get(cache_key)
-            if cached is not None and not ignore_database:
-                # КРИТИЧНО: Если кэшированный результат имеет safe: True, но source не "combined" или "external_apis",
-                # значит он был создан без проверки внешних API - игнорируем его
-                # Также игнорируем любые результаты с source: "local_only" (старые данные)
-                cached_safe = cached.get("safe")
-                cached_source = cached.get("source", "")
-                if cached_source == "local_only":
-                    logger.warning(f"Ignoring cached result with invalid source=local_only for {url}, re-analyzing")
-                    # Удаляем из кэша и продолжаем анализ
-                    self._cache.pop(cache_key, None)
-                    disk_cache.delete(cache_key)
-                elif cached_safe is True and cached_source not in ("combined", "external_apis"):
-                    logger.warning(f"Ignoring cached safe=True result with source={cached_source} for {url}, re-analyzing")
-                    # Удаляем из кэша и продолжаем анализ
-                    self._cache.pop(cache_key, None)
-                    disk_cache.delete(cache_key)
-                else:
-                    return cached
-            
+
             # 1. Проверка в локальной базе данных (пропускаем если ignore_database=True)
             if not ignore_database:
                 # 1.1. Сначала проверяем локальный кэш безопасных/опасных URL (whitelist/blacklist)
                 try:
-                    cached_local = db_manager.get_cached_security(url)
+                    with stage("db_local_cache"):
+                        cached_local = db_manager.get_cached_security(
+                            url, min_whitelist_confidence=verdict_cache_config.DOMAIN_VERDICT_MIN_CONFIDENCE)
+                    cache_lookup("db_local", bool(cached_local))
                     if cached_local:
                         logger.info(f"✅ URL found in local cache (whitelist/blacklist), skipping external APIs: {url}")
                         return {
@@ -312,7 +334,8 @@ class AnalysisService:
 
                 # 1.2. Проверяем таблицу malicious_urls
                 try:
-                    url_threat = db_manager.check_url(url)
+                    with stage("db_malicious_urls"):
+                        url_threat = db_manager.check_url(url)
                     if url_threat:
                         logger.info(f"⚠️ URL found in database as malicious: {url}")
                         return {
@@ -327,11 +350,12 @@ class AnalysisService:
                 logger.info(f"🔄 Ignoring database check for {url} (forced re-analysis)")
             
             # 2. Проверка домена в локальной базе
-            parsed_url = urlparse(url)
-            domain = parsed_url.netloc.lower()
+            domain = parsed_url.domain
             
             # КРИТИЧНО: Проверка доверенных доменов - немедленное определение как безопасных
-            if self._is_trusted_domain(domain):
+            trusted = self._is_trusted_domain(domain)
+            cache_lookup("trusted_domain", trusted)
+            if trusted:
                 logger.info(f"✅ Trusted domain detected: {domain} - marking as safe immediately")
                 result = {
                     "safe": True,
@@ -344,7 +368,8 @@ class AnalysisService:
                 return result
             
             try:
-                domain_threats = db_manager.check_domain(domain)
+                with stage("db_domain"):
+                    domain_threats = db_manager.check_domain(domain)
                 if domain_threats:
                     return {
                         "safe": False,
@@ -360,7 +385,7 @@ class AnalysisService:
                 logger.warning(f"⚠️ Private/internal URL detected, skipping external APIs: {url}")
                 # Для внутренних URL используем эвристику с консервативным подходом
                 # КРИТИЧНО: domain уже определен выше
-                heuristic_result = self._url_heuristic_analysis(url, domain)
+                heuristic_result = self._url_heuristic_analysis(url, domain, parsed_url)
                 heuristic_safe = heuristic_result.get("safe")
                 if heuristic_safe is False:
                     result = {
@@ -384,16 +409,29 @@ class AnalysisService:
                 self._cache_set(cache_key, result)
                 return result
 
+            # 3.1. Вердикт уровня хоста/домена: несколько разных URL сайта уже подтверждены внешними API.
+            # Известные опасные пути проверены выше на уровне URL; эвристика URL всё равно выполняется
+            if not ignore_database:
+                with stage("domain_verdict"):
+                    domain_verdict = await domain_verdict_cache.lookup(domain)
+                cache_lookup("domain_verdict", bool(domain_verdict))
+                if domain_verdict:
+                    heuristic_result = self._url_heuristic_analysis(url, domain, parsed_url)
+                    if heuristic_result.get("safe") is not False:
+                        logger.info(f"✅ {domain_verdict['verdict_scope'].capitalize()}-level verdict for {domain}, skipping external APIs: {url}")
+                        return domain_verdict
+
             # 4. Проверка через внешние API (если включено)
             external_result = None
             should_use_external = use_external_apis if use_external_apis is not None else self.use_external_apis
             if should_use_external:
                 try:
                     logger.info(f"🔍 Checking external APIs for: {url}")
-                    external_result = await asyncio.wait_for(
-                        external_api_manager.check_url_multiple_apis(url), 
-                        timeout=8.0
-                    )
+                    with stage("external_apis"):
+                        external_result = await asyncio.wait_for(
+                            external_api_manager.check_url_multiple_apis(url), 
+                            timeout=8.0
+                        )
                     logger.info(f"🔍 External API result: safe={external_result.get('safe')}, threat_type={external_result.get('threat_type')}")
                     
                     # КРИТИЧНО: Проверяем safe явно, не используя default True
@@ -427,7 +465,7 @@ class AnalysisService:
                     logger.error(f"External API check failed: {e}", exc_info=True)
             
             # 4. Локальная эвристика
-            heuristic_result = self._url_heuristic_analysis(url, domain)
+            heuristic_result = self._url_heuristic_analysis(url, domain, parsed_url)
             
             # 5. Объединяем результаты - ПРИОРИТЕТ ВНЕШНИМ API
             # КРИТИЧНО: Проверяем safe явно, не используя default True
@@ -739,40 +777,80 @@ class AnalysisService:
     # ... остальные методы остаются аналогичными, но с добавлением async/await ...
 
     async def analyze_uploaded_file(self, file_content: bytes, original_filename: str) -> Dict[str, Any]:
-        """Анализ загруженного файла: вычисление SHA-256/MD5/SHA1, базовая типизация и проверка по базам/внешним API."""
+        """Анализ загруженного файла из буфера в памяти (однопроходное сканирование)."""
+        try:
+            # Повторная загрузка того же файла - ответ из кэша сразу после хеширования
+            sha256_hash = await asyncio.to_thread(lambda: hashlib.sha256(file_content).hexdigest())
+            cached = await self._get_cached_upload_result(sha256_hash, original_filename)
+            if cached is not None:
+                return cached
+            if file_analysis_pool.should_offload(len(file_content)) and yara_rule_manager.pool_compatible:
+                scan = await file_analysis_pool.scan_buffer(file_content, yara_path=yara_rule_manager.compiled_path)
+            else:
+                scan = await asyncio.to_thread(scan_bytes, file_content, self._new_file_scanner())
+        except Exception as e:
+            logger.error(f"❌ Uploaded file scan error for {original_filename}: {e}", exc_info=True)
+            return self._file_analysis_error(original_filename, e)
+        return await self.analyze_scanned_file(scan, original_filename)
+
+    async def analyze_upload_stream(self, fileobj, original_filename: str, max_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Анализ загруженного файла без чтения целиком в память.
+
+        fileobj - файловый объект загрузки (SpooledTemporaryFile); файлы на диске
+        отображаются в память через mmap. При превышении max_size выбрасывается
+        FileTooLargeError до начала сканирования. Крупные файлы сканируются в пуле
+        процессов (FileAnalysisBusyError / FileAnalysisTimeoutError при перегрузке).
+        """
+        size = fileobj_size(fileobj)
+        if max_size is not None and size > max_size:
+            raise FileTooLargeError(size, max_size)
+        sha256_hash = await asyncio.to_thread(sha256_fileobj, fileobj)
+        cached = await self._get_cached_upload_result(sha256_hash, original_filename)
+        if cached is not None:
+            return cached
+        if file_analysis_pool.should_offload(size) and yara_rule_manager.pool_compatible:
+            scan = await file_analysis_pool.scan_fileobj(fileobj, max_size, yara_path=yara_rule_manager.compiled_path)
+        else:
+            scan = await asyncio.to_thread(scan_fileobj, fileobj, self._new_file_scanner(), max_size)
+        return await self.analyze_scanned_file(scan, original_filename)
+
+    async def analyze_scanned_file(self, scan: Dict[str, Any], original_filename: str) -> Dict[str, Any]:
+        """Анализ по результату сканирования: хеши SHA-256/MD5/SHA1, базовая типизация и проверка по базам/внешним API."""
         try:
             sanitized_name = security_validator.sanitize_filename(original_filename)
-            sha256_hash = hashlib.sha256(file_content).hexdigest()
-            md5_hash = hashlib.md5(file_content).hexdigest()
-            sha1_hash = hashlib.sha1(file_content).hexdigest()
+            sha256_hash = scan["sha256"]
+            md5_hash = scan["md5"]
+            sha1_hash = scan["sha1"]
+            head = scan["head"]
 
-            # Простейшая идентификация типа файла
-            file_type = "unknown"
-            if file_content.startswith(b"PK\x03\x04"):
-                file_type = "zip_archive"
-            elif file_content.startswith(b"MZ"):
-                file_type = "win_pe"
-            elif file_content.startswith(b"%PDF"):
-                file_type = "pdf"
-            elif file_content.startswith(b"#!/bin/bash") or file_content.startswith(b"#!/bin/sh"):
-                file_type = "shell_script"
-            elif b"powershell" in file_content.lower():
-                file_type = "powershell_script"
+            # Тип файла по таблице сигнатур (только первые килобайты)
+            type_info = file_type_detector.detect(head)
+            file_type = type_info["type"]
 
             # YARA-сканирование
-            yara_result = self._scan_with_yara_rules(file_content)
+            yara_scan = scan.get("yara")
+            yara_rule_manager.record(yara_scan)
+            yara_result = self._scan_with_yara_rules(scan["signature_matches"], yara_scan)
 
             # Проверка по sha256
             hash_result = await self.analyze_file_hash(sha256_hash)
 
             # Поведенческий анализ
-            behavioral_score = self._behavioral_analysis(file_content, file_type)
+            behavioral_score = self._behavioral_analysis(scan, file_type)
+
+            # Файлы внутри архива
+            archive_result = await self._analyze_archive_members(scan["archive"]) if scan.get("archive") else None
+            archive_threat = archive_result.get("threat_type") if archive_result else None
 
             # Объединяем результаты
-            final_safe = hash_result.get("safe", True) and not yara_result["is_suspicious"] and behavioral_score < 50
+            final_safe = (hash_result.get("safe", True) and not yara_result["is_suspicious"]
+                          and behavioral_score < 50 and not archive_threat)
             final_threat_type = None
             if not hash_result.get("safe", True):
                 final_threat_type = hash_result.get("threat_type", "malware")
+            elif archive_threat:
+                final_threat_type = archive_threat
             elif yara_result["is_suspicious"]:
                 final_threat_type = "suspicious_content"
             elif behavioral_score >= 50:
@@ -784,20 +862,30 @@ class AnalysisService:
                 "file_hash": sha256_hash,
                 "md5": md5_hash,
                 "sha1": sha1_hash,
+                "file_size": scan["size"],
                 "file_type": file_type,
+                "file_category": type_info["category"],
+                "mime_type": type_info["mime"],
                 "safe": final_safe,
                 "threat_type": final_threat_type,
                 "details": hash_result.get("details", ""),
                 "source": "combined_analysis",
                 "yara_detections": yara_result["detected_rules"],
+                "yara_ruleset": yara_scan.get("version") if yara_scan else None,
                 "behavioral_score": behavioral_score,
+                "entropy": round(scan["entropy"], 3),
+                "block_entropy": scan.get("block_entropy"),
+                "pe_sections": scan.get("pe_sections", []),
+                "archive": archive_result,
+                "cache_hit": False,
                 "confidence": self._calculate_confidence(hash_result, yara_result, behavioral_score)
             }
             
             # Добавляем взвешенную оценку риска
             risk_assessment = self._calculate_risk_score(base_result)
             base_result.update(risk_assessment)
-            
+
+            self._store_upload_result(base_result, yara_scan.get("version") if yara_scan else None)
             return base_result
         except Exception as e:
             # КРИТИЧНО: Детальное логирование ошибок анализа загруженного файла
@@ -814,131 +902,118 @@ class AnalysisService:
             )
             
             # Возвращаем безопасный результат вместо падения
-            return {
-                "filename": original_filename,
-                "safe": None,  # None означает "неизвестно"
-                "threat_type": "analysis_error",
-                "details": f"Analysis temporarily unavailable: {error_type}",
-                "source": "error",
-            }
+            return self._file_analysis_error(original_filename, e)
 
-    def _url_heuristic_analysis(self, url: str, domain: str) -> Dict[str, Any]:
-        """Смягчённая эвристика анализа URL для снижения ложных срабатываний"""
-        threat_score = 0
-        details = []
-        
-        # КРИТИЧНО: Проверка на известные опасные паттерны в URL
-        url_lower = url.lower()
-        dangerous_patterns = [
-            ('eicar', 'malware', 'EICAR test file'),
-            ('testfile', 'malware', 'Test malware file'),
-            ('malware-test', 'malware', 'Malware test file'),
-            ('virus-test', 'malware', 'Virus test file'),
-            ('download-anti-malware-testfile', 'malware', 'Anti-malware test file download'),
-        ]
-        
-        for pattern, threat_type, description in dangerous_patterns:
-            if pattern in url_lower:
-                logger.warning(f"🚨 Dangerous pattern detected in URL: {pattern} - {url}")
-                return {
-                    "safe": False,
-                    "threat_type": threat_type,
-                    "details": f"Known dangerous pattern detected: {description}",
-                    "threat_score": 100,
-                    "confidence": 95
-                }
-        
-        # КРИТИЧНО: Защита от неопределенного домена
-        if not domain or domain == "unknown":
-            # Если домен неизвестен, считаем неизвестным (недостаточно данных)
-            return {
-                "safe": None,  # Неизвестно, не безопасно по умолчанию
-                "threat_type": None,
-                "details": "Domain information unavailable",
-                "threat_score": 0,
-                "confidence": 0
-            }
+    def _upload_cache_key(self, sha256_hash: str, yara_version: Optional[str]) -> str:
+        """Ключ кэша результата загрузки: хеш содержимого и версии всех наборов правил"""
+        ruleset_version = f"{self._signature_matcher.version}.{yara_version or 'none'}.{file_type_detector.version}"
+        return f"upload:{sha256_hash}:{ruleset_version}"
 
-        # IP-адрес вместо домена — сильный сигнал, но редкий в нормальном серфинге
+    async def _get_cached_upload_result(self, sha256_hash: str, original_filename: str) -> Optional[Dict[str, Any]]:
+        """
+        Готовый результат анализа для уже проверенного содержимого (при смене правил ключ другой).
+        Безопасный результат перепроверяется по malicious_hashes: хэш мог быть добавлен после кэширования.
+        """
+        if file_analysis_config.UPLOAD_RESULT_CACHE_TTL <= 0:
+            return None
+        current_yara = yara_rule_manager.current
+        key = self._upload_cache_key(sha256_hash, current_yara.version if current_yara else None)
         try:
-            if re.match(r"^\d+\.\d+\.\d+\.\d+$", domain):
-                threat_score += 50
-                details.append("Uses IP address instead of domain")
-        except Exception:
-            pass  # Игнорируем ошибки проверки IP
+            cached = disk_cache.get(key)
+        except Exception as e:
+            logger.warning(f"Upload result cache read failed: {e}")
+            return None
+        if not cached:
+            return None
+        if cached.get("safe") and db_manager and await asyncio.to_thread(db_manager.is_malicious_hash, sha256_hash):
+            logger.info(f"Cached upload result for {sha256_hash} is outdated: hash is now blocklisted")
+            disk_cache.delete(key)
+            return None
+        logger.info(f"Upload result cache hit for {sha256_hash}")
+        return {**cached, "filename": security_validator.sanitize_filename(original_filename), "cache_hit": True}
 
-        # Очень длинные URL — учитываем только экстремальные случаи
-        if len(url) > 300:
-            threat_score += 20
-            details.append("URL is extremely long")
-        elif len(url) > 200:
-            threat_score += 10
-            details.append("URL is very long")
+    def _store_upload_result(self, result: Dict[str, Any], yara_version: Optional[str]) -> None:
+        # Результаты с неопределённым вердиктом (ошибки проверок) не кэшируем
+        if file_analysis_config.UPLOAD_RESULT_CACHE_TTL <= 0 or result.get("safe") is None:
+            return
+        try:
+            disk_cache.set(self._upload_cache_key(result["file_hash"], yara_version), result,
+                           file_analysis_config.UPLOAD_RESULT_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Upload result cache write failed: {e}")
 
-        # Много поддоменов — повышаем пороги
+    async def _analyze_archive_members(self, archive: Dict[str, Any]) -> Dict[str, Any]:
+        """Вердикты по файлам архива: хеши всех файлов проверяются по базе одним запросом"""
+        members = archive.get("members", [])
+        hashes = [member["sha256"] for member in members if member.get("sha256")]
         try:
-            subdomain_count = len(domain.split('.'))
-            if subdomain_count > 6:
-                threat_score += 20
-                details.append("Too many subdomains (>6)")
-            elif subdomain_count > 4:
-                threat_score += 10
-                details.append("Many subdomains (>4)")
-        except Exception:
-            pass  # Игнорируем ошибки подсчета поддоменов
+            known = await asyncio.to_thread(db_manager.check_hashes, hashes) if hashes else {}
+        except Exception as e:
+            logger.warning(f"Archive member hash lookup failed: {e}")
+            known = {}
 
-        # Дефисы в домене больше не считаем признаком сами по себе
+        verdicts = []
+        malicious = 0
+        known_threat = None
+        for member in members:
+            verdict = {key: member[key] for key in ("path", "size", "compressed_size", "depth", "status", "file_type")
+                       if key in member}
+            if member.get("sha256"):
+                rules = self._scan_with_yara_rules(member.get("signature_matches", {}))
+                hit = known.get(member["sha256"])
+                verdict.update({
+                    "sha256": member["sha256"],
+                    "entropy": member.get("entropy"),
+                    "detections": [rule["rule_name"] for rule in rules["detected_rules"]],
+                })
+                if hit:
+                    verdict.update({"safe": False, "threat_type": hit["threat_type"], "details": hit["description"]})
+                    known_threat = known_threat or hit["threat_type"]
+                elif rules["is_suspicious"]:
+                    verdict.update({"safe": False, "threat_type": "suspicious_content"})
+                else:
+                    verdict["safe"] = True
+                malicious += verdict["safe"] is False
+            elif "error" in member:
+                verdict["error"] = member["error"]
+            verdicts.append(verdict)
 
-        # Подозрительные TLD — оставляем как слабый сигнал
-        try:
-            suspicious_tlds = {"zip", "review", "click", "xyz", "top", "work"}
-            tld = domain.split('.')[-1] if '.' in domain else ''
-            if tld in suspicious_tlds:
-                threat_score += 10
-                details.append(f"Suspicious TLD: .{tld}")
-        except Exception:
-            pass  # Игнорируем ошибки определения TLD
+        # Совпадение хеша с базой важнее признаков zip-бомбы и эвристики по сигнатурам
+        threat_type = known_threat
+        if threat_type is None and archive.get("zip_bomb"):
+            threat_type = "zip_bomb"
+        if threat_type is None and malicious:
+            threat_type = "suspicious_content"
+        return {
+            "member_count": archive.get("member_count", len(members)),
+            "total_bytes": archive.get("total_bytes", 0),
+            "malicious_members": malicious,
+            "zip_bomb": archive.get("zip_bomb", False),
+            "violations": archive.get("violations", []),
+            "error": archive.get("error"),
+            "threat_type": threat_type,
+            "members": verdicts,
+        }
 
-        # Наличие '@' в URL — сильный сигнал
-        if '@' in url:
-            threat_score += 30
-            details.append("Contains '@' symbol in URL")
+    @staticmethod
+    def _file_analysis_error(original_filename: str, error: Exception) -> Dict[str, Any]:
+        return {
+            "filename": original_filename,
+            "safe": None,  # None означает "неизвестно"
+            "threat_type": "analysis_error",
+            "details": f"Analysis temporarily unavailable: {type(error).__name__}",
+            "source": "error",
+        }
 
-        # Количество параметров — учитываем только очень большое число
-        try:
-            from urllib.parse import urlparse, parse_qs
-            q = parse_qs(urlparse(url).query)
-            if len(q) > 30:
-                threat_score += 20
-                details.append("Too many query parameters (>30)")
-            elif len(q) > 20:
-                threat_score += 10
-                details.append("Many query parameters (>20)")
-        except Exception:
-            pass
-        
-        # Гораздо более высокий порог срабатывания, чтобы не метить обычные сайты
+    def _url_heuristic_analysis(self, url: str, domain: str, parsed: Optional[ParsedURL] = None) -> Dict[str, Any]:
+        """Смягчённая эвристика анализа URL для снижения ложных срабатываний (правила - app.url_heuristics)"""
         try:
-            if threat_score >= 70:
-                return {
-                    "safe": False,
-                    "threat_type": "suspicious",
-                    "details": f"Heuristic detection: {', '.join(details) if details else 'Multiple suspicious indicators'}",
-                    "threat_score": threat_score,
-                    "confidence": min(95, 50 + threat_score)  # Higher confidence for higher threat scores
-                }
-
-            # КРИТИЧНО: Эвристика не должна возвращать safe: True без внешних API
-            # Возвращаем None (неизвестно), чтобы требовать проверку внешними API
-            return {
-                "safe": None,  # Неизвестно, не безопасно по умолчанию
-                "threat_type": None,
-                "details": "Heuristic analysis passed, but external API verification required",
-                "threat_score": threat_score,
-                "confidence": 0  # Низкая уверенность без внешних API
-            }
+            with stage("heuristic"):
+                if parsed is None or parsed.url != url:
+                    parsed = parse_url(url)
+                return url_heuristic_engine.evaluate(parsed, domain)
         except Exception as e:
-            logger.error(f"Error in heuristic analysis result generation: {e}", exc_info=True)
+            logger.error(f"Error in heuristic analysis: {e}", exc_info=True)
             # Fallback: считаем неизвестным при ошибке
             return {
                 "safe": None,  # Неизвестно, не безопасно по умолчанию
@@ -948,59 +1023,56 @@ class AnalysisService:
                 "confidence": 50
             }
 
-    def _behavioral_analysis(self, file_content: bytes, file_type: str) -> int:
-        """Поведенческий анализ файла"""
+    def url_heuristic_batch(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """
+        Пакетная эвристика для массовых проверок: каждый URL нормализуется и
+        разбирается один раз, опасные паттерны ищутся одним проходом по всей пачке.
+        """
+        parsed = [self._parse_url_for_analysis(url) for url in urls]
+        try:
+            results = url_heuristic_engine.evaluate_many(parsed)
+        except Exception as e:
+            logger.error(f"Error in batch heuristic analysis: {e}", exc_info=True)
+            return [self._url_heuristic_analysis(p.url, p.domain, p) for p in parsed]
+        for item, result in zip(parsed, results):
+            result["url"] = item.url
+        return results
+
+    def _behavioral_analysis(self, scan: Dict[str, Any], file_type: str) -> int:
+        """Поведенческий анализ файла (по результату однопроходного сканирования)"""
         score = 0
         
         # Анализ размера файла
-        if len(file_content) > 50 * 1024 * 1024:  # > 50MB
+        if scan["size"] > 50 * 1024 * 1024:  # > 50MB
             score += 20
-        elif len(file_content) < 100:  # < 100 bytes
+        elif scan["size"] < 100:  # < 100 bytes
             score += 15
         
         # Анализ энтропии (простая проверка)
-        if self._calculate_entropy(file_content) > 7.5:
+        if scan["entropy"] > 7.5:
             score += 25  # Высокая энтропия может указывать на шифрование/упаковку
+        else:
+            # Упакованная секция PE или крупный высокоэнтропийный участок внутри обычного файла
+            packed_sections = [s for s in scan.get("pe_sections", []) if s["entropy"] > HIGH_ENTROPY_THRESHOLD]
+            block_entropy = scan.get("block_entropy") or {}
+            if packed_sections:
+                score += 20
+            elif block_entropy.get("high_entropy_ratio", 0) >= 0.5:
+                score += 15
         
-        # Анализ строк
-        suspicious_strings = [
-            b"cmd.exe", b"powershell", b"reg add", b"net user", 
-            b"schtasks", b"wmic", b"rundll32", b"certutil"
-        ]
-        for suspicious in suspicious_strings:
-            if suspicious in file_content.lower():
-                score += 10
+        # Анализ строк (поведенческие сигнатуры, найдены сканером без учёта регистра)
+        for rule in self._signature_matcher.rules_by_category("behavioral"):
+            if rule["name"] in scan["signature_matches"]:
+                score += rule["threat_score"]
         
-        # Анализ по типу файла
-        if file_type == "win_pe":
-            score += 5  # PE файлы потенциально опасны
-        elif file_type == "powershell_script":
-            score += 20  # PowerShell скрипты часто используются для атак
-        elif file_type == "shell_script":
-            score += 15  # Shell скрипты могут быть опасны
+        # Анализ по типу файла (behavior_score из таблицы типов: исполняемые файлы и скрипты)
+        score += file_type_detector.behavior_score(file_type)
         
         return min(score, 100)  # Максимум 100 баллов
 
     def _calculate_entropy(self, data: bytes) -> float:
-        """Вычисление энтропии данных"""
-        if not data:
-            return 0.0
-        
-        # Подсчет частоты байтов
-        byte_counts = [0] * 256
-        for byte in data:
-            byte_counts[byte] += 1
-        
-        # Вычисление энтропии: -sum(p * log2(p))
-        import math
-        entropy = 0.0
-        data_len = len(data)
-        for count in byte_counts:
-            if count > 0:
-                probability = count / data_len
-                entropy -= probability * math.log2(probability)
-        
-        return entropy
+        """Вычисление энтропии данных (векторизованный подсчёт частот байтов)"""
+        return shannon_entropy(data)
 
     def _calculate_confidence(self, hash_result: Dict[str, Any], yara_result: Dict[str, Any], behavioral_score: int) -> int:
         """Вычисление общей уверенности в результате"""
@@ -1067,15 +1139,7 @@ class AnalysisService:
         
         # Фактор 4: Тип файла (вес 10%)
         file_type = results.get("file_type", "unknown")
-        type_scores = {
-            "win_pe": 60,
-            "powershell_script": 70,
-            "shell_script": 50,
-            "zip_archive": 30,
-            "pdf": 20,
-            "unknown": 10
-        }
-        type_score = type_scores.get(file_type, 10)
+        type_score = file_type_detector.risk_score(file_type)
         risk_factors.append({
             "factor": "file_type",
             "weight": 10,
@@ -1123,4 +1187,5 @@ class AnalysisService:
         return base_explanation
 
 # Создаем экземпляр сервиса с включенными внешними API
-analysis_service = AnalysisService(use_external_apis=True)
\ No newline at end of file
+with startup_profile.measure("analysis_service.init"):
+    analysis_service = AnalysisService(use_external_apis=True)
\ No newline at end of file
@@ -0,0 +1,78 @@
+# app/startup_profile.py
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class StartupProfile:
+    """
+    Профиль холодного старта процесса: этапы импорта, ленивой инициализации
+    синглтонов, шагов startup_event и отложенного обслуживания, а также
+    время до готовности принимать запросы.
+
+    Модуль импортируется первым и не зависит от app.config/app.logger,
+    чтобы замеры начинались до загрузки остальных модулей.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready_ms: Optional[float] = None
+        self.steps: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+        self._last_checkpoint = self._t0
+
+    def record(self, name: str, seconds: float, kind: str = "init",
+               started: Optional[float] = None, error: Optional[str] = None) -> None:
+        if started is None:
+            started = time.perf_counter() - seconds
+        step = {
+            "name": name,
+            "kind": kind,
+            "start_ms": round((started - self._t0) * 1000, 1),
+            "duration_ms": round(seconds * 1000, 1),
+        }
+        if error:
+            step["error"] = error
+        self.steps.append(step)
+
+    @contextmanager
+    def measure(self, name: str, kind: str = "init"):
+        """Замер блока инициализации; исключение пробрасывается и отмечается в шаге."""
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, kind, started, error)
+
+    def checkpoint(self, name: str, kind: str = "startup") -> None:
+        """Шаг от предыдущей контрольной точки до текущего момента (последовательные этапы запуска)."""
+        now = time.perf_counter()
+        self.record(name, now - self._last_checkpoint, kind, self._last_checkpoint)
+        self._last_checkpoint = now
+
+    def mark_ready(self) -> None:
+        self.ready_ms = round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def report(self, slowest: int = 5) -> Dict[str, Any]:
+        steps = sorted(self.steps, key=lambda step: step["start_ms"])
+        return {
+            "started_at": self.started_at,
+            "ready_ms": self.ready_ms,
+            "steps": steps,
+            "slowest": sorted(steps, key=lambda step: step["duration_ms"], reverse=True)[:slowest],
+        }
+
+    def log_report(self) -> None:
+        from app.logger import logger
+
+        report = self.report()
+        slowest = ", ".join(f"{step['name']}={step['duration_ms']}ms" for step in report["slowest"])
+        logger.info(f"Startup profile: ready in {report['ready_ms']} ms; slowest: {slowest}")
+
+
+# Глобальный профиль запуска процесса
+startup_profile = StartupProfile()
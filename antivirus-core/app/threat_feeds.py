@@ -0,0 +1,195 @@
+# app/threat_feeds.py
+import argparse
+import csv
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.cache import disk_cache
+from app.config import security_config, threat_feed_config
+from app.database import db_manager
+from app.logger import logger
+from app.url_heuristics import normalize_url, parse_url
+
+# Допустимые значения - как в CHECK-ограничениях malicious_urls / malicious_hashes
+URL_THREAT_TYPES = {"phishing", "malware", "scam", "fraud", "defacement", "spam", "botnet", "cryptojacking"}
+HASH_THREAT_TYPES = {"malware", "trojan", "ransomware", "virus", "worm", "spyware", "adware", "rootkit", "backdoor"}
+SEVERITIES = {"low", "medium", "high", "critical"}
+
+# Колонки CSV, в которых может лежать сам индикатор
+KEY_COLUMNS = ("url", "hash", "sha256", "sha1", "md5", "indicator", "value")
+HASH_RE = re.compile(r"^(?:[0-9a-f]{32}|[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+class ThreatFeedLoader:
+    """
+    Загрузка локальных фидов угроз (CSV или построчные списки URL/хэшей) в
+    malicious_urls / malicious_hashes.
+
+    Файл читается потоково и уходит в PostgreSQL через COPY; diff с таблицей
+    (добавление, обновление, удаление исчезнувших из фида записей) выполняется
+    одной транзакцией в db_manager.ingest_threat_feed. После загрузки из
+    кэшей вердиктов убираются записи, которые фид мог сделать устаревшими.
+    """
+
+    def __init__(self, feeds_dir: str = threat_feed_config.THREAT_FEEDS_DIR):
+        self.feeds_dir = Path(feeds_dir)
+        self.last_results: Dict[str, Dict[str, Any]] = {}
+
+    def resolve(self, name: str) -> Path:
+        """Файл фида внутри THREAT_FEEDS_DIR (пути за пределами каталога не принимаются)"""
+        path = (self.feeds_dir / name).resolve()
+        if self.feeds_dir.resolve() not in path.parents:
+            raise ValueError(f"Feed file must be inside {self.feeds_dir}")
+        if not path.is_file():
+            raise FileNotFoundError(f"Feed file not found: {name}")
+        return path
+
+    def ingest(self, path: Path, kind: str, source: str, expire_missing: bool = True,
+               threat_type: Optional[str] = None, severity: Optional[str] = None) -> Dict[str, Any]:
+        """Загружает файл фида; возвращает счетчики received/skipped/inserted/updated/expired"""
+        if kind not in ("url", "hash"):
+            raise ValueError("kind must be 'url' or 'hash'")
+        if not source:
+            raise ValueError("source is required")
+        if db_manager is None:
+            raise RuntimeError("Database is not configured")
+        feed_source = f"feed:{source}"
+        skipped = [0]
+        started = time.perf_counter()
+        rows = self._iter_rows(Path(path), kind, feed_source, threat_type, severity, skipped)
+        result = db_manager.ingest_threat_feed(kind, rows, feed_source, expire_missing=expire_missing)
+        result.update({
+            "kind": kind,
+            "source": feed_source,
+            "file": str(path),
+            "skipped": skipped[0],
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+        self._invalidate_caches(kind, result)
+        self.last_results[feed_source] = {**result, "finished_at": time.time()}
+        logger.info(
+            f"Threat feed {feed_source} ({kind}): {result['received']} rows in {result['seconds']}s, "
+            f"+{result['inserted']} ~{result['updated']} -{result['expired']}, skipped {result['skipped']}, "
+            f"whitelist entries purged {result.get('whitelist_purged', 0)}"
+        )
+        return result
+
+    # ---------------------- Разбор файлов ----------------------
+
+    def _iter_rows(self, path: Path, kind: str, source: str, threat_type: Optional[str],
+                   severity: Optional[str], skipped: list) -> Iterator[Tuple]:
+        allowed_types = URL_THREAT_TYPES if kind == "url" else HASH_THREAT_TYPES
+        default_type = threat_type or (threat_feed_config.THREAT_FEED_URL_THREAT_TYPE if kind == "url"
+                                       else threat_feed_config.THREAT_FEED_HASH_THREAT_TYPE)
+        default_severity = severity or threat_feed_config.THREAT_FEED_SEVERITY
+        default_description = f"Threat feed {source}"
+
+        for value, row_type, row_severity, description in self._iter_entries(path):
+            row_type = (row_type or "").strip().lower()
+            row_severity = (row_severity or "").strip().lower()
+            row_type = row_type if row_type in allowed_types else default_type
+            row_severity = row_severity if row_severity in SEVERITIES else default_severity
+            description = (description or "").strip() or default_description
+            if kind == "url":
+                url, domain = self._normalize_url(value)
+                if not url:
+                    skipped[0] += 1
+                    continue
+                yield url, domain, row_type, row_severity, description
+            else:
+                file_hash = value.strip().lower()
+                if not HASH_RE.match(file_hash):
+                    skipped[0] += 1
+                    continue
+                yield file_hash, row_type, row_severity, description
+
+    def _iter_entries(self, path: Path) -> Iterator[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+        """(индикатор, threat_type, severity, description) из CSV с заголовком или построчного списка"""
+        with path.open("r", encoding="utf-8", errors="replace", newline="") as handle:
+            lines = (line for line in handle if line.strip() and not line.lstrip().startswith("#"))
+            if path.suffix.lower() == ".csv":
+                reader = csv.DictReader(lines)
+                fields = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+                key_field = next((fields[name] for name in KEY_COLUMNS if name in fields), None)
+                if key_field is None:
+                    raise ValueError(f"CSV feed has no indicator column ({', '.join(KEY_COLUMNS)})")
+                type_field, severity_field = fields.get("threat_type"), fields.get("severity")
+                description_field = fields.get("description")
+                for record in reader:
+                    value = (record.get(key_field) or "").strip()
+                    if value:
+                        yield (value,
+                               record.get(type_field) if type_field else None,
+                               record.get(severity_field) if severity_field else None,
+                               record.get(description_field) if description_field else None)
+            else:
+                for line in lines:
+                    # Первое поле строки: "url", "hash  filename" и т.п.
+                    yield line.split(None, 1)[0], None, None, None
+
+    @staticmethod
+    def _normalize_url(value: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Ключ как при проверке URL (normalize_url без фрагмента и трекерных параметров,
+        в нижнем регистре, как в check_url) и хост - как домен в cached_whitelist.
+        """
+        url = value.strip()
+        if not url or len(url) > security_config.MAX_URL_LENGTH:
+            return None, None
+        if "://" not in url:
+            url = f"http://{url}"
+        try:
+            url = normalize_url(parse_url(url)).url.lower()
+            domain = urlsplit(url).hostname
+        except ValueError:
+            return None, None
+        return (url, domain) if domain else (None, None)
+
+    # ---------------------- Кэши ----------------------
+
+    def _invalidate_caches(self, kind: str, result: Dict[str, Any]) -> None:
+        """
+        Новые угрозы делают устаревшими кэшированные safe-вердикты, удаленные -
+        вердикты local_db; чистятся по индексам диск-кэша и в памяти сервиса.
+        """
+        namespaces = ("url",) if kind == "url" else ("hash", "upload")
+        try:
+            for namespace in namespaces:
+                if result["inserted"] or result["updated"]:
+                    disk_cache.delete_where(namespace=namespace, safe=True)
+                if result["expired"]:
+                    disk_cache.delete_where(namespace=namespace, source="local_db")
+            if result["inserted"] or result["updated"] or result["expired"]:
+                from app.services import analysis_service
+                analysis_service.clear_cache()
+        except Exception as e:
+            logger.warning(f"Cache invalidation after threat feed failed: {e}")
+
+
+# Глобальный загрузчик фидов угроз
+threat_feed_loader = ThreatFeedLoader()
+
+
+def main() -> None:
+    """
+    Загрузка фида из командной строки (из каталога antivirus-core):
+        python -m app.threat_feeds feeds/urlhaus.txt --kind url --source urlhaus
+    """
+    parser = argparse.ArgumentParser(description="Bulk threat feed ingestion")
+    parser.add_argument("path")
+    parser.add_argument("--kind", choices=("url", "hash"), required=True)
+    parser.add_argument("--source", required=True, help="имя фида; записи сохраняются с source=feed:<имя>")
+    parser.add_argument("--no-expire", action="store_true", help="не удалять записи, отсутствующие в файле")
+    parser.add_argument("--threat-type")
+    parser.add_argument("--severity")
+    args = parser.parse_args()
+    result = threat_feed_loader.ingest(Path(args.path), args.kind, args.source, expire_missing=not args.no_expire,
+                                       threat_type=args.threat_type, severity=args.severity)
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# app/tracing.py
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.config import tracing_config
+
+
+class RequestTrace:
+    """Трасса одного запроса: этапы анализа со смещением от начала запроса и длительностью."""
+
+    __slots__ = ("label", "started_at", "total_ms", "spans", "_t0")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started_at = time.time()
+        self.total_ms: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+
+    def add(self, name: str, seconds: float, started: Optional[float] = None) -> None:
+        """Добавляет этап; started - perf_counter() начала (по умолчанию - сейчас минус длительность)."""
+        if started is None:
+            started = time.perf_counter() - seconds
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self._t0) * 1000, 2),
+            "duration_ms": round(seconds * 1000, 2),
+        })
+
+    def finish(self) -> "RequestTrace":
+        self.total_ms = round((time.perf_counter() - self._t0) * 1000, 2)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "started_at": self.started_at,
+            "total_ms": self.total_ms,
+            "spans": list(self.spans),
+        }
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing: длительности этапов (одноимённые суммируются) и total."""
+        durations: Dict[str, float] = {}
+        for span in self.spans:
+            durations[span["name"]] = durations.get(span["name"], 0.0) + span["duration_ms"]
+        parts = [f"{name};dur={duration:.2f}" for name, duration in durations.items()]
+        if self.total_ms is not None:
+            parts.append(f"total;dur={self.total_ms:.2f}")
+        return ", ".join(parts)
+
+
+class TraceBuffer:
+    """Кольцевой буфер последних трасс процесса (для админки)."""
+
+    def __init__(self, size: int = tracing_config.TRACE_BUFFER_SIZE):
+        self._items: deque = deque(maxlen=max(size, 1))
+
+    def add(self, trace: RequestTrace) -> None:
+        self._items.append(trace.to_dict())
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Последние трассы, новые первыми."""
+        return list(self._items)[::-1][:limit]
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def should_trace(requested: bool) -> bool:
+    """Трассировать ли запрос: по явному запросу клиента или выборочно (TRACE_SAMPLE_RATE)."""
+    if not tracing_config.TRACE_ENABLED:
+        return False
+    return requested or (tracing_config.TRACE_SAMPLE_RATE > 0 and random.random() < tracing_config.TRACE_SAMPLE_RATE)
+
+
+@contextmanager
+def trace_request(label: str, enabled: bool = True):
+    """
+    Включает трассу для текущего контекста (задачи, созданные внутри, пишут в неё же).
+    Возвращает RequestTrace или None; завершённая трасса попадает в trace_buffer.
+    """
+    if not enabled:
+        yield None
+        return
+    trace = RequestTrace(label)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace_buffer.add(trace.finish())
+
+
+def record_span(name: str, seconds: float, started: Optional[float] = None) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds, started)
+
+
+@contextmanager
+def span(name: str):
+    """Замер блока только в трассу запроса (без метрик); без активной трассы почти бесплатен."""
+    if _current_trace.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started, started)
+
+
+# Глобальный буфер последних трасс
+trace_buffer = TraceBuffer()
@@ -0,0 +1,263 @@
+# app/url_heuristics.py
+import bisect
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from app.config import url_heuristic_config
+from app.logger import logger
+
+# ---------------------- Правила (данные) ----------------------
+
+# Известные опасные фрагменты URL: (фрагмент, тип угрозы, описание). При нескольких
+# совпадениях выбирается первый по списку.
+DANGEROUS_PATTERNS: List[Tuple[str, str, str]] = [
+    ("eicar", "malware", "EICAR test file"),
+    ("testfile", "malware", "Test malware file"),
+    ("malware-test", "malware", "Malware test file"),
+    ("virus-test", "malware", "Virus test file"),
+    ("download-anti-malware-testfile", "malware", "Anti-malware test file download"),
+]
+
+SUSPICIOUS_TLDS = {"zip", "review", "click", "xyz", "top", "work"}
+
+# Пороговые признаки: (признак, порог, баллы, описание) - по убыванию порога, срабатывает первый
+THRESHOLD_RULES: Dict[str, List[Tuple[int, int, str]]] = {
+    "url_length": [(300, 20, "URL is extremely long"), (200, 10, "URL is very long")],
+    "host_labels": [(6, 20, "Too many subdomains (>6)"), (4, 10, "Many subdomains (>4)")],
+    "query_params": [(30, 20, "Too many query parameters (>30)"), (20, 10, "Many query parameters (>20)")],
+}
+IP_HOST_SCORE = 50
+AT_SIGN_SCORE = 30
+SUSPICIOUS_TLD_SCORE = 10
+# Порог, начиная с которого URL считается подозрительным
+SUSPICIOUS_THRESHOLD = 70
+
+# Нормализация: трекинг-параметры удаляются из URL до анализа и кэширования
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_EXACT = {"gclid", "fbclid", "yclid", "mc_cid", "mc_eid", "utm_referrer", "_hsenc", "_hsmi", "spm"}
+
+_IP_HOST = re.compile(r"^\d+\.\d+\.\d+\.\d+$")
+
+
+class ParsedURL:
+    """Результат однократного разбора URL - общий для нормализации и эвристики."""
+
+    __slots__ = ("url", "scheme", "netloc", "path", "query", "query_pairs", "_lower")
+
+    def __init__(self, url: str, scheme: str, netloc: str, path: str, query: str,
+                 query_pairs: List[Tuple[str, str]]):
+        self.url = url
+        self.scheme = scheme
+        self.netloc = netloc
+        self.path = path
+        self.query = query
+        self.query_pairs = query_pairs
+        self._lower: Optional[str] = None
+
+    @property
+    def lower(self) -> str:
+        if self._lower is None:
+            self._lower = self.url.lower()
+        return self._lower
+
+    @property
+    def domain(self) -> str:
+        return self.netloc.lower()
+
+
+def parse_url(url: str) -> ParsedURL:
+    parts = urlsplit(url)
+    return ParsedURL(url, parts.scheme, parts.netloc, parts.path or "", parts.query or "",
+                     parse_qsl(parts.query or "", keep_blank_values=True))
+
+
+def normalize_url(parsed: ParsedURL) -> ParsedURL:
+    """
+    Нормализация URL для анализа и кэша (без повторного разбора):
+    - приведение домена к нижнему регистру
+    - удаление фрагмента (#...)
+    - удаление UTM/трекерных параметров
+    - доменно-специфические правила (Google, YouTube и т.п.)
+    """
+    domain = parsed.netloc.lower()
+    # Google search: удаляем все параметры, анализируем только домен и путь
+    if "google." in domain:
+        filtered_pairs: List[Tuple[str, str]] = []
+    # YouTube: для watch-ссылок оставляем только v (id видео)
+    elif "youtube.com" in domain or domain == "youtu.be":
+        filtered_pairs = [(k, v) for (k, v) in parsed.query_pairs if k == "v"]
+    else:
+        filtered_pairs = [(k, v) for (k, v) in parsed.query_pairs
+                          if not (k.startswith(TRACKING_PREFIXES) or k in TRACKING_EXACT)]
+    query = urlencode(filtered_pairs, doseq=True)
+    url = urlunsplit((parsed.scheme, domain, parsed.path, query, ""))
+    return ParsedURL(url, parsed.scheme, domain, parsed.path, query, filtered_pairs)
+
+
+# ---------------------- Движок ----------------------
+
+class UrlHeuristicEngine:
+    """
+    Эвристический анализ URL по правилам, скомпилированным при загрузке.
+
+    Опасные фрагменты объединены в одно регулярное выражение (с просмотром
+    вперёд - находятся и перекрывающиеся фрагменты), TLD и пороги - таблицы.
+    Для пачки URL выражение применяется один раз к их объединению, а совпадения
+    распределяются по URL по смещениям.
+    """
+
+    def __init__(self, dangerous_patterns: Sequence[Tuple[str, str, str]] = DANGEROUS_PATTERNS,
+                 suspicious_tlds: Iterable[str] = SUSPICIOUS_TLDS):
+        self.dangerous_patterns = [(p.lower(), t, d) for p, t, d in dangerous_patterns]
+        self.suspicious_tlds = frozenset(tld.lower().lstrip(".") for tld in suspicious_tlds)
+        self._pattern_index = {pattern: index for index, (pattern, _, _) in enumerate(self.dangerous_patterns)}
+        self._dangerous_regex = None
+        if self.dangerous_patterns:
+            # Более длинные альтернативы первыми; lookahead позволяет найти фрагмент в каждой позиции
+            alternatives = sorted(self._pattern_index, key=len, reverse=True)
+            self._dangerous_regex = re.compile("(?=(" + "|".join(re.escape(p) for p in alternatives) + "))")
+
+    def evaluate(self, parsed: ParsedURL, domain: Optional[str] = None) -> Dict[str, Any]:
+        """Эвристика для одного URL (domain по умолчанию - netloc в нижнем регистре)."""
+        matched = self._dangerous_hits(parsed.lower)
+        return self._result(parsed, parsed.domain if domain is None else domain, matched)
+
+    def evaluate_many(self, urls: Sequence[Any]) -> List[Dict[str, Any]]:
+        """Пакетная эвристика: элементы - строки или ParsedURL; порядок результатов совпадает."""
+        parsed_list = [u if isinstance(u, ParsedURL) else parse_url(u) for u in urls]
+        if not parsed_list:
+            return []
+        hits: List[Optional[int]] = [None] * len(parsed_list)
+        if self._dangerous_regex is not None:
+            # Перевод строки не встречается в разобранном URL - фрагмент не перейдёт через границу
+            blob = "\n".join(p.lower for p in parsed_list)
+            starts = []
+            position = 0
+            for p in parsed_list:
+                starts.append(position)
+                position += len(p.lower) + 1
+            for match in self._dangerous_regex.finditer(blob):
+                owner = bisect.bisect_right(starts, match.start()) - 1
+                index = self._pattern_index[match.group(1)]
+                if hits[owner] is None or index < hits[owner]:
+                    hits[owner] = index
+        return [self._result(p, p.domain, hit) for p, hit in zip(parsed_list, hits)]
+
+    # ---------------------- Внутренние методы ----------------------
+
+    def _dangerous_hits(self, url_lower: str) -> Optional[int]:
+        if self._dangerous_regex is None:
+            return None
+        best = None
+        for match in self._dangerous_regex.finditer(url_lower):
+            index = self._pattern_index[match.group(1)]
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return best
+
+    def _result(self, parsed: ParsedURL, domain: str, dangerous: Optional[int]) -> Dict[str, Any]:
+        if dangerous is not None:
+            pattern, threat_type, description = self.dangerous_patterns[dangerous]
+            logger.warning(f"🚨 Dangerous pattern detected in URL: {pattern} - {parsed.url}")
+            return {
+                "safe": False,
+                "threat_type": threat_type,
+                "details": f"Known dangerous pattern detected: {description}",
+                "threat_score": 100,
+                "confidence": 95
+            }
+
+        if not domain or domain == "unknown":
+            # Если домен неизвестен, считаем неизвестным (недостаточно данных)
+            return {
+                "safe": None,
+                "threat_type": None,
+                "details": "Domain information unavailable",
+                "threat_score": 0,
+                "confidence": 0
+            }
+
+        threat_score = 0
+        details: List[str] = []
+
+        # IP-адрес вместо домена — сильный сигнал, но редкий в нормальном серфинге
+        if _IP_HOST.match(domain):
+            threat_score += IP_HOST_SCORE
+            details.append("Uses IP address instead of domain")
+
+        # Учитываются уникальные параметры с непустым значением (как parse_qs)
+        query_params = len({key for key, value in parsed.query_pairs if value})
+        features = {
+            "url_length": len(parsed.url),
+            "host_labels": domain.count(".") + 1,
+            "query_params": query_params,
+        }
+        for feature in ("url_length", "host_labels"):
+            threat_score += self._threshold_score(feature, features[feature], details)
+
+        tld = domain.rsplit(".", 1)[-1] if "." in domain else ""
+        if tld in self.suspicious_tlds:
+            threat_score += SUSPICIOUS_TLD_SCORE
+            details.append(f"Suspicious TLD: .{tld}")
+
+        # Наличие '@' в URL — сильный сигнал
+        if "@" in parsed.url:
+            threat_score += AT_SIGN_SCORE
+            details.append("Contains '@' symbol in URL")
+
+        threat_score += self._threshold_score("query_params", features["query_params"], details)
+
+        # Гораздо более высокий порог срабатывания, чтобы не метить обычные сайты
+        if threat_score >= SUSPICIOUS_THRESHOLD:
+            return {
+                "safe": False,
+                "threat_type": "suspicious",
+                "details": f"Heuristic detection: {', '.join(details) if details else 'Multiple suspicious indicators'}",
+                "threat_score": threat_score,
+                "confidence": min(95, 50 + threat_score)
+            }
+
+        # КРИТИЧНО: Эвристика не должна возвращать safe: True без внешних API
+        return {
+            "safe": None,
+            "threat_type": None,
+            "details": "Heuristic analysis passed, but external API verification required",
+            "threat_score": threat_score,
+            "confidence": 0
+        }
+
+    @staticmethod
+    def _threshold_score(feature: str, value: int, details: List[str]) -> int:
+        for threshold, score, description in THRESHOLD_RULES[feature]:
+            if value > threshold:
+                details.append(description)
+                return score
+        return 0
+
+
+def load_url_heuristic_engine(rules_file: Optional[str] = None) -> UrlHeuristicEngine:
+    """
+    Встроенные правила плюс файл правил (JSON): dangerous_patterns - список
+    {pattern, threat_type, description}, suspicious_tlds - список TLD.
+    """
+    patterns = list(DANGEROUS_PATTERNS)
+    tlds = set(SUSPICIOUS_TLDS)
+    if rules_file and Path(rules_file).is_file():
+        try:
+            data = json.loads(Path(rules_file).read_text(encoding="utf-8"))
+            for entry in data.get("dangerous_patterns", []):
+                patterns.append((entry["pattern"], entry.get("threat_type", "malware"),
+                                 entry.get("description", entry["pattern"])))
+            tlds.update(data.get("suspicious_tlds", []))
+        except Exception as e:
+            logger.error(f"Failed to load URL heuristic rules from {rules_file}: {e}")
+    return UrlHeuristicEngine(patterns, tlds)
+
+
+# Глобальный движок URL-эвристики
+url_heuristic_engine = load_url_heuristic_engine(url_heuristic_config.URL_HEURISTIC_RULES_FILE)
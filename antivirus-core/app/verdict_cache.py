@@ -0,0 +1,244 @@
+# app/verdict_cache.py
+import asyncio
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.cache import disk_cache
+from app.config import verdict_cache_config
+from app.domain_matcher import normalize_host, trusted_domain_manager
+from app.logger import logger
+
+# Источники, чей вердикт safe=True подтверждён внешними API и годится как свидетельство для домена
+VERIFIED_SAFE_SOURCES = ("combined", "external_apis")
+# Вердикты safe=False этих источников не портят домен: эвристика пересчитывается для каждого URL
+NON_DOMAIN_BAD_SOURCES = ("heuristic", "internal_heuristic")
+# Вердикты, выданные самим кэшем доменов или списками, - не новые свидетельства
+SKIP_SOURCES = ("domain_cache", "trusted_domain", "internal_only", "error")
+
+
+class DomainVerdictCache:
+    """
+    Иерархический кэш вердиктов: URL -> хост -> регистрируемый домен.
+
+    Для хоста и домена копятся свидетельства: сколько разных URL внешние API
+    признали безопасными (с достаточной уверенностью) и сколько URL оказались
+    опасными. Вердикт хоста или домена подменяет проверку URL, только если
+    набралось достаточно разных безопасных URL и нет ни одного опасного;
+    известные опасные пути проверяются раньше на уровне URL (кэш url:,
+    malicious_urls, cached_blacklist) и всегда имеют приоритет. Небольшая
+    доля запросов (DOMAIN_VERDICT_SAMPLE_RATE) всё равно проверяется
+    полностью - опасный URL на хосте отключает вердикт хоста и домена.
+
+    Уровень регистрируемого домена используется только с полным PSL: по
+    встроенной части списка поддомены неизвестных хостингов с разными
+    владельцами сливались бы в один "домен". Опасные URL отмечаются отдельным
+    ключом verdict:bad:..., который запись безопасных свидетельств никогда не
+    перезаписывает. Отметки (и их отсутствие) держатся в памяти недолго
+    (DOMAIN_VERDICT_BAD_MEMORY_TTL), так что отметка другого воркера видна
+    через несколько секунд без чтения disk_cache на каждом запросе.
+
+    Уже учтённый URL повторно не записывается, а обращения к disk_cache
+    (SQLite) выполняются в потоке, не блокируя цикл событий.
+    """
+
+    def __init__(self,
+                 ttl: int = verdict_cache_config.DOMAIN_VERDICT_TTL,
+                 min_confidence: int = verdict_cache_config.DOMAIN_VERDICT_MIN_CONFIDENCE,
+                 host_min_urls: int = verdict_cache_config.DOMAIN_VERDICT_HOST_MIN_URLS,
+                 domain_min_urls: int = verdict_cache_config.DOMAIN_VERDICT_DOMAIN_MIN_URLS,
+                 sample_rate: float = verdict_cache_config.DOMAIN_VERDICT_SAMPLE_RATE,
+                 memory_entries: int = verdict_cache_config.DOMAIN_VERDICT_MEMORY_ENTRIES,
+                 bad_memory_ttl: int = verdict_cache_config.DOMAIN_VERDICT_BAD_MEMORY_TTL):
+        self.ttl = ttl
+        self.min_confidence = min_confidence
+        self.host_min_urls = host_min_urls
+        self.domain_min_urls = domain_min_urls
+        self.sample_rate = sample_rate
+        self.memory_entries = memory_entries
+        self.bad_memory_ttl = bad_memory_ttl
+        # Сколько хешей URL хранить для подсчёта разных URL (больше порога не нужно)
+        self._max_url_keys = max(host_min_urls, domain_min_urls)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Отметки об опасных URL; None - отметки нет (тоже кэшируется, чтобы не ходить в disk_cache)
+        self._bad: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._stats = {"host_hits": 0, "domain_hits": 0, "misses": 0, "sampled": 0, "recorded_safe": 0, "recorded_bad": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def scopes(self, domain: str) -> Tuple[str, Optional[str]]:
+        """Хост и регистрируемый домен (по Public Suffix List; None, если полный список не загружен)."""
+        host = normalize_host(domain)
+        psl = trusted_domain_manager.psl
+        return host, psl.registrable_domain(host) if psl.complete else None
+
+    async def lookup(self, domain: str) -> Optional[Dict[str, Any]]:
+        """Вердикт уровня хоста или домена, который может заменить проверку URL, или None."""
+        if not self.enabled or not domain:
+            return None
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            # Выборочная полная проверка: взломанный сайт с хорошей историей будет замечен
+            self._stats["sampled"] += 1
+            return None
+        host, registrable = self.scopes(domain)
+        host_key = f"host:{host}"
+        host_entry = await self._get(host_key)
+        if host_entry and len(host_entry["urls"]) >= self.host_min_urls:
+            if not await self._has_bad(host_key, host_entry):
+                self._stats["host_hits"] += 1
+                return self._verdict("host", host, host_entry)
+            # На хосте уже встречались опасные URL - домен за него не поручается
+            self._stats["misses"] += 1
+            return None
+        if registrable:
+            domain_key = f"domain:{registrable}"
+            domain_entry = await self._get(domain_key)
+            if (domain_entry and len(domain_entry["urls"]) >= self.domain_min_urls
+                    and not await self._has_bad(host_key, host_entry)
+                    and not await self._has_bad(domain_key, domain_entry)):
+                self._stats["domain_hits"] += 1
+                return self._verdict("domain", registrable, domain_entry)
+        self._stats["misses"] += 1
+        return None
+
+    async def record(self, url: str, domain: str, result: Optional[Dict[str, Any]]) -> None:
+        """Учитывает итоговый вердикт по URL как свидетельство для его хоста и домена."""
+        if not self.enabled or not domain or not isinstance(result, dict):
+            return
+        source = result.get("source") or ""
+        safe = result.get("safe")
+        if source in SKIP_SOURCES:
+            return
+        if safe is True:
+            if source not in VERIFIED_SAFE_SOURCES or (result.get("confidence") or 0) < self.min_confidence:
+                return
+            kind = "safe"
+        elif safe is False:
+            if source in NON_DOMAIN_BAD_SOURCES:
+                return
+            kind = "bad"
+        else:
+            return
+        url_key = hashlib.sha1(url.encode("utf-8", "ignore")).hexdigest()[:12]
+        host, registrable = self.scopes(domain)
+        # Повторная проверка уже учтённого URL ничего не меняет - без записи в disk_cache
+        keys = [key for key in (f"host:{host}", f"domain:{registrable}" if registrable else None)
+                if key and not self._is_recorded(key, kind, url_key)]
+        if not keys:
+            return
+        try:
+            for key in keys:
+                entry = await asyncio.to_thread(self._update, key, kind, url_key, result.get("confidence") or 0)
+                if entry:
+                    (self._remember_bad if kind == "bad" else self._remember)(key, entry, time.time())
+            self._stats[f"recorded_{kind}"] += 1
+        except Exception as e:
+            logger.warning(f"Domain verdict cache update failed for {domain}: {e}")
+
+    def invalidate(self, domain: str) -> None:
+        host, registrable = self.scopes(domain)
+        for key in (f"host:{host}", f"domain:{registrable}" if registrable else None):
+            if key:
+                self._memory.pop(key, None)
+                self._bad.pop(key, None)
+                disk_cache.delete(f"verdict:{key}")
+                disk_cache.delete(f"verdict:bad:{key}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self._stats["host_hits"] + self._stats["domain_hits"] + self._stats["misses"]
+        hits = self._stats["host_hits"] + self._stats["domain_hits"]
+        return {
+            **self._stats,
+            "memory_entries": len(self._memory),
+            "bad_memory_entries": len(self._bad),
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+        }
+
+    # ---------------------- Внутренние методы ----------------------
+
+    def _verdict(self, scope: str, name: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        confidence = min(entry["confidence_min"], verdict_cache_config.DOMAIN_VERDICT_MAX_CONFIDENCE)
+        return {
+            "safe": True,
+            "threat_type": None,
+            "details": f"{scope.capitalize()}-level verdict: {len(entry['urls'])} URLs on {name} verified safe by external APIs",
+            "source": "domain_cache",
+            "verdict_scope": scope,
+            "confidence": confidence,
+            "external_scans": {},
+        }
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        item = self._memory.get(key)
+        if item and item[0] > now:
+            self._memory.move_to_end(key)
+            return item[1]
+        entry = await asyncio.to_thread(disk_cache.get, f"verdict:{key}")
+        if entry:
+            self._remember(key, entry, now)
+        else:
+            self._memory.pop(key, None)
+        return entry
+
+    async def _has_bad(self, key: str, entry: Optional[Dict[str, Any]]) -> bool:
+        """Были ли опасные URL: отметка verdict:bad:... (через короткий кэш в памяти) или старое поле bad."""
+        if entry and entry.get("bad"):
+            return True
+        now = time.time()
+        item = self._bad.get(key)
+        if item and item[0] > now:
+            return item[1] is not None
+        marker = await asyncio.to_thread(disk_cache.get, f"verdict:bad:{key}")
+        self._remember_bad(key, marker, now)
+        return marker is not None
+
+    def _is_recorded(self, key: str, kind: str, url_key: str) -> bool:
+        """Учтён ли уже URL для ключа по свежей копии в памяти (тогда запись ничего не изменит)."""
+        now = time.time()
+        item = (self._bad if kind == "bad" else self._memory).get(key)
+        if not item or item[0] <= now or not item[1]:
+            return False
+        urls = item[1].get("urls", [])
+        return url_key in urls or len(urls) >= self._max_url_keys
+
+    def _update(self, key: str, kind: str, url_key: str, confidence: int) -> Optional[Dict[str, Any]]:
+        """Добавляет URL к свидетельствам ключа одной транзакцией disk_cache (выполняется в потоке)."""
+        def add_url(entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            entry = entry or ({"urls": [], "count": 0} if kind == "bad" else {"urls": [], "confidence_min": 100})
+            entry.setdefault("urls", [])
+            if url_key in entry["urls"] or len(entry["urls"]) >= self._max_url_keys:
+                # Ничего нового: запись не переписываем
+                return None
+            entry["urls"].append(url_key)
+            if kind == "bad":
+                entry["count"] = entry.get("count", 0) + 1
+            else:
+                entry["confidence_min"] = min(entry["confidence_min"], int(confidence))
+            entry["updated_at"] = time.time()
+            return entry
+
+        # Опасные URL - отдельный ключ: безопасные обновления из других воркеров его не перезапишут
+        prefix = "verdict:bad:" if kind == "bad" else "verdict:"
+        return disk_cache.update(f"{prefix}{key}", add_url, self.ttl)
+
+    def _remember(self, key: str, entry: Dict[str, Any], now: float) -> None:
+        # В памяти запись живёт недолго: обновления из других воркеров приходят через disk_cache
+        self._memory[key] = (now + min(self.ttl, 60), entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _remember_bad(self, key: str, marker: Optional[Dict[str, Any]], now: float) -> None:
+        self._bad[key] = (now + min(self.ttl, self.bad_memory_ttl), marker)
+        self._bad.move_to_end(key)
+        while len(self._bad) > self.memory_entries:
+            self._bad.popitem(last=False)
+
+
+# Глобальный кэш вердиктов уровня хоста/домена
+domain_verdict_cache = DomainVerdictCache()
@@ -1,57 +1,93 @@
 import asyncio
+import heapq
+import json
+import time
 import uuid
-from datetime import datetime, timedelta
-from typing import Any, Dict, Optional, Set
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
 from fastapi import WebSocket
 
+from app.config import websocket_config
 from app.logger import logger
+from app.metrics import WS_EVICTIONS
+from app.serialization import dumps
+
+# Маркер завершения очереди отправки клиента
+_CLOSE_SENTINEL = object()
 
 
 class ClientConnection:
     """Представление активного WebSocket клиента."""
 
-    def __init__(self, websocket: WebSocket, user_info: Optional[Dict[str, Any]], meta: Optional[Dict[str, Any]] = None):
+    def __init__(self, websocket: WebSocket, user_info: Optional[Dict[str, Any]], meta: Optional[Dict[str, Any]] = None,
+                 queue_size: int = websocket_config.WS_SEND_QUEUE_SIZE):
         self.id: str = str(uuid.uuid4())
         self.websocket: WebSocket = websocket
         self.user_info: Optional[Dict[str, Any]] = user_info
         self.meta: Dict[str, Any] = meta or {}
         self.connected_at: datetime = datetime.utcnow()
         self.last_heartbeat: datetime = self.connected_at
+        self.last_heartbeat_monotonic: float = time.monotonic()
         self.subscriptions: Set[str] = set()
+        # Функции из JWT разбираются один раз при подключении
+        self.features: FrozenSet[str] = self._parse_features(user_info)
+        # Очередь исходящих сообщений и задача-отправитель
+        self.send_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.sender_task: Optional[asyncio.Task] = None
+        self.closed: bool = False
 
-    @property
-    def features(self) -> Set[str]:
+    @staticmethod
+    def _parse_features(user_info: Optional[Dict[str, Any]]) -> FrozenSet[str]:
         """Возвращает набор функций, доступных клиенту согласно JWT токену."""
-        features_raw = (self.user_info or {}).get("features", [])
+        features_raw = (user_info or {}).get("features", [])
         if isinstance(features_raw, str):
             try:
-                import json
                 parsed = json.loads(features_raw or "[]")
             except Exception:
                 parsed = []
-        elif isinstance(features_raw, (list, tuple, set)):
+        elif isinstance(features_raw, (list, tuple, set, frozenset)):
             parsed = list(features_raw)
         else:
             parsed = []
-        return set(parsed)
+        if not isinstance(parsed, list):
+            parsed = []
+        return frozenset(str(feature) for feature in parsed)
 
     def touch(self) -> None:
         """Обновляет timestamp последнего heartbeat."""
         self.last_heartbeat = datetime.utcnow()
+        self.last_heartbeat_monotonic = time.monotonic()
 
 
 class WebSocketManager:
-    """Менеджер для отслеживания активных WebSocket подключений."""
+    """Менеджер для отслеживания активных WebSocket подключений.
 
-    def __init__(self) -> None:
+    Каждый клиент получает собственную ограниченную очередь и задачу-отправитель,
+    поэтому broadcast не ждёт медленных клиентов: сообщения раскладываются по очередям,
+    а клиенты с переполненной очередью или зависшей отправкой отключаются.
+    Истечение heartbeat отслеживается через min-heap дедлайнов вместо полного обхода.
+    """
+
+    def __init__(self,
+                 send_queue_size: int = websocket_config.WS_SEND_QUEUE_SIZE,
+                 send_timeout: float = websocket_config.WS_SEND_TIMEOUT,
+                 heartbeat_timeout: int = websocket_config.WS_HEARTBEAT_TIMEOUT) -> None:
         self._clients: Dict[str, ClientConnection] = {}
+        self._subscribers: Dict[str, Set[str]] = {}
+        self._heartbeat_heap: List[Tuple[float, str]] = []
         self._lock = asyncio.Lock()
+        self._background_tasks: Set[asyncio.Task] = set()
+        self.send_queue_size = send_queue_size
+        self.send_timeout = send_timeout
+        self.heartbeat_timeout = heartbeat_timeout
 
     async def connect(self, websocket: WebSocket, user_info: Optional[Dict[str, Any]], meta: Optional[Dict[str, Any]]) -> ClientConnection:
-        client = ClientConnection(websocket, user_info, meta)
+        client = ClientConnection(websocket, user_info, meta, queue_size=self.send_queue_size)
+        client.sender_task = asyncio.create_task(self._sender_loop(client))
         async with self._lock:
             self._clients[client.id] = client
+            heapq.heappush(self._heartbeat_heap, (client.last_heartbeat_monotonic + self.heartbeat_timeout, client.id))
         user_id = user_info.get("user_id") if user_info else None
         logger.info(f"[WS] Client connected: id={client.id}, user_id={user_id}, ip={meta.get('ip') if meta else 'unknown'}")
         return client
@@ -59,7 +95,10 @@ class WebSocketManager:
     async def disconnect(self, client_id: str, close_code: int = 1000, reason: Optional[str] = None) -> None:
         async with self._lock:
             client = self._clients.pop(client_id, None)
+            if client:
+                self._unsubscribe_all(client)
         if client:
+            await self._stop_sender(client)
             try:
                 if client.websocket.application_state.value != 3:  # 3 = WebSocketState.DISCONNECTED
                     await client.websocket.close(code=close_code, reason=reason)
@@ -70,13 +109,8 @@ class WebSocketManager:
             logger.info(f"[WS] Client disconnected: id={client_id}, reason={reason or 'unknown'}")
 
     async def send_json(self, client: ClientConnection, payload: Dict[str, Any]) -> None:
-        try:
-            await client.websocket.send_json(payload)
-        except RuntimeError:
-            # Соединение уже закрыто
-            logger.debug(f"[WS] Attempted to send to closed connection {client.id}")
-        except Exception as exc:
-            logger.warning(f"[WS] Failed to send message to {client.id}: {exc}")
+        """Ставит сообщение в очередь клиента (не ждёт фактической отправки)."""
+        self._enqueue(client, payload)
 
     async def send_error(self, client: ClientConnection, request_id: Optional[str], message: str, code: str = "error") -> None:
         payload = {
@@ -89,29 +123,52 @@ class WebSocketManager:
             payload["requestId"] = request_id
         await self.send_json(client, payload)
 
-    async def broadcast(self, payload: Dict[str, Any], subscription: Optional[str] = None) -> None:
-        async with self._lock:
+    async def broadcast(self, payload: Dict[str, Any], subscription: Optional[str] = None) -> int:
+        """Раскладывает сообщение по очередям клиентов. Возвращает число адресатов."""
+        if subscription:
+            client_ids = list(self._subscribers.get(subscription, ()))
+            clients = [self._clients[cid] for cid in client_ids if cid in self._clients]
+        else:
             clients = list(self._clients.values())
+        delivered = 0
         for client in clients:
-            if subscription and subscription not in client.subscriptions:
-                continue
-            await self.send_json(client, payload)
+            if self._enqueue(client, payload):
+                delivered += 1
+        return delivered
+
+    def set_subscriptions(self, client: ClientConnection, channels: Iterable[str]) -> None:
+        """Заменяет подписки клиента и обновляет индекс подписчиков."""
+        self._unsubscribe_all(client)
+        client.subscriptions = set(channels)
+        for channel in client.subscriptions:
+            self._subscribers.setdefault(channel, set()).add(client.id)
 
     async def mark_heartbeat(self, client: ClientConnection) -> None:
+        # Дедлайн в heap не переставляется: он продлевается лениво при проверке
         client.touch()
 
-    async def remove_stale_clients(self, timeout_seconds: int = 90) -> None:
+    async def remove_stale_clients(self, timeout_seconds: Optional[int] = None) -> None:
         """Закрывает соединения, которые давно не отправляли heartbeat."""
-        now = datetime.utcnow()
+        timeout = timeout_seconds if timeout_seconds is not None else self.heartbeat_timeout
+        now = time.monotonic()
         stale_clients: Dict[str, ClientConnection] = {}
 
         async with self._lock:
-            for client_id, client in list(self._clients.items()):
-                if (now - client.last_heartbeat) > timedelta(seconds=timeout_seconds):
-                    stale_clients[client_id] = client
-                    self._clients.pop(client_id, None)
+            while self._heartbeat_heap and self._heartbeat_heap[0][0] <= now:
+                _, client_id = heapq.heappop(self._heartbeat_heap)
+                client = self._clients.get(client_id)
+                if not client:
+                    continue  # Клиент уже отключился
+                deadline = client.last_heartbeat_monotonic + timeout
+                if deadline > now:
+                    heapq.heappush(self._heartbeat_heap, (deadline, client_id))
+                    continue
+                stale_clients[client_id] = client
+                self._clients.pop(client_id, None)
+                self._unsubscribe_all(client)
 
         for client_id, client in stale_clients.items():
+            await self._stop_sender(client)
             try:
                 await client.websocket.close(code=4000, reason="Heartbeat timeout")
             except Exception:
@@ -122,10 +179,93 @@ class WebSocketManager:
         async with self._lock:
             clients = list(self._clients.items())
             self._clients.clear()
-        for client_id, client in clients:
+            self._subscribers.clear()
+            self._heartbeat_heap.clear()
+
+        async def _close(client_id: str, client: ClientConnection) -> None:
+            await self._stop_sender(client)
             try:
                 await client.websocket.close(code=1001, reason="Server shutdown")
             except Exception:
                 pass
             logger.info(f"[WS] Closed connection for client {client_id} (server shutdown)")
 
+        await asyncio.gather(*(_close(client_id, client) for client_id, client in clients), return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Количество подключений и суммарная глубина очередей отправки."""
+        return {
+            "connections": len(self._clients),
+            "queued_messages": sum(client.send_queue.qsize() for client in self._clients.values()),
+            "subscriptions": {channel: len(ids) for channel, ids in self._subscribers.items()},
+        }
+
+    # ---------------------- Внутренние методы ----------------------
+
+    def _unsubscribe_all(self, client: ClientConnection) -> None:
+        for channel in client.subscriptions:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(client.id)
+                if not subscribers:
+                    self._subscribers.pop(channel, None)
+
+    def _enqueue(self, client: ClientConnection, payload: Dict[str, Any]) -> bool:
+        if client.closed:
+            logger.debug(f"[WS] Attempted to send to closed connection {client.id}")
+            return False
+        try:
+            client.send_queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"[WS] Send queue overflow for {client.id}, evicting slow consumer")
+            self._evict(client, "Slow consumer")
+            return False
+
+    def _evict(self, client: ClientConnection, reason: str) -> None:
+        if client.closed:
+            return
+        client.closed = True
+        WS_EVICTIONS.inc()
+        task = asyncio.create_task(self.disconnect(client.id, close_code=4008, reason=reason))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _sender_loop(self, client: ClientConnection) -> None:
+        """Отправляет сообщения из очереди клиента по одному."""
+        while True:
+            payload = await client.send_queue.get()
+            if payload is _CLOSE_SENTINEL:
+                return
+            try:
+                await asyncio.wait_for(client.websocket.send_text(dumps(payload)), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"[WS] Send timeout for {client.id}, evicting slow consumer")
+                self._evict(client, "Slow consumer")
+                return
+            except RuntimeError:
+                # Соединение уже закрыто
+                logger.debug(f"[WS] Attempted to send to closed connection {client.id}")
+                client.closed = True
+                return
+            except Exception as exc:
+                logger.warning(f"[WS] Failed to send message to {client.id}: {exc}")
+                client.closed = True
+                return
+
+    async def _stop_sender(self, client: ClientConnection) -> None:
+        """Дожидается отправки уже поставленных сообщений и останавливает отправителя."""
+        client.closed = True
+        task = client.sender_task
+        if not task or task.done() or task is asyncio.current_task():
+            return
+        try:
+            client.send_queue.put_nowait(_CLOSE_SENTINEL)
+        except asyncio.QueueFull:
+            task.cancel()
+        try:
+            await asyncio.wait_for(task, timeout=self.send_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        except Exception as exc:
+            logger.debug(f"[WS] Sender task for {client.id} finished with error: {exc}")
@@ -0,0 +1,98 @@
+"""
+Микробенчмарк сериализации вердиктов.
+
+Сравнивает стандартный json (как раньше в DiskCache.set/get, payload в PostgreSQL
+и JSONResponse) с app.serialization (orjson, если установлен) на типичных
+вердиктах: короткий ответ кэша, сводный вердикт внешних API и полный отчёт
+VirusTotal по ~70 движкам. Время - на один вердикт.
+
+Запуск из каталога antivirus-core:
+    python benchmarks/bench_serialization.py --iterations 20000
+    SERIALIZER=json python benchmarks/bench_serialization.py   # только стандартный json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import serialization  # noqa: E402
+
+
+def cached_verdict() -> dict:
+    return {
+        "safe": True,
+        "threat_type": None,
+        "details": "Domain verified safe by external APIs",
+        "source": "combined",
+        "confidence": 92,
+        "cached_at": datetime(2024, 5, 1, 12, 30).isoformat(),
+    }
+
+
+def combined_verdict() -> dict:
+    verdict = cached_verdict()
+    verdict["external_scans"] = {
+        "virustotal": {"safe": True, "malicious": 0, "suspicious": 0, "harmless": 64, "undetected": 22,
+                       "detection_ratio": "0/86", "permalink": "https://www.virustotal.com/gui/url/abc"},
+        "google_safe_browsing": {"safe": True, "matches": []},
+        "abuseipdb": {"safe": True, "abuse_confidence_score": 0, "total_reports": 0, "country_code": "RU"},
+    }
+    verdict["heuristics"] = {"score": 12, "signals": ["long_path", "many_subdomains"], "тип": "обычный"}
+    return verdict
+
+
+def full_report_verdict() -> dict:
+    verdict = combined_verdict()
+    verdict["external_scans"]["virustotal"]["last_analysis_results"] = {
+        f"Engine{i}": {"category": "harmless" if i % 9 else "undetected", "result": "clean",
+                       "method": "blacklist", "engine_name": f"Engine{i}"}
+        for i in range(70)
+    }
+    return verdict
+
+
+def bench(func, payload, iterations: int) -> float:
+    """Лучшее из трёх прогонов, микросекунды на операцию."""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func(payload)
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    samples = [
+        ("cached", cached_verdict()),
+        ("combined", combined_verdict()),
+        ("full VT report", full_report_verdict()),
+    ]
+    print(f"Backend app.serialization: {serialization.BACKEND}")
+    print(f"{'verdict':<16} {'bytes json/new':>15} {'implementation':<22} {'dumps us':>9} {'loads us':>9}")
+
+    for name, verdict in samples:
+        legacy_text = json.dumps(verdict)
+        new_text = serialization.dumps(verdict)
+        sizes = f"{len(legacy_text.encode())}/{len(new_text.encode())}"
+        rows = [
+            ("json (stdlib)", json.dumps, json.loads, legacy_text),
+            ("app.serialization", serialization.dumps, serialization.loads, new_text),
+            ("  response bytes", serialization.dumps_bytes, serialization.loads, new_text.encode()),
+        ]
+        for implementation, dump, load, encoded in rows:
+            dump_us = bench(dump, verdict, args.iterations)
+            load_us = bench(load, encoded, args.iterations)
+            print(f"{name:<16} {sizes:>15} {implementation:<22} {dump_us:>9.2f} {load_us:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Микробенчмарк эвристического анализа URL.
+
+Сравнивает прежнюю реализацию (нормализация и эвристика разбирают URL
+по отдельности, правила создаются при каждом вызове) с app.url_heuristics:
+по одному URL и пакетом через UrlHeuristicEngine.evaluate_many.
+
+Запуск из каталога antivirus-core:
+    python benchmarks/bench_url_heuristics.py --count 20000 --repeat 3
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.url_heuristics import normalize_url, parse_url, url_heuristic_engine  # noqa: E402
+
+
+def legacy_normalize(url: str) -> str:
+    """Прежняя нормализация (AnalysisService._normalize_url_for_analysis)."""
+    parts = urlsplit(url)
+    netloc = parts.netloc.lower()
+    query_pairs = parse_qsl(parts.query or "", keep_blank_values=True)
+    tracking_exact = {"gclid", "fbclid", "yclid", "mc_cid", "mc_eid", "utm_referrer", "_hsenc", "_hsmi", "spm"}
+    if "google." in netloc:
+        filtered_pairs = []
+    elif "youtube.com" in netloc or netloc == "youtu.be":
+        filtered_pairs = [(k, v) for (k, v) in query_pairs if k in {"v"}]
+    else:
+        filtered_pairs = [(k, v) for (k, v) in query_pairs if not (k.startswith(("utm_",)) or k in tracking_exact)]
+    return urlunsplit((parts.scheme, netloc, parts.path or "", urlencode(filtered_pairs, doseq=True), ""))
+
+
+def legacy_heuristic(url: str, domain: str) -> int:
+    """Прежняя эвристика (AnalysisService._url_heuristic_analysis), возвращает только оценку."""
+    url_lower = url.lower()
+    dangerous_patterns = [
+        ("eicar", "malware", "EICAR test file"),
+        ("testfile", "malware", "Test malware file"),
+        ("malware-test", "malware", "Malware test file"),
+        ("virus-test", "malware", "Virus test file"),
+        ("download-anti-malware-testfile", "malware", "Anti-malware test file download"),
+    ]
+    for pattern, _, _ in dangerous_patterns:
+        if pattern in url_lower:
+            return 100
+    score = 0
+    if re.match(r"^\d+\.\d+\.\d+\.\d+$", domain):
+        score += 50
+    if len(url) > 300:
+        score += 20
+    elif len(url) > 200:
+        score += 10
+    labels = len(domain.split("."))
+    score += 20 if labels > 6 else 10 if labels > 4 else 0
+    suspicious_tlds = {"zip", "review", "click", "xyz", "top", "work"}
+    if (domain.split(".")[-1] if "." in domain else "") in suspicious_tlds:
+        score += 10
+    if "@" in url:
+        score += 30
+    q = parse_qs(urlparse(url).query)
+    score += 20 if len(q) > 30 else 10 if len(q) > 20 else 0
+    return score
+
+
+def legacy_pipeline(urls):
+    results = []
+    for url in urls:
+        normalized = legacy_normalize(url)
+        results.append(legacy_heuristic(normalized, urlparse(normalized).netloc.lower()))
+    return results
+
+
+def single_pipeline(urls):
+    results = []
+    for url in urls:
+        parsed = normalize_url(parse_url(url))
+        results.append(url_heuristic_engine.evaluate(parsed)["threat_score"])
+    return results
+
+
+def batch_pipeline(urls):
+    parsed = [normalize_url(parse_url(url)) for url in urls]
+    return [result["threat_score"] for result in url_heuristic_engine.evaluate_many(parsed)]
+
+
+def make_urls(count: int, seed: int = 1):
+    """Смесь обычных ссылок с трекинг-параметрами, длинных URL и IP-адресов."""
+    rng = random.Random(seed)
+    hosts = ["example.com", "news.example.org", "cdn.a.b.c.example.net", "shop.xyz", "10.0.0.5", "login.click"]
+    urls = []
+    for index in range(count):
+        path = "/".join(rng.choice(["docs", "img", "api", "v1", "item", "download"]) for _ in range(rng.randint(1, 6)))
+        params = "&".join(f"p{i}={rng.randint(0, 999)}" for i in range(rng.randint(0, 25)))
+        urls.append(f"https://{rng.choice(hosts)}/{path}/{index}?utm_source=mail&{params}#top")
+    return urls
+
+
+def bench(func, data, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="число URL в выборке")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    urls = make_urls(args.count)
+    assert legacy_pipeline(urls[:500]) == single_pipeline(urls[:500]) == batch_pipeline(urls[:500])
+    print(f"{'implementation':<28} {'seconds':>9} {'URL/s':>10}")
+    for name, func in [
+        ("legacy (parse twice)", legacy_pipeline),
+        ("engine.evaluate", single_pipeline),
+        ("engine.evaluate_many", batch_pipeline),
+    ]:
+        seconds = bench(func, urls, args.repeat)
+        print(f"{name:<28} {seconds:>9.4f} {args.count / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Локальные заглушки VirusTotal, Google Safe Browsing и AbuseIPDB для нагрузочных тестов.
+
+Отвечают в формате настоящих API с настраиваемой задержкой и профилем ошибок:
+доля ответов 5xx, 429 (превышен лимит), опасных вердиктов и URL, которых
+"нет в базе" VirusTotal (клиент уходит в отправку на анализ и опрос).
+
+Запуск из каталога antivirus-core:
+    python benchmarks/fake_providers.py --port 9100 --latency-ms 150 --jitter-ms 50 --error-rate 0.01
+
+Сервер направляется на заглушки переменными окружения (ключи - любые непустые):
+    VIRUSTOTAL_URL_API=http://127.0.0.1:9100/vt/api/v3
+    GOOGLE_SAFE_BROWSING_API=http://127.0.0.1:9100/gsb/v4
+    ABUSEIPDB_API=http://127.0.0.1:9100/abuseipdb/api/v2
+    VIRUSTOTAL_API_KEY=fake GOOGLE_SAFE_BROWSING_KEY=fake ABUSEIPDB_API_KEY=fake
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict
+
+from aiohttp import web
+
+
+@dataclass
+class Profile:
+    """Профиль поведения заглушки."""
+    latency_ms: float = 100.0
+    jitter_ms: float = 30.0
+    error_rate: float = 0.0
+    ratelimit_rate: float = 0.0
+    malicious_rate: float = 0.02
+    unknown_rate: float = 0.1
+    seed: int = 1
+    stats: Dict[str, int] = field(default_factory=dict)
+
+    def count(self, key: str) -> None:
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def is_malicious(self, value: str) -> bool:
+        # Детерминированно по значению: один и тот же URL всегда получает один вердикт
+        digest = hashlib.sha1(f"{self.seed}:{value}".encode()).digest()
+        return digest[0] / 256 < self.malicious_rate
+
+    def is_unknown(self, value: str) -> bool:
+        digest = hashlib.sha1(f"{self.seed}:unknown:{value}".encode()).digest()
+        return digest[0] / 256 < self.unknown_rate
+
+
+def _stats(malicious: bool) -> Dict[str, int]:
+    if malicious:
+        return {"malicious": 12, "suspicious": 2, "undetected": 20, "harmless": 36, "timeout": 0}
+    return {"malicious": 0, "suspicious": 0, "undetected": 22, "harmless": 48, "timeout": 0}
+
+
+def _vt_url(url_id: str) -> str:
+    """Идентификатор URL в VirusTotal - base64 без паддинга; вердикт считается по самому URL."""
+    try:
+        return base64.urlsafe_b64decode(url_id + "=" * (-len(url_id) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        return url_id
+
+
+def _vt_object(object_type: str, object_id: str, malicious: bool) -> Dict:
+    return {"data": {"type": object_type, "id": object_id,
+                     "attributes": {"last_analysis_stats": _stats(malicious), "last_analysis_results": {}}}}
+
+
+def build_app(profile: Profile) -> web.Application:
+    rng = random.Random(profile.seed)
+
+    @web.middleware
+    async def latency_and_errors(request: web.Request, handler):
+        provider = request.path.strip("/").split("/", 1)[0]
+        profile.count(f"{provider}.requests")
+        delay = max(0.0, profile.latency_ms + rng.uniform(-profile.jitter_ms, profile.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        roll = rng.random()
+        if roll < profile.ratelimit_rate:
+            profile.count(f"{provider}.429")
+            return web.json_response({"error": {"code": "QuotaExceededError"}}, status=429)
+        if roll < profile.ratelimit_rate + profile.error_rate:
+            profile.count(f"{provider}.5xx")
+            return web.json_response({"error": {"code": "TransientError"}}, status=503)
+        return await handler(request)
+
+    async def vt_url(request: web.Request):
+        url_id = request.match_info["url_id"]
+        url = _vt_url(url_id)
+        if profile.is_unknown(url):
+            return web.json_response({"error": {"code": "NotFoundError"}}, status=404)
+        return web.json_response(_vt_object("url", url_id, profile.is_malicious(url)))
+
+    async def vt_submit(request: web.Request):
+        form = await request.post()
+        url_id = base64.urlsafe_b64encode(str(form.get("url", "")).encode()).decode().strip("=")
+        analysis_id = f"u-{url_id}"
+        return web.json_response({"data": {"type": "analysis", "id": analysis_id}})
+
+    async def vt_analysis(request: web.Request):
+        analysis_id = request.match_info["analysis_id"]
+        body = _vt_object("analysis", analysis_id, profile.is_malicious(_vt_url(analysis_id[2:])))
+        body["data"]["attributes"]["status"] = "completed"
+        return web.json_response(body)
+
+    async def vt_file(request: web.Request):
+        file_hash = request.match_info["file_hash"]
+        if profile.is_unknown(file_hash):
+            return web.json_response({"error": {"code": "NotFoundError"}}, status=404)
+        return web.json_response(_vt_object("file", file_hash, profile.is_malicious(file_hash)))
+
+    async def vt_ip(request: web.Request):
+        ip = request.match_info["ip"]
+        return web.json_response(_vt_object("ip_address", ip, profile.is_malicious(ip)))
+
+    async def gsb_find(request: web.Request):
+        data = await request.json()
+        entries = data.get("threatInfo", {}).get("threatEntries", [])
+        matches = [
+            {"threatType": "SOCIAL_ENGINEERING", "platformType": "ANY_PLATFORM",
+             "threatEntryType": "URL", "threat": {"url": entry.get("url", "")}, "cacheDuration": "300s"}
+            for entry in entries if profile.is_malicious(entry.get("url", ""))
+        ]
+        return web.json_response({"matches": matches} if matches else {})
+
+    async def abuseipdb_check(request: web.Request):
+        ip = request.query.get("ipAddress", "")
+        score = 90 if profile.is_malicious(ip) else 0
+        return web.json_response({"data": {"ipAddress": ip, "abuseConfidenceScore": score,
+                                           "totalReports": score // 10, "countryCode": "ZZ"}})
+
+    async def stats(request: web.Request):
+        return web.json_response(profile.stats)
+
+    app = web.Application(middlewares=[latency_and_errors])
+    app.router.add_get("/vt/api/v3/urls/{url_id}", vt_url)
+    app.router.add_post("/vt/api/v3/urls", vt_submit)
+    app.router.add_get("/vt/api/v3/analyses/{analysis_id}", vt_analysis)
+    app.router.add_get("/vt/api/v3/files/{file_hash}", vt_file)
+    app.router.add_get("/vt/api/v3/ip_addresses/{ip}", vt_ip)
+    app.router.add_post("/gsb/v4/threatMatches:find", gsb_find)
+    app.router.add_get("/abuseipdb/api/v2/check", abuseipdb_check)
+    app.router.add_get("/_stats", stats)
+    return app
+
+
+async def start_fake_providers(profile: Profile, host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+    """Запуск заглушек в текущем цикле событий (для использования из других скриптов)."""
+    runner = web.AppRunner(build_app(profile), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def provider_env(host: str = "127.0.0.1", port: int = 9100) -> Dict[str, str]:
+    """Переменные окружения, направляющие сервер на заглушки."""
+    base = f"http://{host}:{port}"
+    return {
+        "VIRUSTOTAL_URL_API": f"{base}/vt/api/v3",
+        "GOOGLE_SAFE_BROWSING_API": f"{base}/gsb/v4",
+        "ABUSEIPDB_API": f"{base}/abuseipdb/api/v2",
+        "VIRUSTOTAL_API_KEY": "fake",
+        "GOOGLE_SAFE_BROWSING_KEY": "fake",
+        "ABUSEIPDB_API_KEY": "fake",
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="средняя задержка ответа")
+    parser.add_argument("--jitter-ms", type=float, default=30.0, help="разброс задержки (+/-)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--malicious-rate", type=float, default=0.02, help="доля опасных вердиктов")
+    parser.add_argument("--unknown-rate", type=float, default=0.1, help="доля URL, неизвестных VirusTotal")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    profile = Profile(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                      ratelimit_rate=args.ratelimit_rate, malicious_rate=args.malicious_rate,
+                      unknown_rate=args.unknown_rate, seed=args.seed)
+    for name, value in provider_env(args.host, args.port).items():
+        print(f"export {name}={value}")
+    print(f"# fake providers on http://{args.host}:{args.port} (counters: /_stats), started {time.strftime('%H:%M:%S')}")
+    web.run_app(build_app(profile), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
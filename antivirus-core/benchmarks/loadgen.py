@@ -0,0 +1,306 @@
+"""
+Нагрузочный тест HTTP и WebSocket API.
+
+Сценарии:
+    url     - POST /check/url: смесь популярных (повторяющихся) и новых URL
+    upload  - POST /check/upload: случайные файлы, часть содержимого повторяется
+    ws      - /ws, сообщения analyze_url по одному на клиента
+    hover   - /ws, всплески по --burst URL сразу (наведение на ссылки страницы)
+
+Внешние API подменяются заглушками benchmarks/fake_providers.py: их можно
+запустить отдельно или прямо здесь (--fake-port), а сервер стартовать с
+переменными окружения, которые печатает fake_providers.py.
+
+Результат (RPS, p50/p90/p99) дописывается в benchmarks/results/loadgen.jsonl
+вместе с ревизией git; --compare сравнивает с предыдущим запуском того же
+сценария и параметров и завершается с кодом 1 при регрессии.
+
+Запуск из каталога antivirus-core:
+    python benchmarks/loadgen.py url --base-url http://127.0.0.1:8000 --concurrency 50 --duration 30 --compare
+    python benchmarks/loadgen.py hover --clients 20 --burst 30 --duration 30 --token $JWT --fake-port 9100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_providers import Profile, start_fake_providers  # noqa: E402
+
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "loadgen.jsonl")
+
+
+class Recorder:
+    """Задержки успешных запросов и счётчик ошибок."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def ok(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+        return {
+            "requests": len(ordered),
+            "errors": sum(self.errors.values()),
+            "error_kinds": self.errors,
+            "seconds": round(elapsed, 2),
+            "rps": round(len(ordered) / elapsed, 1) if elapsed else None,
+            "p50_ms": pct(50),
+            "p90_ms": pct(90),
+            "p99_ms": pct(99),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+        }
+
+
+class UrlPool:
+    """Популярные URL повторяются (кэш), остальные - новые (путь через внешние API)."""
+
+    def __init__(self, new_ratio: float, seed: int = 1):
+        self.new_ratio = new_ratio
+        self.rng = random.Random(seed)
+        self.popular = [f"https://site{i % 40}.example.com/page/{i}" for i in range(200)]
+        self.counter = 0
+
+    def next(self) -> str:
+        if self.rng.random() < self.new_ratio:
+            self.counter += 1
+            host = f"host{self.rng.randint(0, 5000)}.example{self.rng.randint(0, 50)}.org"
+            return f"https://{host}/article/{self.counter}?utm_source=bench&id={self.rng.randint(0, 10 ** 6)}"
+        return self.rng.choice(self.popular)
+
+
+def _headers(args) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+
+def _until(args, deadline: float, issued: List[int]) -> bool:
+    """Продолжать ли: по времени (--duration) или числу запросов (--requests)."""
+    if args.requests:
+        if issued[0] >= args.requests:
+            return False
+        issued[0] += 1
+        return True
+    return time.perf_counter() < deadline
+
+
+async def run_url(args, recorder: Recorder) -> None:
+    pool = UrlPool(args.new_ratio)
+    deadline = time.perf_counter() + args.duration
+    issued = [0]
+    async with aiohttp.ClientSession(headers=_headers(args)) as session:
+        async def worker():
+            while _until(args, deadline, issued):
+                started = time.perf_counter()
+                try:
+                    async with session.post(f"{args.base_url}/check/url", json={"url": pool.next()}) as resp:
+                        await resp.read()
+                        if resp.status == 200:
+                            recorder.ok(time.perf_counter() - started)
+                        else:
+                            recorder.error(f"http_{resp.status}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    recorder.error(type(e).__name__)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def run_upload(args, recorder: Recorder) -> None:
+    rng = random.Random(2)
+    # Повторяющиеся файлы проверяют кэш по хешу содержимого
+    repeated = [os.urandom(args.upload_kb * 1024) for _ in range(10)]
+    deadline = time.perf_counter() + args.duration
+    issued = [0]
+    async with aiohttp.ClientSession(headers=_headers(args)) as session:
+        async def worker():
+            while _until(args, deadline, issued):
+                content = rng.choice(repeated) if rng.random() >= args.new_ratio else os.urandom(args.upload_kb * 1024)
+                form = aiohttp.FormData()
+                form.add_field("file", content, filename="sample.bin", content_type="application/octet-stream")
+                started = time.perf_counter()
+                try:
+                    async with session.post(f"{args.base_url}/check/upload", data=form) as resp:
+                        await resp.read()
+                        if resp.status == 200:
+                            recorder.ok(time.perf_counter() - started)
+                        else:
+                            recorder.error(f"http_{resp.status}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    recorder.error(type(e).__name__)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def run_ws(args, recorder: Recorder, burst: int = 1) -> None:
+    """Каждый клиент отправляет burst сообщений analyze_url и ждёт все analysis_result."""
+    pool = UrlPool(args.new_ratio)
+    deadline = time.perf_counter() + args.duration
+    issued = [0]
+    ws_url = args.base_url.replace("http", "ws", 1) + "/ws" + (f"?token={args.token}" if args.token else "")
+    context = "hover" if args.token and burst > 1 else "generic"
+
+    async with aiohttp.ClientSession() as session:
+        async def client(client_id: int):
+            try:
+                ws = await session.ws_connect(ws_url, heartbeat=30)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                recorder.error(f"connect_{type(e).__name__}")
+                return
+            sequence = 0
+            try:
+                await ws.receive_json(timeout=10)  # hello
+                while _until(args, deadline, issued):
+                    pending: Dict[str, float] = {}
+                    for _ in range(burst):
+                        sequence += 1
+                        request_id = f"{client_id}-{sequence}"
+                        pending[request_id] = time.perf_counter()
+                        await ws.send_json({"type": "analyze_url", "requestId": request_id,
+                                            "payload": {"url": pool.next(), "context": context}})
+                    while pending:
+                        message = await ws.receive_json(timeout=args.timeout)
+                        request_id = message.get("requestId")
+                        if request_id not in pending:
+                            continue
+                        if message.get("type") == "analysis_result":
+                            recorder.ok(time.perf_counter() - pending.pop(request_id))
+                        elif message.get("type") == "error":
+                            pending.pop(request_id)
+                            recorder.error(f"ws_{message.get('code')}")
+                    if args.burst_interval:
+                        await asyncio.sleep(args.burst_interval)
+            except asyncio.TimeoutError:
+                recorder.error("ws_timeout")
+            except (aiohttp.ClientError, TypeError, ValueError) as e:
+                recorder.error(f"ws_{type(e).__name__}")
+            finally:
+                await ws.close()
+
+        await asyncio.gather(*(client(i) for i in range(args.clients)))
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def _params(args) -> Dict[str, Any]:
+    keys = ["scenario", "concurrency", "clients", "burst", "new_ratio", "upload_kb", "duration", "requests"]
+    return {key: getattr(args, key) for key in keys}
+
+
+def _previous(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, encoding="utf-8") as fileobj:
+        for line in fileobj:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("params") == params:
+                previous = record
+    return previous
+
+
+def _compare(current: Dict[str, Any], previous: Dict[str, Any], threshold: float) -> bool:
+    """Печатает изменения относительно предыдущего запуска; True - есть регрессия."""
+    regression = False
+    print(f"\nvs {previous.get('revision') or '?'} ({previous.get('label') or previous.get('timestamp')}):")
+    for key, higher_is_better in (("rps", True), ("p50_ms", False), ("p99_ms", False)):
+        old, new = previous["stats"].get(key), current.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change < -threshold if higher_is_better else change > threshold
+        regression |= worse
+        print(f"  {key:<8} {old:>10} -> {new:<10} {change:+.1%}{'  REGRESSION' if worse else ''}")
+    return regression
+
+
+async def run(args) -> Dict[str, Any]:
+    runner = None
+    if args.fake_port:
+        runner = await start_fake_providers(
+            Profile(latency_ms=args.fake_latency_ms, error_rate=args.fake_error_rate), port=args.fake_port)
+    recorder = Recorder()
+    try:
+        if args.scenario == "url":
+            await run_url(args, recorder)
+        elif args.scenario == "upload":
+            await run_upload(args, recorder)
+        else:
+            await run_ws(args, recorder, burst=args.burst if args.scenario == "hover" else 1)
+    finally:
+        recorder.finished = time.perf_counter()
+        if runner:
+            await runner.cleanup()
+    return recorder.summary()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=["url", "upload", "ws", "hover"])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default=os.getenv("BENCH_TOKEN", ""), help="JWT (нужен для hover-контекста)")
+    parser.add_argument("--concurrency", type=int, default=20, help="параллельные HTTP-запросы")
+    parser.add_argument("--clients", type=int, default=20, help="WebSocket-клиенты")
+    parser.add_argument("--burst", type=int, default=25, help="URL во всплеске (hover)")
+    parser.add_argument("--burst-interval", type=float, default=0.5, help="пауза между всплесками, сек")
+    parser.add_argument("--new-ratio", type=float, default=0.2, help="доля новых URL/файлов (остальные повторяются)")
+    parser.add_argument("--upload-kb", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--requests", type=int, default=0, help="число запросов (для hover - всплесков) вместо --duration")
+    parser.add_argument("--timeout", type=float, default=30.0, help="ожидание ответа WebSocket, сек")
+    parser.add_argument("--fake-port", type=int, default=0, help="запустить заглушки внешних API на этом порту")
+    parser.add_argument("--fake-latency-ms", type=float, default=100.0)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--label", default="", help="метка запуска (например, версия релиза)")
+    parser.add_argument("--compare", action="store_true", help="сравнить с предыдущим запуском")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимое ухудшение для --compare")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run(args))
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+    params = _params(args)
+    previous = _previous(params) if args.compare else None
+    if not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        record = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": _git_revision(),
+                  "label": args.label, "params": params, "stats": stats}
+        with open(RESULTS_FILE, "a", encoding="utf-8") as fileobj:
+            fileobj.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if previous and _compare(stats, previous, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
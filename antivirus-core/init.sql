@@ -70,6 +70,11 @@ CREATE TABLE IF NOT EXISTS malicious_urls (
     detection_count INTEGER DEFAULT 1
 );
 
+-- Выборки по источнику (diff при загрузке фидов) и проверки по домену
+CREATE INDEX IF NOT EXISTS idx_malicious_hashes_source ON malicious_hashes(source);
+CREATE INDEX IF NOT EXISTS idx_malicious_urls_source ON malicious_urls(source);
+CREATE INDEX IF NOT EXISTS idx_malicious_urls_domain ON malicious_urls(domain);
+
 -- 5. Таблица для логов запросов (для аналитики)
 CREATE TABLE IF NOT EXISTS request_logs (
     id SERIAL PRIMARY KEY,
@@ -104,10 +109,30 @@ CREATE TABLE IF NOT EXISTS background_jobs (
     status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'processing', 'completed', 'failed')),
     retry_count INTEGER DEFAULT 0,
     error_message TEXT,
+    priority INTEGER DEFAULT 0,
+    run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    repeat_interval INTEGER DEFAULT NULL,
+    dedup_key TEXT DEFAULT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Одна активная задача на dedup_key; индекс для выборки по приоритету и времени запуска
+CREATE UNIQUE INDEX IF NOT EXISTS idx_background_jobs_dedup
+    ON background_jobs(dedup_key) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_background_jobs_claim
+    ON background_jobs(priority DESC, run_after, created_at) WHERE status = 'pending';
+
+-- Поминутные счетчики запросов к внешним API по всем воркерам (бюджет квоты ревалидации)
+CREATE TABLE IF NOT EXISTS provider_usage (
+    provider TEXT NOT NULL,
+    minute TIMESTAMP NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, minute)
+);
+
+CREATE INDEX IF NOT EXISTS idx_provider_usage_minute ON provider_usage(minute);
+
 -- 8. Таблица для локальной базы доверенных доменов (white-list)
 CREATE TABLE IF NOT EXISTS cached_whitelist (
     domain TEXT PRIMARY KEY,
@@ -115,11 +140,13 @@ CREATE TABLE IF NOT EXISTS cached_whitelist (
     detection_ratio TEXT,
     confidence INTEGER,
     source TEXT DEFAULT 'external_apis',
-    payload TEXT,
+    -- Только поля ответа, которых нет в отдельных колонках (см. migrations/004)
+    payload JSONB,
     first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    revalidated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     hit_count INTEGER DEFAULT 1
-);
+) WITH (fillfactor = 85);
 
 -- 9. Таблица для локальной базы известных угроз (black-list)
 CREATE TABLE IF NOT EXISTS cached_blacklist (
@@ -129,14 +156,86 @@ CREATE TABLE IF NOT EXISTS cached_blacklist (
     threat_type TEXT,
     details TEXT,
     source TEXT DEFAULT 'external_apis',
-    payload TEXT,
+    -- Только поля ответа, которых нет в отдельных колонках (см. migrations/004)
+    payload JSONB,
     first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    revalidated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     hit_count INTEGER DEFAULT 1
-);
+) WITH (fillfactor = 85);
 
 CREATE INDEX IF NOT EXISTS idx_cached_blacklist_domain ON cached_blacklist(domain);
 CREATE INDEX IF NOT EXISTS idx_cached_blacklist_url ON cached_blacklist(url);
+CREATE INDEX IF NOT EXISTS idx_cached_whitelist_revalidated ON cached_whitelist(revalidated_at);
+CREATE INDEX IF NOT EXISTS idx_cached_blacklist_revalidated ON cached_blacklist(revalidated_at);
+
+-- Число записей, хитов и байт whitelist/blacklist, ведется триггерами (шарды против конкуренции за строку)
+CREATE TABLE IF NOT EXISTS cache_stats (
+    store TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    entries BIGINT NOT NULL DEFAULT 0,
+    hits BIGINT NOT NULL DEFAULT 0,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (store, shard)
+);
+
+CREATE OR REPLACE FUNCTION cache_stats_track() RETURNS trigger AS $$
+DECLARE
+    delta_entries BIGINT := 0;
+    delta_hits BIGINT := 0;
+    delta_bytes BIGINT := 0;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM cache_stats WHERE store = TG_ARGV[0];
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        delta_entries := delta_entries + 1;
+        delta_hits := delta_hits + COALESCE(NEW.hit_count, 0);
+        delta_bytes := delta_bytes + pg_column_size(NEW);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        delta_entries := delta_entries - 1;
+        delta_hits := delta_hits - COALESCE(OLD.hit_count, 0);
+        delta_bytes := delta_bytes - pg_column_size(OLD);
+    END IF;
+    INSERT INTO cache_stats (store, shard, entries, hits, bytes)
+    VALUES (TG_ARGV[0], floor(random() * 16)::smallint, delta_entries, delta_hits, delta_bytes)
+    ON CONFLICT (store, shard) DO UPDATE SET
+        entries = cache_stats.entries + EXCLUDED.entries,
+        hits = cache_stats.hits + EXCLUDED.hits,
+        bytes = cache_stats.bytes + EXCLUDED.bytes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cached_whitelist_stats ON cached_whitelist;
+CREATE TRIGGER trg_cached_whitelist_stats
+    AFTER INSERT OR UPDATE OR DELETE ON cached_whitelist
+    FOR EACH ROW EXECUTE FUNCTION cache_stats_track('whitelist');
+DROP TRIGGER IF EXISTS trg_cached_whitelist_stats_truncate ON cached_whitelist;
+CREATE TRIGGER trg_cached_whitelist_stats_truncate
+    AFTER TRUNCATE ON cached_whitelist
+    FOR EACH STATEMENT EXECUTE FUNCTION cache_stats_track('whitelist');
+
+DROP TRIGGER IF EXISTS trg_cached_blacklist_stats ON cached_blacklist;
+CREATE TRIGGER trg_cached_blacklist_stats
+    AFTER INSERT OR UPDATE OR DELETE ON cached_blacklist
+    FOR EACH ROW EXECUTE FUNCTION cache_stats_track('blacklist');
+DROP TRIGGER IF EXISTS trg_cached_blacklist_stats_truncate ON cached_blacklist;
+CREATE TRIGGER trg_cached_blacklist_stats_truncate
+    AFTER TRUNCATE ON cached_blacklist
+    FOR EACH STATEMENT EXECUTE FUNCTION cache_stats_track('blacklist');
+
+-- Список доверенных доменов для быстрого пути проверки URL (дополняет файлы rules/trusted_domains)
+CREATE TABLE IF NOT EXISTS trusted_domains (
+    domain TEXT PRIMARY KEY,
+    include_subdomains BOOLEAN DEFAULT TRUE,
+    source TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_trusted_domains_updated ON trusted_domains(updated_at);
 
 -- 10. Таблица активных сессий (один аккаунт - одна активная сессия)
 CREATE TABLE IF NOT EXISTS active_sessions (
@@ -231,3 +330,11 @@ CREATE INDEX IF NOT EXISTS idx_request_logs_user_id ON request_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_accounts_email ON accounts(email);
 CREATE INDEX IF NOT EXISTS idx_accounts_username ON accounts(username);
 
+
+-- Поиск в админке: подстрока и нечеткие совпадения по триграммам, ранжирование по расстоянию (KNN)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_malicious_urls_url_trgm_gist ON malicious_urls USING gist (url gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_malicious_urls_domain_trgm_gist ON malicious_urls USING gist (domain gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_cached_blacklist_url_trgm_gist ON cached_blacklist USING gist (url gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_cached_blacklist_domain_trgm_gist ON cached_blacklist USING gist (domain gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_cached_whitelist_domain_trgm_gist ON cached_whitelist USING gist (domain gist_trgm_ops);
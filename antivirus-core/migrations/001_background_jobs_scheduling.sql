@@ -0,0 +1,12 @@
+-- Приоритеты, отложенный/периодический запуск и дедупликация фоновых задач
+-- Применение: psql "$DATABASE_URL" -f migrations/001_background_jobs_scheduling.sql
+
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS priority INTEGER DEFAULT 0;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS repeat_interval INTEGER DEFAULT NULL;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS dedup_key TEXT DEFAULT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_background_jobs_dedup
+    ON background_jobs(dedup_key) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_background_jobs_claim
+    ON background_jobs(priority DESC, run_after, created_at) WHERE status = 'pending';
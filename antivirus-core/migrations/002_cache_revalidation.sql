@@ -0,0 +1,15 @@
+-- Время последней перепроверки записей локального кэша (для фоновой ревалидации)
+-- Применение: psql "$DATABASE_URL" -f migrations/002_cache_revalidation.sql
+
+ALTER TABLE cached_whitelist ADD COLUMN IF NOT EXISTS revalidated_at TIMESTAMP;
+ALTER TABLE cached_blacklist ADD COLUMN IF NOT EXISTS revalidated_at TIMESTAMP;
+
+-- Для существующих записей время проверки неизвестно - берём время создания
+UPDATE cached_whitelist SET revalidated_at = first_seen WHERE revalidated_at IS NULL;
+UPDATE cached_blacklist SET revalidated_at = first_seen WHERE revalidated_at IS NULL;
+
+ALTER TABLE cached_whitelist ALTER COLUMN revalidated_at SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE cached_blacklist ALTER COLUMN revalidated_at SET DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_cached_whitelist_revalidated ON cached_whitelist(revalidated_at);
+CREATE INDEX IF NOT EXISTS idx_cached_blacklist_revalidated ON cached_blacklist(revalidated_at);
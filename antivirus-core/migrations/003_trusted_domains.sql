@@ -0,0 +1,11 @@
+-- Список доверенных доменов для быстрого пути проверки URL (дополняет файлы rules/trusted_domains)
+-- Применение: psql "$DATABASE_URL" -f migrations/003_trusted_domains.sql
+
+CREATE TABLE IF NOT EXISTS trusted_domains (
+    domain TEXT PRIMARY KEY,
+    include_subdomains BOOLEAN DEFAULT TRUE,
+    source TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_trusted_domains_updated ON trusted_domains(updated_at);
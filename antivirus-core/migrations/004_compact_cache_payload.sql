@@ -0,0 +1,108 @@
+-- Компактное хранение локального кэша вердиктов и счетчики размера без полного прохода по таблицам
+-- Применение: psql "$DATABASE_URL" -f migrations/004_compact_cache_payload.sql
+--
+-- payload: TEXT с полным ответом -> JSONB только с полями, которых нет в отдельных колонках
+-- (safe, details, detection_ratio, confidence, threat_type, source восстанавливаются из колонок).
+-- cache_stats: число записей, хитов и байт по таблице, ведется триггерами; строки разбиты
+-- на 16 шардов, чтобы параллельные обновления hit_count не упирались в одну строку.
+
+BEGIN;
+
+-- Повторный запуск безопасен: колонки, уже переведенные в JSONB, не трогаем
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'cached_whitelist'
+                 AND column_name = 'payload' AND data_type <> 'jsonb') THEN
+        ALTER TABLE cached_whitelist ALTER COLUMN payload TYPE JSONB USING (
+            CASE WHEN payload IS NULL OR payload = '' THEN NULL
+                 ELSE NULLIF(payload::jsonb - 'safe' - 'details' - 'detection_ratio' - 'confidence' - 'source', '{}'::jsonb)
+            END
+        );
+    END IF;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'cached_blacklist'
+                 AND column_name = 'payload' AND data_type <> 'jsonb') THEN
+        ALTER TABLE cached_blacklist ALTER COLUMN payload TYPE JSONB USING (
+            CASE WHEN payload IS NULL OR payload = '' THEN NULL
+                 ELSE NULLIF(payload::jsonb - 'safe' - 'details' - 'threat_type' - 'source', '{}'::jsonb)
+            END
+        );
+    END IF;
+END $$;
+
+-- Запас места на страницах: обновления hit_count/last_seen остаются HOT и не раздувают индексы
+ALTER TABLE cached_whitelist SET (fillfactor = 85);
+ALTER TABLE cached_blacklist SET (fillfactor = 85);
+
+CREATE TABLE IF NOT EXISTS cache_stats (
+    store TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    entries BIGINT NOT NULL DEFAULT 0,
+    hits BIGINT NOT NULL DEFAULT 0,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (store, shard)
+);
+
+CREATE OR REPLACE FUNCTION cache_stats_track() RETURNS trigger AS $$
+DECLARE
+    delta_entries BIGINT := 0;
+    delta_hits BIGINT := 0;
+    delta_bytes BIGINT := 0;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM cache_stats WHERE store = TG_ARGV[0];
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        delta_entries := delta_entries + 1;
+        delta_hits := delta_hits + COALESCE(NEW.hit_count, 0);
+        delta_bytes := delta_bytes + pg_column_size(NEW);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        delta_entries := delta_entries - 1;
+        delta_hits := delta_hits - COALESCE(OLD.hit_count, 0);
+        delta_bytes := delta_bytes - pg_column_size(OLD);
+    END IF;
+    INSERT INTO cache_stats (store, shard, entries, hits, bytes)
+    VALUES (TG_ARGV[0], floor(random() * 16)::smallint, delta_entries, delta_hits, delta_bytes)
+    ON CONFLICT (store, shard) DO UPDATE SET
+        entries = cache_stats.entries + EXCLUDED.entries,
+        hits = cache_stats.hits + EXCLUDED.hits,
+        bytes = cache_stats.bytes + EXCLUDED.bytes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cached_whitelist_stats ON cached_whitelist;
+CREATE TRIGGER trg_cached_whitelist_stats
+    AFTER INSERT OR UPDATE OR DELETE ON cached_whitelist
+    FOR EACH ROW EXECUTE FUNCTION cache_stats_track('whitelist');
+DROP TRIGGER IF EXISTS trg_cached_whitelist_stats_truncate ON cached_whitelist;
+CREATE TRIGGER trg_cached_whitelist_stats_truncate
+    AFTER TRUNCATE ON cached_whitelist
+    FOR EACH STATEMENT EXECUTE FUNCTION cache_stats_track('whitelist');
+
+DROP TRIGGER IF EXISTS trg_cached_blacklist_stats ON cached_blacklist;
+CREATE TRIGGER trg_cached_blacklist_stats
+    AFTER INSERT OR UPDATE OR DELETE ON cached_blacklist
+    FOR EACH ROW EXECUTE FUNCTION cache_stats_track('blacklist');
+DROP TRIGGER IF EXISTS trg_cached_blacklist_stats_truncate ON cached_blacklist;
+CREATE TRIGGER trg_cached_blacklist_stats_truncate
+    AFTER TRUNCATE ON cached_blacklist
+    FOR EACH STATEMENT EXECUTE FUNCTION cache_stats_track('blacklist');
+
+-- Начальные значения по существующим записям
+DELETE FROM cache_stats;
+INSERT INTO cache_stats (store, shard, entries, hits, bytes)
+SELECT 'whitelist', 0, COUNT(*), COALESCE(SUM(hit_count), 0), COALESCE(SUM(pg_column_size(t)), 0)
+FROM cached_whitelist t;
+INSERT INTO cache_stats (store, shard, entries, hits, bytes)
+SELECT 'blacklist', 0, COUNT(*), COALESCE(SUM(hit_count), 0), COALESCE(SUM(pg_column_size(t)), 0)
+FROM cached_blacklist t;
+
+COMMIT;
+
+-- Переписанные строки освобождают место от прежних TEXT-payload
+VACUUM (ANALYZE) cached_whitelist;
+VACUUM (ANALYZE) cached_blacklist;
@@ -0,0 +1,10 @@
+-- Индексы для массовой загрузки фидов угроз и проверок по домену
+-- Применение: psql "$DATABASE_URL" -f migrations/005_threat_feed_indexes.sql
+--
+-- source: удаление исчезнувших из фида записей (source = 'feed:<имя>') без прохода по всей таблице.
+-- domain: check_domain на миллионах URL из фидов.
+-- CONCURRENTLY - без блокировки записи в таблицы, поэтому вне транзакции.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_malicious_hashes_source ON malicious_hashes(source);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_malicious_urls_source ON malicious_urls(source);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_malicious_urls_domain ON malicious_urls(domain);
@@ -0,0 +1,22 @@
+-- Триграммные GiST-индексы для поиска URL/доменов в админке (LIKE '%...%', оператор % и ORDER BY <-> pg_trgm)
+-- Применение: psql "$DATABASE_URL" -f migrations/006_search_trgm_indexes.sql
+--
+-- Те же индексы создает db_manager.ensure_search_indexes при старте (SEARCH_ENSURE_INDEXES);
+-- миграция нужна, если у пользователя приложения нет прав на CREATE EXTENSION.
+-- GiST, а не GIN: поиск выбирает ближайшие строки обходом индекса по расстоянию (KNN)
+-- вместо сортировки всех совпадений. Прежние GIN-индексы *_trgm удаляются.
+-- CONCURRENTLY - без блокировки записи в таблицы, поэтому вне транзакции.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_malicious_urls_url_trgm;
+DROP INDEX CONCURRENTLY IF EXISTS idx_malicious_urls_domain_trgm;
+DROP INDEX CONCURRENTLY IF EXISTS idx_cached_blacklist_url_trgm;
+DROP INDEX CONCURRENTLY IF EXISTS idx_cached_blacklist_domain_trgm;
+DROP INDEX CONCURRENTLY IF EXISTS idx_cached_whitelist_domain_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_malicious_urls_url_trgm_gist ON malicious_urls USING gist (url gist_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_malicious_urls_domain_trgm_gist ON malicious_urls USING gist (domain gist_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cached_blacklist_url_trgm_gist ON cached_blacklist USING gist (url gist_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cached_blacklist_domain_trgm_gist ON cached_blacklist USING gist (domain gist_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cached_whitelist_domain_trgm_gist ON cached_whitelist USING gist (domain gist_trgm_ops);
@@ -0,0 +1,14 @@
+-- Поминутные счетчики запросов к внешним API, общие для всех воркеров
+-- Применение: psql "$DATABASE_URL" -f migrations/007_provider_usage.sql
+--
+-- Каждый воркер добавляет свои запросы к провайдерам (и перепроверки кэша - provider
+-- 'cache_revalidation'); бюджет ревалидации считается по сумме за последний час.
+
+CREATE TABLE IF NOT EXISTS provider_usage (
+    provider TEXT NOT NULL,
+    minute TIMESTAMP NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, minute)
+);
+
+CREATE INDEX IF NOT EXISTS idx_provider_usage_minute ON provider_usage(minute);